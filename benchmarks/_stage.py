@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Run one pipeline stage with per-unit timing; used by run_benchmarks.py.
+
+Usage: python benchmarks/_stage.py {scrape,enrich,feed} RESULT_JSON [feed args...]
+
+The stage is configured through the environment exactly as in production.
+The function handling one unit of work (a listing page, a book, an
+enclosure probe) is wrapped to record its latency, then the stage's
+``main()`` runs unchanged.
+"""
+import functools, importlib.util, json, pathlib, sys, threading, time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+def _load(name, path):
+    spec = importlib.util.spec_from_file_location(name, ROOT / path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+def _timed(fn, latencies, lock):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+    return wrapper
+
+def _count_csv_rows(path):
+    with open(path, encoding="utf-8-sig") as f:
+        return max(0, sum(1 for _ in f) - 1)
+
+def main():
+    stage, result_path, extra = sys.argv[1], sys.argv[2], sys.argv[3:]
+    latencies, lock = [], threading.Lock()
+    start = time.perf_counter()
+    if stage == "scrape":
+        mod = _load("scrape", "scrape_iranseda_env.py")
+        mod.fetch_page = _timed(mod.fetch_page, latencies, lock)
+        mod.main()
+        units = _count_csv_rows(mod.OUTPUT_FILE)
+    elif stage == "enrich":
+        mod = _load("enrich", "script_iran_seda_final_STREAM_MERGE_v6_env.py")
+        mod._enrich_row = _timed(mod._enrich_row, latencies, lock)
+        mod.main()
+        units = _count_csv_rows(mod.OUT_CSV)
+    elif stage == "feed":
+        from tools import csv_to_podcast as mod
+        mod.fetch_audio_length = _timed(mod.fetch_audio_length, latencies, lock)
+        mod.main(extra)
+        out = mod.output_path(mod.build_parser().parse_args(extra))
+        with open(out, encoding="utf-8") as f:
+            units = sum(1 for line in f if line.strip() == "<item>")
+    else:
+        raise SystemExit(f"unknown stage {stage}")
+    wall = time.perf_counter() - start
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump({"units": units, "seconds": wall, "latencies": latencies}, f)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark for the ``parse_page`` backends.
+
+Usage: python benchmarks/bench_parse_page.py [--pages N] [--html FILE]
+
+Without ``--html`` a synthetic Details page of realistic size (navigation,
+inline scripts, metadata lists, related-book grid) is used.  ``legacy`` is
+the previous implementation: a full html.parser tree plus one rescan per
+metadata label.
+"""
+import argparse, importlib.util, pathlib, sys, time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+_spec = importlib.util.spec_from_file_location("enrich", ROOT / "script_iran_seda_final_STREAM_MERGE_v6_env.py")
+enrich = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(enrich)
+
+URL = "https://book.iranseda.ir/DetailsAlbum/?VALID=TRUE&g=674800"
+
+def synthetic_page():
+    nav = "".join(f'<li><a href="/taglist/?t={i}">دسته {i}</a></li>' for i in range(120))
+    scripts = "".join(f"<script>var cfg{i} = {{a: '{'x' * 400}'}};</script>" for i in range(15))
+    related = "".join(
+        f'<div class="book-card"><a href="/DetailsAlbum/?VALID=TRUE&g={i}">'
+        f'<img src="https://player.iranseda.ir/picture?AttID={i}&s=c"/><span>کتاب {i}</span></a></div>'
+        for i in range(60)
+    )
+    meta = "".join(
+        f"<li><dt>{label}</dt><dd>مقدار {label}</dd></li>" for _, label in enrich.METADATA_LABELS
+    )
+    return f"""<html><head><meta property="og:image" content="https://player.iranseda.ir/picture?AttID=521584&s=c"/>
+    {scripts}<style>{'.c{{color:red}}' * 300}</style></head><body>
+    <header><nav><ul>{nav}</ul></nav></header>
+    <div class="container"><h1>بیست هزار فرسنگ زیر دریا</h1>
+    <div class="short-description">{'خلاصه ' * 80}</div>
+    <div class="full-description">{'<p>متن کامل معرفی کتاب</p>' * 40}</div>
+    <ul class="item-info"><li><span>مدت زمان:</span> 02:10:00</li><li><span>تعداد قسمت:</span> 8</li></ul>
+    <ul class="metadata-list">{meta}</ul>
+    <div class="related">{related}</div></div>
+    <footer>{'<p>پانویس</p>' * 50}</footer></body></html>"""
+
+def legacy_parse(html, url):
+    soup = enrich.BeautifulSoup(html, "html.parser")
+    out = {key: enrich.parse_from_metadata_list(soup, label) for key, label in enrich.METADATA_LABELS}
+    out["duration"], out["episodes"] = enrich.parse_duration_and_episodes(soup)
+    out["attid"] = enrich.extract_attid(soup)
+    out["cover"] = enrich.get_og_image(soup) or enrich.find_first_image_src(soup)
+    return out
+
+def bench(fn, html, pages):
+    fn(html)  # warm-up
+    start = time.perf_counter()
+    for _ in range(pages):
+        fn(html)
+    return pages / (time.perf_counter() - start)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, default=200)
+    ap.add_argument("--html", help="Recorded Details page to parse instead of the synthetic one")
+    args = ap.parse_args()
+    html = pathlib.Path(args.html).read_text(encoding="utf-8") if args.html else synthetic_page()
+
+    print(f"page size: {len(html.encode('utf-8')) / 1024:.1f} KiB, fast parser: {enrich._FAST_FEATURES}")
+    results = {
+        "legacy": bench(lambda h: legacy_parse(h, URL), html, args.pages),
+        "bs4": bench(lambda h: enrich.parse_page(h, URL, backend="bs4"), html, args.pages),
+        "fast": bench(lambda h: enrich.parse_page(h, URL, backend="fast"), html, args.pages),
+    }
+    base = results["legacy"]
+    for name, pps in results.items():
+        print(f"{name:>7}: {pps:8.1f} pages/s  ({pps / base:.2f}x)")
+
+if __name__ == "__main__":
+    main()
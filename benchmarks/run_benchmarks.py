@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Offline throughput/latency benchmarks for the three pipeline stages.
+
+Usage:
+    python benchmarks/run_benchmarks.py                      # 100, 1000 and 10000 books
+    python benchmarks/run_benchmarks.py --sizes 100 --check  # enforce thresholds.json
+
+A local :class:`stub_server.StubServer` serves listing pages, Details pages,
+apisec JSON and MP3 HEAD responses, so nothing leaves the machine.  Each
+stage runs in its own process against a fresh ``RUNS_DIR`` with the HTTP
+and enclosure caches disabled, chained exactly like the workflow:
+``scrape_iranseda_env.py`` -> enrichment ``main()`` -> ``csv_to_podcast.main()``
+(with ``--verify-sample 1``, so every enclosure is probed).
+
+For every stage and size the JSON report holds the units processed (books
+or feed items), wall time, throughput (units/s) and p50/p95 latency of one
+unit of work (a listing page, a book, an enclosure probe).
+"""
+import argparse, json, os, pathlib, platform, subprocess, sys, tempfile, time
+
+HERE = pathlib.Path(__file__).resolve().parent
+ROOT = HERE.parent
+sys.path.insert(0, str(HERE))
+from stub_server import StubServer
+
+STAGES = ("scrape", "enrich", "feed")
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values`` (``0.0`` when empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def run_stage(stage, env, workdir, extra=()):
+    result = pathlib.Path(workdir) / f"{stage}.json"
+    cmd = [sys.executable, str(HERE / "_stage.py"), stage, str(result), *extra]
+    proc = subprocess.run(cmd, env=env, cwd=workdir, capture_output=True, text=True)
+    if proc.returncode:
+        raise RuntimeError(f"{stage} failed:\n{proc.stdout[-2000:]}\n{proc.stderr[-2000:]}")
+    data = json.loads(result.read_text(encoding="utf-8"))
+    lat = data.pop("latencies")
+    data.update(
+        throughput=data["units"] / data["seconds"] if data["seconds"] else 0.0,
+        p50_ms=percentile(lat, 50) * 1000,
+        p95_ms=percentile(lat, 95) * 1000,
+        samples=len(lat),
+    )
+    return data
+
+def bench_size(books, args):
+    results = {}
+    with StubServer(books=books, latency=args.latency_ms / 1000, error_rate=args.error_rate) as stub, \
+            tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        runs_dir = pathlib.Path(workdir) / "runs"
+        env = dict(
+            os.environ,
+            PYTHONPATH=str(ROOT),
+            RUN_NAME="bench",
+            RUNS_DIR=str(runs_dir),
+            SOURCE_URL=stub.source_url,
+            START_PAGE="1",
+            END_PAGE="auto",
+            SCRAPE_WORKERS=str(args.workers),
+            ENRICH_WORKERS=str(args.workers),
+            API_DETAILS_URL=stub.api_url,
+            HTTP_CACHE="off",
+            MAX_RPS_PER_HOST="0",
+            HTTP_RETRIES="4",
+            RESUME="0",
+        )
+        merged = runs_dir / "bench" / "merged" / "books_with_attid_bench.csv"
+        feed_args = ["--csv", str(merged), "--out", str(pathlib.Path(workdir) / "podcast.xml"),
+                     "--site", "https://example.invalid", "--run-name", "bench", "--no-cache",
+                     "--probe-workers", str(args.workers * 2),
+                     # The stub API reports file sizes, which the feed trusts; probe
+                     # every enclosure anyway so the feed timings measure real work.
+                     "--verify-sample", "1"]
+        for stage in STAGES:
+            before = stub.requests
+            results[stage] = run_stage(stage, env, workdir, feed_args if stage == "feed" else ())
+            results[stage]["requests"] = stub.requests - before
+            print(f"  {stage:>6} {books:>6} books: {results[stage]['units']:>6} units "
+                  f"{results[stage]['throughput']:8.1f}/s  p50 {results[stage]['p50_ms']:7.1f} ms  "
+                  f"p95 {results[stage]['p95_ms']:7.1f} ms")
+    return results
+
+def check_thresholds(report, thresholds):
+    """Return a list of human-readable threshold violations."""
+    problems = []
+    for stage, by_size in thresholds.items():
+        for size, limits in by_size.items():
+            res = report["results"].get(stage, {}).get(size)
+            if res is None:
+                continue
+            if "min_units" in limits and res["units"] < limits["min_units"]:
+                problems.append(f"{stage}@{size}: units {res['units']} < {limits['min_units']}")
+            if "min_throughput" in limits and res["throughput"] < limits["min_throughput"]:
+                problems.append(f"{stage}@{size}: throughput {res['throughput']:.1f}/s < {limits['min_throughput']}/s")
+            if "max_p95_ms" in limits and res["p95_ms"] > limits["max_p95_ms"]:
+                problems.append(f"{stage}@{size}: p95 {res['p95_ms']:.1f} ms > {limits['max_p95_ms']} ms")
+    return problems
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--latency-ms", type=float, default=5.0, help="Mean stub latency per request")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--thresholds", default=str(HERE / "thresholds.json"))
+    ap.add_argument("--check", action="store_true", help="Exit non-zero when a threshold is violated")
+    args = ap.parse_args()
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "workers": args.workers,
+            "latency_ms": args.latency_ms,
+            "error_rate": args.error_rate,
+        },
+        "results": {stage: {} for stage in STAGES},
+    }
+    for books in args.sizes:
+        print(f"[bench] {books} books")
+        for stage, res in bench_size(books, args).items():
+            report["results"][stage][str(books)] = res
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print("Wrote:", args.out)
+
+    if args.check:
+        with open(args.thresholds, encoding="utf-8") as f:
+            problems = check_thresholds(report, json.load(f))
+        for p in problems:
+            print("REGRESSION:", p)
+        if problems:
+            sys.exit(1)
+        print("All thresholds met.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for book.iranseda.ir, apisec.iranseda.ir and player.iranseda.ir.
+
+Responses are rendered from the templates in ``benchmarks/fixtures`` for a
+catalog of ``books`` synthetic books:
+
+* ``/taglist/?pn=N``                 listing page N (``per_page`` books, empty past the end)
+* ``/DetailsAlbum/?VALID=TRUE&g=ID`` Details page of book ID
+* ``/book/Details/?g=ID&attid=A``    apisec Details JSON with three MP3 downloads
+* ``/downloadfile/?attid=A``         MP3 enclosure headers (HEAD), or its first bytes
+                                     for a ``Range`` GET: an ID3v2 tag and CBR frames
+                                     with an Info/LAME header (bitrate by ``A % 10``)
+
+Every response waits ``latency`` seconds (with +/-50% jitter) and a fraction
+``error_rate`` of requests answers ``503`` to exercise the retry paths.
+
+Run standalone with ``python benchmarks/stub_server.py --books 1000``.
+"""
+import argparse, pathlib, random, re, struct, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FIXTURES = pathlib.Path(__file__).resolve().parent / "fixtures"
+FIRST_ID = 700000
+ATTID_OFFSET = 300000
+MP3_LENGTH = 22998033
+# kbps of /downloadfile/?attid=A by A % 10 (the API fixture's three files end in 1, 2, 3)
+MP3_BITRATES = {1: 128, 2: 64, 3: 96}
+_BITRATE_INDEX = {32: 1, 40: 2, 48: 3, 56: 4, 64: 5, 80: 6, 96: 7, 112: 8, 128: 9, 160: 10, 192: 11, 256: 13, 320: 14}
+
+def mp3_prefix(bitrate, length=MP3_LENGTH, size=32 * 1024):
+    """First ``size`` bytes of a ``length``-byte 44.1 kHz stereo CBR MP3."""
+    tag_size = 2038
+    tag = b"ID3\x03\x00\x00" + bytes((tag_size >> s) & 0x7F for s in (21, 14, 7, 0)) + bytes(tag_size)
+    header = bytes((0xFF, 0xFB, _BITRATE_INDEX[bitrate] << 4, 0x00))
+    frame_len = 144 * bitrate * 1000 // 44100
+    audio = length - len(tag)
+    info = (b"Info" + struct.pack(">III", 0x0F, audio // frame_len, audio) + bytes(100)
+            + struct.pack(">I", 0) + b"LAME3.100")
+    first = (header + bytes(32) + info).ljust(frame_len, b"\x00")
+    frame = header.ljust(frame_len, b"\x00")
+    data = tag + first
+    while len(data) < size:
+        data += frame
+    return data[:size]
+
+def _fill(template, **values):
+    for key, val in values.items():
+        template = template.replace("{{" + key + "}}", str(val))
+    return template
+
+class StubServer:
+    def __init__(self, books=100, per_page=20, latency=0.0, error_rate=0.0, host="127.0.0.1", port=0, seed=1):
+        self.books = books
+        self.per_page = per_page
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.templates = {p.stem + p.suffix: p.read_text(encoding="utf-8") for p in FIXTURES.iterdir()}
+        self.requests = 0
+        self.range_requests = 0
+        self.errors = 0
+        self._count_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.base = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    # -- URL helpers used by the benchmark runner -------------------------
+    @property
+    def source_url(self):
+        return self.base + "/taglist/?VALID=TRUE&t=bench&pn={}"
+
+    @property
+    def api_url(self):
+        return self.base + "/book/Details/?VALID=TRUE&g={g}&attid={attid}"
+
+    # -- lifecycle --------------------------------------------------------
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    # -- responses ----------------------------------------------------------
+    def _delay_and_fail(self):
+        with self._random_lock:
+            jitter = self._random.uniform(0.5, 1.5)
+            fail = self._random.random() < self.error_rate
+        with self._count_lock:
+            self.requests += 1
+            self.errors += fail
+        if self.latency:
+            time.sleep(self.latency * jitter)
+        return fail
+
+    def render(self, path, query):
+        """Return ``(status, content_type, body_bytes)`` for a request."""
+        q = {k: v[0] for k, v in parse_qs(query).items()}
+        if path.startswith("/taglist"):
+            page = int(q.get("pn", "1"))
+            start = (page - 1) * self.per_page
+            ids = range(FIRST_ID + start, FIRST_ID + min(self.books, start + self.per_page))
+            items = "".join(
+                _fill(self.templates["taglist_item.html"], BASE=self.base, ID=i, ATTID=i - ATTID_OFFSET) for i in ids
+            )
+            html = _fill(self.templates["taglist.html"], BOOKS=items, PAGER=page)
+            return 200, "text/html; charset=utf-8", html.encode("utf-8")
+        if path.startswith("/DetailsAlbum") or path.startswith("/Details"):
+            g = int(q.get("g", FIRST_ID))
+            html = _fill(self.templates["details.html"], BASE=self.base, ID=g, ATTID=g - ATTID_OFFSET)
+            return 200, "text/html; charset=utf-8", html.encode("utf-8")
+        if path.startswith("/book/Details"):
+            g = int(q.get("g", FIRST_ID))
+            body = _fill(self.templates["api_details.json"], BASE=self.base, ID=g,
+                         FILE1=g * 10 + 1, FILE2=g * 10 + 2, FILE3=g * 10 + 3)
+            return 200, "application/json; charset=utf-8", body.encode("utf-8")
+        if path.startswith("/downloadfile"):
+            return 200, "audio/mpeg", None
+        if path.startswith("/picture"):
+            return 200, "image/jpeg", b"\xff\xd8\xff\xd9"
+        return 404, "text/plain", b"not found"
+
+    def _handler(server):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Without TCP_NODELAY every keep-alive request stalls ~40 ms on
+            # Nagle + delayed ACK, which would dominate the measured latency.
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _respond(self, send_body):
+                url = urlparse(self.path)
+                if server._delay_and_fail():
+                    status, ctype, body = 503, "text/plain", b"injected error"
+                else:
+                    status, ctype, body = server.render(url.path, url.query)
+                rng = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+                if body is None and send_body and rng:
+                    # Only the first KB of an enclosure are served, for header probes.
+                    with server._count_lock:
+                        server.range_requests += 1
+                    attid = int(parse_qs(url.query).get("attid", ["1"])[0])
+                    start, end = int(rng.group(1)), int(rng.group(2))
+                    body = mp3_prefix(MP3_BITRATES.get(attid % 10, 128))[start:end + 1]
+                    self.send_response(206)
+                    self.send_header("Content-Type", ctype)
+                    self.send_header("Content-Range", f"bytes {start}-{start + len(body) - 1}/{MP3_LENGTH}")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if body is None and send_body:
+                    # Full enclosure bodies are not served; the stages only probe headers.
+                    status, ctype, body = 405, "text/plain", b"HEAD only"
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                if body is None:
+                    self.send_header("Content-Length", str(MP3_LENGTH))
+                    self.send_header("Accept-Ranges", "bytes")
+                    self.end_headers()
+                    return
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond(True)
+
+            def do_HEAD(self):
+                self._respond(False)
+
+        return Handler
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--books", type=int, default=100)
+    ap.add_argument("--per-page", type=int, default=20)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args()
+    stub = StubServer(books=args.books, per_page=args.per_page, latency=args.latency_ms / 1000,
+                      error_rate=args.error_rate, port=args.port)
+    print("Serving", stub.base)
+    print("  SOURCE_URL=" + stub.source_url)
+    print("  API_DETAILS_URL=" + stub.api_url)
+    try:
+        stub.httpd.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Scrape, enrich and build the feed in one process with overlapping stages.
+
+Usage:
+    RUN_NAME=... SOURCE_URL=... END_PAGE=auto \
+        python pipeline.py --site https://<user>.github.io/<repo> [csv_to_podcast options]
+
+The stages are connected by bounded queues (``PIPELINE_QUEUE`` items each):
+
+    crawl listing pages -> enrich books -> probe enclosures -> write podcast.xml
+
+so books are enriched while later listing pages are still being crawled and
+each enclosure is probed as soon as its book is enriched.  The raw, merged
+and errors CSVs (and the checkpoint journal) are still written exactly as the
+standalone scripts write them, so every other tool keeps working, and the
+usual environment variables (``SCRAPE_WORKERS``, ``ENRICH_WORKERS``,
+``ENRICH_MODE``, ``RESUME``, ...) apply.  The feed options are those of
+``tools/csv_to_podcast.py``; ``--csv`` defaults to the run's merged CSV.
+"""
+import os, queue, sys, threading, time
+
+PIPELINE_QUEUE = max(1, int(os.getenv("PIPELINE_QUEUE", "256") or "256"))
+
+_DONE = object()
+
+class _Failed:
+    def __init__(self, exc):
+        self.exc = exc
+
+def _pump(source, q, stop, name, timings):
+    """Move items from ``source`` into ``q`` until exhausted, failed or stopped.
+
+    The queue always ends with ``_DONE`` (or ``_Failed``), so whoever drains
+    it never blocks on a stage that has gone away.
+    """
+    start = time.perf_counter()
+    end = _DONE
+    try:
+        for item in source:
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                getattr(source, "close", lambda: None)()
+                return
+    except BaseException as e:
+        end = _Failed(e)
+    finally:
+        timings[name] = time.perf_counter() - start
+        _put_end(q, end, stop)
+
+def _put_end(q, end, stop):
+    """Enqueue the end marker; once stopped, make room by dropping queued items."""
+    if not stop.is_set():
+        q.put(end)
+        return
+    while True:
+        try:
+            q.put_nowait(end)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+def _drain(q):
+    """Yield the items a :func:`_pump` puts into ``q``, re-raising its failure."""
+    while True:
+        item = q.get()
+        if item is _DONE:
+            return
+        if isinstance(item, _Failed):
+            raise item.exc
+        yield item
+
+def _start(source, name, stop, timings):
+    q = queue.Queue(maxsize=PIPELINE_QUEUE)
+    t = threading.Thread(target=_pump, args=(source, q, stop, name, timings), name=name, daemon=True)
+    t.start()
+    return q, t
+
+def _record_order(rows, order):
+    """Pass ``rows`` through, appending each crawled AudioBook_ID to ``order``."""
+    for row in rows:
+        order.append(str(row["AudioBook_ID"]))
+        yield row
+
+def _in_crawl_order(earlier, enriched, order):
+    """Merge the resumed ``earlier`` rows into the ``enriched`` stream by crawl position.
+
+    ``order`` is filled by :func:`_record_order` while the crawl proceeds;
+    an earlier book is yielded as soon as the stream has passed its
+    position.  Earlier books the crawl did not list follow at the end.
+    """
+    pending = {str(r["AudioBook_ID"]): r for r in earlier}
+    position, indexed, done = {}, 0, 0
+
+    def _upto(end):
+        nonlocal done
+        while done < end:
+            bid = order[done]
+            done += 1
+            if bid in pending:
+                yield pending.pop(bid)
+
+    for row in enriched:
+        while indexed < len(order):
+            position.setdefault(order[indexed], indexed)
+            indexed += 1
+        yield from _upto(position.get(str(row.get("AudioBook_ID")), done))
+        yield row
+    yield from _upto(len(order))
+    yield from pending.values()
+
+def main(argv=None):
+    # Only the feed tool is needed to parse the command line; the other
+    # stage modules (bs4, the catalog, ...) and Pillow (--covers-dir) are
+    # imported once it is known to be valid.
+    from tools import csv_to_podcast as feeds
+    argv = list(sys.argv[1:] if argv is None else argv)
+    args = feeds.build_parser().parse_args(argv)
+
+    import scrape_iranseda_env as scrape
+    import script_iran_seda_final_STREAM_MERGE_v6_env as enrich
+    from tools import metrics
+    from tools.http_client import default_client
+
+    args.csv = args.csv or enrich.OUT_CSV
+    run_dir = os.path.dirname(enrich.CHECKPOINT)
+    stop = threading.Event()
+    timings = {}
+    with metrics.stage_run("pipeline", run_dir):
+        # Decide what to resume before the merged CSV starts growing; rows
+        # enriched by earlier runs go into the feed at their crawl position.
+        keep = enrich.resume_filter()
+        earlier = enrich.read_csv_rows(enrich.OUT_CSV)
+        if earlier:
+            print(f"[pipeline] resuming after {len(earlier)} enriched books")
+
+        books = ({"AudioBook_ID": bid, "URL": url} for bid, url in scrape.scrape_books())
+        books_q, crawler = _start(books, "scrape", stop, timings)
+        crawled = []
+        enriched = enrich.enrich_rows(row for row in _record_order(_drain(books_q), crawled) if keep(row))
+        rows_q, enricher = _start(enriched, "enrich", stop, timings)
+
+        cache = feeds.open_cache(args)
+        catalog = feeds.open_catalog(args)
+        start = time.perf_counter()
+        try:
+            rows = _in_crawl_order(earlier, _drain(rows_q), crawled)
+            out_file = feeds.build_feed(args, cache=cache, client=default_client(), rows=rows, catalog=catalog)
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            timings["feed"] = time.perf_counter() - start
+            if cache:
+                cache.close()
+            if catalog:
+                catalog.close()
+        crawler.join()
+        enricher.join()
+        enrich.close_catalog()
+        enrich.close_mp3_headers()
+        for name, seconds in timings.items():
+            metrics.set_gauge("pipeline_stage_seconds", seconds, stage=name)
+        enrich.finish_outputs()
+    print("✓ Wrote:", enrich.OUT_CSV)
+    print("Wrote:", out_file)
+
+if __name__ == "__main__":
+    main()
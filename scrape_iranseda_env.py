@@ -1,52 +1,184 @@
 # -*- coding: utf-8 -*-
-import os, csv, re, time, random
+import os, csv, re, itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
 import requests
 from bs4 import BeautifulSoup
+from tools import metrics
+from tools.catalog import Catalog
+from tools.http_cache import cached_get
 
 RUN_NAME = os.getenv("RUN_NAME", "latest")
 RUNS_DIR = os.getenv("RUNS_DIR", "runs")
 SOURCE_URL = os.getenv("SOURCE_URL", "https://book.iranseda.ir/taglist/?VALID=TRUE&t=%D8%A2%D8%AF%D8%A7%D8%A8%20%D9%88%20%D8%B1%D8%B3%D9%88%D9%85&pn={}").strip()
 START_PAGE = int(os.getenv("START_PAGE", "1") or "1")
-END_PAGE = int(os.getenv("END_PAGE", "1") or "1")
+# ``END_PAGE=auto`` (or ``0``) keeps crawling until the site returns a page
+# without any book links, so whole tags can be crawled without guessing.
+_END_PAGE_RAW = (os.getenv("END_PAGE", "1") or "1").strip().lower()
+END_PAGE = None if _END_PAGE_RAW in ("auto", "0") else int(_END_PAGE_RAW)
+SCRAPE_WORKERS = max(1, int(os.getenv("SCRAPE_WORKERS", "4") or "4"))
+# In auto mode a 404 is the end of the listing, and so are this many
+# failed pages in a row (sites that answer 5xx past the last page).
+MAX_FAILED_PAGES = max(1, int(os.getenv("MAX_FAILED_PAGES", "3") or "3"))
+# ``INCREMENTAL=1`` keeps a watermark of the books each SOURCE_URL lists in
+# the catalog (CATALOG_PATH) and stops at the first page listing only known
+# books; the new books also go to a delta CSV next to the raw CSV.
+INCREMENTAL = os.getenv("INCREMENTAL", "0").strip().lower() in ("1", "true", "yes")
+CATALOG_PATH = os.getenv("CATALOG_PATH", "") or os.path.join(RUNS_DIR, "catalog.sqlite")
 
 out_dir = os.path.join(RUNS_DIR, RUN_NAME, "raw")
 os.makedirs(out_dir, exist_ok=True)
 OUTPUT_FILE = os.path.join(out_dir, f"audiobooks_{RUN_NAME}.csv")
+DELTA_FILE = os.path.join(out_dir, f"audiobooks_{RUN_NAME}.delta.csv")
 
 def abs_url(u: str) -> str:
     if u.startswith("http"):
         return u
     return urljoin("https://book.iranseda.ir/", u)
 
-all_data = []
-for page in range(START_PAGE, END_PAGE + 1):
+def extract_books(html: str):
+    """Return ``[book_id, url]`` pairs for every book link on a taglist page."""
+    with metrics.timer("parse_seconds", page="taglist"):
+        soup = BeautifulSoup(html, "html.parser")
+        books = []
+        for a in soup.select("a[href*='?VALID=TRUE&g=']"):
+            href = a.get("href", "")
+            m = re.search(r"[?&]g=(\d+)", href)
+            if m:
+                books.append([int(m.group(1)), abs_url(href)])
+    return books
+
+def fetch_page(page: int):
+    """Fetch one listing page; return its books or ``None`` if it failed.
+
+    A 404 is a page without books (``[]``), not a failure.
+    """
     url = SOURCE_URL.format(page)
     print(f"[scrape] Page {page}: {url}")
-    r = requests.get(url, timeout=30)
+    try:
+        r = cached_get(url)
+    except requests.RequestException as e:
+        print(f"  ! page {page}: {e}")
+        metrics.inc("scrape_pages_total", status="error")
+        return None
     r.encoding = "utf-8"
+    if r.status_code == 404:
+        print(f"  ! page {page}: not found")
+        metrics.inc("scrape_pages_total", status="not_found")
+        return []
     if r.status_code != 200:
-        print(f"  ! status={r.status_code}")
-        continue
-    soup = BeautifulSoup(r.text, "html.parser")
-    for a in soup.select("a[href*='?VALID=TRUE&g=']"):
-        href = a.get("href", "")
-        m = re.search(r"[?&]g=(\d+)", href)
-        if m:
-            book_id = int(m.group(1))
-            all_data.append([book_id, abs_url(href)])
-    time.sleep(random.uniform(0.1, 0.3))
-
-seen = set()
-unique = []
-for (bid, url) in all_data:
-    if bid in seen: continue
-    seen.add(bid)
-    unique.append([bid, url])
-
-with open(OUTPUT_FILE, "w", newline="", encoding="utf-8-sig") as f:
-    w = csv.writer(f)
-    w.writerow(["AudioBook_ID", "URL"])
-    w.writerows(unique)
-
-print(f"[scrape] ✓ wrote {len(unique)} rows -> {OUTPUT_FILE}")
+        print(f"  ! page {page}: status={r.status_code}")
+        metrics.inc("scrape_pages_total", status="error")
+        return None
+    metrics.inc("scrape_pages_total", status="ok")
+    return extract_books(r.text)
+
+def crawl(start=START_PAGE, end=END_PAGE, workers=SCRAPE_WORKERS):
+    """Yield ``(page, books)`` in page order while fetching pages in parallel.
+
+    At most ``workers`` pages are in flight; a new page is only requested
+    once the oldest one has been consumed.  With ``end=None`` the crawl stops
+    at the first page that has no book links (or is not found), or after
+    ``MAX_FAILED_PAGES`` failed pages in a row.
+    """
+    pages = itertools.count(start) if end is None else iter(range(start, end + 1))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        pending = deque(
+            (page, ex.submit(fetch_page, page))
+            for page in itertools.islice(pages, workers)
+        )
+        failures = 0
+        try:
+            while pending:
+                page, fut = pending.popleft()
+                books = fut.result()
+                yield page, books
+                failures = failures + 1 if books is None else 0
+                if end is None and books is not None and not books:
+                    print(f"[scrape] page {page} has no books; last page is {page - 1}")
+                    return
+                if end is None and failures >= MAX_FAILED_PAGES:
+                    print(f"[scrape] {failures} pages in a row failed; stopping at page {page}")
+                    return
+                nxt = next(pages, None)
+                if nxt is not None:
+                    pending.append((nxt, ex.submit(fetch_page, nxt)))
+        finally:
+            for _, fut in pending:
+                fut.cancel()
+
+def write_delta(path, books):
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        w = csv.writer(f)
+        w.writerow(["AudioBook_ID", "URL"])
+        w.writerows(books)
+    print(f"[scrape] {len(books)} new books -> {path}")
+
+def scrape_books(output_file=None, delta_file=None):
+    """Crawl the listing and write the raw CSV, yielding each ``(id, url)`` it writes.
+
+    Rows are flushed as they are found, so the CSV is usable as soon as the
+    generator is exhausted (or by ``pipeline.py`` while it is running).
+
+    With ``INCREMENTAL`` the crawl stops at the first page whose books are
+    all in the listing's watermark (unless an earlier page failed), the new
+    books are also written to the delta CSV, and the known books follow them
+    in the raw CSV so it still lists the whole tag, newest first.  The
+    watermark is only updated once the crawl completes.  Enriching the raw
+    CSV therefore still visits the known books; they are only skipped while
+    the catalog holds a copy younger than ``CATALOG_MAX_AGE_DAYS``.
+    """
+    seen = set()
+    cat = Catalog(CATALOG_PATH) if INCREMENTAL else None
+    listing = [(int(bid), url) for bid, url in cat.listing(SOURCE_URL)] if cat else []
+    known = {bid for bid, _ in listing}
+    found, failed = [], False
+    try:
+        with open(output_file or OUTPUT_FILE, "w", newline="", encoding="utf-8-sig") as f:
+            w = csv.writer(f)
+            w.writerow(["AudioBook_ID", "URL"])
+            for page, books in crawl():
+                failed = failed or books is None
+                fresh = []
+                for bid, url in books or []:
+                    if bid not in seen:
+                        seen.add(bid)
+                        fresh.append([bid, url])
+                # In auto mode a page that only repeats known books means the
+                # site is echoing its last page for out-of-range page numbers.
+                if END_PAGE is None and books and not fresh:
+                    print(f"[scrape] page {page} repeats known books; stopping")
+                    break
+                if known:
+                    fresh = [b for b in fresh if b[0] not in known]
+                    if books and not fresh and not failed:
+                        print(f"[scrape] page {page} only lists books in the watermark; stopping")
+                        break
+                w.writerows(fresh)
+                f.flush()
+                metrics.inc("scrape_books_total", len(fresh))
+                found.extend(fresh)
+                for bid, url in fresh:
+                    yield bid, url
+            if cat:
+                write_delta(delta_file or DELTA_FILE, found)
+                new = {bid for bid, _ in found}
+                rest = [(bid, url) for bid, url in listing if bid not in new]
+                w.writerows(rest)
+                f.flush()
+                metrics.inc("scrape_watermark_books_total", len(rest))
+                cat.put_listing(SOURCE_URL, [tuple(b) for b in found] + rest)
+                for bid, url in rest:
+                    yield bid, url
+    finally:
+        if cat:
+            cat.close()
+
+def main():
+    with metrics.stage_run("scrape", os.path.dirname(out_dir)):
+        n = sum(1 for _ in scrape_books())
+    print(f"[scrape] ✓ wrote {n} rows -> {OUTPUT_FILE}")
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,57 @@
 # -*- coding: utf-8 -*-
-import os, sys, re, csv, time, random
+import os, sys, re, csv, hashlib, importlib.util, json, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from urllib.parse import urljoin, urlparse, parse_qs
-import pandas as pd
+from tools import metrics
+from tools.catalog import Catalog
+from tools.http_cache import cached_get
+from tools.mp3_probe import Mp3HeaderCache, choose_file, probe_files
 
 RUN_NAME = os.getenv("RUN_NAME", "latest")
 RUNS_DIR = os.getenv("RUNS_DIR", "runs")
 IN_CSV_ENV = os.getenv("INPUT_CSV", "")
+# Number of books enriched concurrently.  Per-host pacing, retries and
+# connection pooling are handled by tools.http_client (MAX_RPS_PER_HOST etc.).
+ENRICH_WORKERS = max(1, int(os.getenv("ENRICH_WORKERS", "1") or "1"))
+# ``bs4`` parses the whole page with html.parser; ``fast`` uses lxml (when
+# installed) and a SoupStrainer that skips scripts, styles and navigation.
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "bs4").strip().lower() or "bs4"
+# ``html`` fetches every Details page; ``api`` reads the apisec JSON first and
+# only falls back to the page when the attid is unknown or one of
+# API_REQUIRED_FIELDS is missing from the JSON (default: any field the page
+# provides, see PAGE_FIELDS).
+ENRICH_MODE = os.getenv("ENRICH_MODE", "html").strip().lower() or "html"
+API_REQUIRED_FIELDS = [f.strip() for f in os.getenv("API_REQUIRED_FIELDS", "").split(",") if f.strip()]
+# With RESUME enabled (default) a re-run of the same RUN_NAME skips books
+# that already made it into the merged CSV and retries the listed errors.
+RESUME = os.getenv("RESUME", "1").strip().lower() not in ("0", "false", "no")
+# Enriched books are also kept in a catalog shared by all runs; a book that
+# any run refreshed less than CATALOG_MAX_AGE_DAYS ago is copied from it
+# instead of being fetched again (``0`` always refetches, ``CATALOG=0``
+# disables the catalog).
+CATALOG = os.getenv("CATALOG", "1").strip().lower() not in ("0", "false", "no")
+CATALOG_PATH = os.getenv("CATALOG_PATH", "") or str(Path(RUNS_DIR) / "catalog.sqlite")
+CATALOG_MAX_AGE_DAYS = float(os.getenv("CATALOG_MAX_AGE_DAYS", "7") or "0")
+# With MP3_PROBE=1 the first KB of every MP3 of a book are read with a Range
+# request (tools/mp3_probe.py, cached per attid in MP3_PROBE_CACHE); the file
+# with the highest bitrate, at most MP3_MAX_BITRATE kbps when set, is
+# published and its exact duration recorded.
+MP3_PROBE = os.getenv("MP3_PROBE", "0").strip().lower() in ("1", "true", "yes")
+MP3_MAX_BITRATE = int(os.getenv("MP3_MAX_BITRATE", "0") or "0")
+MP3_PROBE_CACHE = os.getenv("MP3_PROBE_CACHE", "") or str(Path(RUNS_DIR) / ".cache" / "mp3_headers.sqlite")
+
+# SHARD_COUNT > 1 splits the input between workers by a stable hash of the
+# AudioBook_ID; worker SHARD_INDEX (0-based) only enriches its own books and
+# writes shard-suffixed outputs, which ``merge`` combines afterwards.
+SHARD_COUNT = max(1, int(os.getenv("SHARD_COUNT", "1") or "1"))
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0") or "0")
+if not 0 <= SHARD_INDEX < SHARD_COUNT:
+    raise SystemExit(f"SHARD_INDEX must be in 0..{SHARD_COUNT - 1}")
+SHARD_SUFFIX = f".shard-{SHARD_INDEX}-of-{SHARD_COUNT}" if SHARD_COUNT > 1 else ""
 
 RAW_DIR = Path(RUNS_DIR) / RUN_NAME / "raw"
 MERGED_DIR = Path(RUNS_DIR) / RUN_NAME / "merged"
@@ -17,15 +60,24 @@ for d in (RAW_DIR, MERGED_DIR, ERROR_DIR):
     d.mkdir(parents=True, exist_ok=True)
 
 INPUT_CSV = IN_CSV_ENV or str(RAW_DIR / f"audiobooks_{RUN_NAME}.csv")
-OUT_CSV = str(MERGED_DIR / f"books_with_attid_{RUN_NAME}.csv")
-ERR_CSV = str(ERROR_DIR / f"errors_{RUN_NAME}.csv")
+MERGED_CSV = str(MERGED_DIR / f"books_with_attid_{RUN_NAME}.csv")
+MERGED_ERR_CSV = str(ERROR_DIR / f"errors_{RUN_NAME}.csv")
+OUT_CSV = str(MERGED_DIR / f"books_with_attid_{RUN_NAME}{SHARD_SUFFIX}.csv")
+ERR_CSV = str(ERROR_DIR / f"errors_{RUN_NAME}{SHARD_SUFFIX}.csv")
+CHECKPOINT = str(Path(RUNS_DIR) / RUN_NAME / f"checkpoint_{RUN_NAME}{SHARD_SUFFIX}.jsonl")
+ERR_FIELDS = ["AudioBook_ID", "Error"]
 
 CSV_FIELDS = [
     "AudioBook_ID","Book_Title","Book_Description","Book_Detail","Book_Language","Book_Country",
     "Book_Author","Book_Translator","Book_Narrator","Book_Director","Book_Producer",
     "Book_SoundEngineer","Book_Effector","Book_Actors","Book_Genre","Book_Category",
     "Book_Duration","Episode_Count","Cover_Image_URL","Player_Link",
-    "FullBook_MP3_URL","All_MP3s_Found"
+    "FullBook_MP3_URL","FullBook_MP3_Size","FullBook_MP3_Type","FullBook_MP3_Quality",
+    "FullBook_MP3_Bitrate","FullBook_MP3_Duration","All_MP3s_Found","All_MP3s_Meta","Field_Sources"
+]
+MP3_FIELDS = [
+    "FullBook_MP3_URL","FullBook_MP3_Size","FullBook_MP3_Type","FullBook_MP3_Quality",
+    "FullBook_MP3_Bitrate","FullBook_MP3_Duration","All_MP3s_Found","All_MP3s_Meta",
 ]
 
 def abs_url(u: str) -> str:
@@ -33,7 +85,7 @@ def abs_url(u: str) -> str:
     return urljoin("https://book.iranseda.ir/", u)
 
 def req_get(url: str) -> requests.Response:
-    r = requests.get(url, timeout=30)
+    r = cached_get(url)
     r.encoding = "utf-8"
     r.raise_for_status()
     return r
@@ -84,48 +136,236 @@ def parse_duration_and_episodes(soup):
 def build_player_link(audio_id, attid):
     return f"https://book.iranseda.ir/Details?VALID=TRUE&g={audio_id}&b=&attid={attid}"
 
-def get_mp3s_from_api(g, attid):
+# Overridable so the offline benchmarks can point the stage at a stub server.
+API_DETAILS_URL = os.getenv("API_DETAILS_URL", "https://apisec.iranseda.ir/book/Details/?VALID=TRUE&g={g}&attid={attid}")
+
+def fetch_api_details(g, attid):
+    r = req_get(API_DETAILS_URL.format(g=g, attid=attid))
+    try:
+        return r.json()
+    except ValueError:
+        return {}
+
+def mp3_files_from_api_data(data):
+    """``[{"url", "file_size", "type", "quality"}]`` for every MP3 download of an apisec payload.
+
+    ``quality`` is the payload's ``quality`` if present, else the ``q``
+    parameter of the download URL.  Unusable payloads give ``[]``.
+    """
+    files = []
     try:
-        api_url = f"https://apisec.iranseda.ir/book/Details/?VALID=TRUE&g={g}&attid={attid}"
-        r = req_get(api_url)
-        data = r.json()
-        urls = []
-        best_url = None
-        best_size = -1
         for it in data.get("items", []):
             for d in it.get("download", []):
                 if str(d.get("extension","")).lower() == "mp3":
                     url = abs_url(d.get("downloadUrl",""))
-                    size = int(d.get("fileSize","0") or 0)
-                    urls.append(url)
-                    if size > best_size:
-                        best_size = size
-                        best_url = url
-        return best_url, ",".join(urls) if urls else None
-    except Exception:
-        return None, None
-
-def parse_page(html: str, url: str):
-    soup = BeautifulSoup(html, "html.parser")
-    title = text_or_none(soup.find("h1"))
-    desc = text_or_none(soup.find("div", class_="short-description")) or ""
-    detail = text_or_none(soup.find("div", class_="full-description")) or ""
-    lang = parse_from_metadata_list(soup, "زبان")
-    country = parse_from_metadata_list(soup, "کشور")
-    author = parse_from_metadata_list(soup, "نویسنده")
-    translator = parse_from_metadata_list(soup, "مترجم")
-    narrator = parse_from_metadata_list(soup, "گوینده")
-    director = parse_from_metadata_list(soup, "کارگردان")
-    producer = parse_from_metadata_list(soup, "تهیه‌کننده")
-    se = parse_from_metadata_list(soup, "مهندس صدا")
-    eff = parse_from_metadata_list(soup, "افکت‌گذار")
-    actors = parse_from_metadata_list(soup, "بازیگران")
-    genre = parse_from_metadata_list(soup, "ژانر")
-    category = parse_from_metadata_list(soup, "دسته‌بندی")
-
-    attid = extract_attid(soup)
-    duration, episodes = parse_duration_and_episodes(soup)
-    cover = get_og_image(soup) or find_first_image_src(soup)
+                    quality = d.get("quality") or parse_qs(urlparse(url).query).get("q", [None])[0]
+                    files.append({"url": url, "file_size": int(d.get("fileSize","0") or 0) or None,
+                                  "type": d.get("mimeType") or "audio/mpeg",
+                                  "quality": str(quality) if quality is not None else None})
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return []
+    return files
+
+def summarize_mp3_files(files):
+    """Return ``(best_url, comma-joined urls)``; the best file is chosen as in :func:`mp3_columns`."""
+    chosen = choose_file(files, MP3_MAX_BITRATE or None)
+    return (chosen["url"] if chosen else None), ",".join(f["url"] for f in files) if files else None
+
+def mp3_columns(files):
+    """CSV columns for a book's MP3 files.
+
+    The chosen file's URL, size, type, quality, bitrate and duration, the
+    comma-joined URLs, and every file as JSON in ``All_MP3s_Meta``, so the
+    feed stage can use the sizes instead of probing each enclosure.  The
+    largest file is chosen unless the files were probed (see
+    :func:`probe_mp3_files`).
+    """
+    chosen = choose_file(files, MP3_MAX_BITRATE or None) or {}
+    duration = chosen.get("duration")
+    return {
+        "FullBook_MP3_URL": chosen.get("url"),
+        "FullBook_MP3_Size": chosen.get("file_size"),
+        "FullBook_MP3_Type": chosen.get("type"),
+        "FullBook_MP3_Quality": chosen.get("quality"),
+        "FullBook_MP3_Bitrate": chosen.get("bitrate"),
+        "FullBook_MP3_Duration": round(duration) if duration else None,
+        "All_MP3s_Found": ",".join(f["url"] for f in files) if files else None,
+        "All_MP3s_Meta": json.dumps(files, ensure_ascii=False) if files else None,
+    }
+
+_mp3_headers = None
+_mp3_headers_lock = threading.Lock()
+
+def mp3_headers():
+    """The shared :class:`~tools.mp3_probe.Mp3HeaderCache` at MP3_PROBE_CACHE."""
+    global _mp3_headers
+    with _mp3_headers_lock:
+        if _mp3_headers is None or _mp3_headers.path != MP3_PROBE_CACHE:
+            _mp3_headers = Mp3HeaderCache(MP3_PROBE_CACHE)
+    return _mp3_headers
+
+def close_mp3_headers():
+    global _mp3_headers
+    with _mp3_headers_lock:
+        if _mp3_headers is not None:
+            _mp3_headers.close()
+            _mp3_headers = None
+
+def probe_mp3_files(files):
+    """Add the probed bitrate and duration to each file when MP3_PROBE is on."""
+    if not MP3_PROBE or not files:
+        return files
+    return probe_files(files, cache=mp3_headers())
+
+def get_mp3_files_from_api(g, attid):
+    """Return the book's MP3 files (see :func:`mp3_files_from_api_data`); ``[]`` for unusable payloads.
+
+    Transport errors are no longer swallowed: once the HTTP client has run out
+    of retries they propagate, so the book lands in the errors CSV and is
+    retried on the next run instead of being saved without MP3s.
+    """
+    return mp3_files_from_api_data(fetch_api_details(g, attid))
+
+def get_mp3s_from_api(g, attid):
+    """Return ``(best_url, all_urls)``; ``(None, None)`` for unusable payloads."""
+    return summarize_mp3_files(get_mp3_files_from_api(g, attid))
+
+# CSV field -> key of the apisec payload (or its first item).  Only keys the
+# API is known to return are listed; every other field comes from the page.
+API_FIELD_KEYS = {
+    "Book_Title": "title",
+}
+
+def parse_api_details(data):
+    """Map the book metadata of an apisec payload onto CSV fields (see ``API_FIELD_KEYS``)."""
+    scopes = [data]
+    items = data.get("items") or []
+    if items and isinstance(items[0], dict):
+        scopes.append(items[0])
+    fields = {}
+    for key, api_key in API_FIELD_KEYS.items():
+        for scope in scopes:
+            val = scope.get(api_key)
+            if isinstance(val, (str, int)) and str(val).strip():
+                fields[key] = str(val).strip()
+                break
+    if fields.get("Cover_Image_URL"):
+        fields["Cover_Image_URL"] = abs_url(fields["Cover_Image_URL"])
+    return fields
+
+# CSV field -> label searched in the ``dt`` of ``.metadata-list li``.
+METADATA_LABELS = [
+    ("Book_Language", "زبان"),
+    ("Book_Country", "کشور"),
+    ("Book_Author", "نویسنده"),
+    ("Book_Translator", "مترجم"),
+    ("Book_Narrator", "گوینده"),
+    ("Book_Director", "کارگردان"),
+    ("Book_Producer", "تهیه‌کننده"),
+    ("Book_SoundEngineer", "مهندس صدا"),
+    ("Book_Effector", "افکت‌گذار"),
+    ("Book_Actors", "بازیگران"),
+    ("Book_Genre", "ژانر"),
+    ("Book_Category", "دسته‌بندی"),
+]
+# CSV field -> label searched in the ``span`` of ``.item-info li``.
+ITEMINFO_LABELS = [
+    ("Book_Duration", "مدت زمان:"),
+    ("Episode_Count", "تعداد قسمت:"),
+]
+# CSV fields the Details page provides (see ``parse_page``).
+PAGE_FIELDS = ["Book_Title", "Book_Description", "Book_Detail",
+               *(key for key, _ in METADATA_LABELS), *(key for key, _ in ITEMINFO_LABELS), "Cover_Image_URL"]
+
+# Top-level elements kept by the ``fast`` backend.  Everything the parser
+# needs lives in (or is) one of these; descendants of kept tags are kept too.
+_STRAINER = SoupStrainer(["h1", "meta", "img", "div", "section", "article", "main", "aside", "ul", "ol", "dl"])
+
+_FAST_FEATURES = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+def make_soup(html: str, backend: str = None):
+    backend = backend or PARSER_BACKEND
+    if backend == "fast":
+        return BeautifulSoup(html, _FAST_FEATURES, parse_only=_STRAINER)
+    if backend == "bs4":
+        return BeautifulSoup(html, "html.parser")
+    raise ValueError(f"unknown PARSER_BACKEND: {backend}")
+
+def scan_page(soup):
+    """Collect everything ``parse_page`` needs in one walk over the tree.
+
+    Mirrors the helpers above (first ``h1``, first og:image, first ``img``,
+    first match per label) without rescanning the document for each field.
+    """
+    found = {"h1": None, "short": None, "full": None, "og": None, "img_src": None, "img_attid": None}
+    metadata, iteminfo = [], []
+    for tag in soup.find_all(True):
+        name = tag.name
+        classes = tag.get("class") or ()
+        if name == "h1":
+            if found["h1"] is None:
+                found["h1"] = tag
+        elif name == "div":
+            if found["short"] is None and "short-description" in classes:
+                found["short"] = tag
+            if found["full"] is None and "full-description" in classes:
+                found["full"] = tag
+        elif name == "meta":
+            if found["og"] is None and tag.get("property") == "og:image":
+                found["og"] = tag
+        elif name == "img":
+            src = tag.get("src")
+            if src is not None:
+                if found["img_src"] is None:
+                    found["img_src"] = src
+                if found["img_attid"] is None:
+                    m = re.search(r"[?&]AttID=(\d+)", src, re.I)
+                    if m:
+                        found["img_attid"] = int(m.group(1))
+        if "metadata-list" in classes:
+            for li in tag.find_all("li"):
+                dt = li.find("dt")
+                if dt:
+                    metadata.append((dt.get_text(strip=True), li))
+        if "item-info" in classes:
+            for li in tag.find_all("li"):
+                span = li.find("span")
+                if span:
+                    iteminfo.append((span.get_text(strip=True), li))
+    found["metadata"] = metadata
+    found["iteminfo"] = iteminfo
+    return found
+
+def _first_metadata(entries, label):
+    for dt_text, li in entries:
+        if label in dt_text:
+            return text_or_none(li.find("dd"))
+    return None
+
+def _first_iteminfo(entries, label):
+    for span_text, li in entries:
+        if label in span_text:
+            return li.get_text(" ", strip=True).replace(label, "").strip()
+    return None
+
+def parse_page(html: str, url: str, backend: str = None):
+    with metrics.timer("parse_seconds", page="details", backend=backend or PARSER_BACKEND):
+        return _parse_page(html, url, backend)
+
+def _parse_page(html, url, backend):
+    scan = scan_page(make_soup(html, backend))
+    fields = {key: _first_metadata(scan["metadata"], label) for key, label in METADATA_LABELS}
+    fields.update((key, _first_iteminfo(scan["iteminfo"], label)) for key, label in ITEMINFO_LABELS)
+
+    og = scan["og"].get("content") if scan["og"] is not None else None
+    og = og or None
+    attid = None
+    if og:
+        m = re.search(r"[?&]AttID=(\d+)", og, re.I)
+        if m: attid = int(m.group(1))
+    if attid is None:
+        attid = scan["img_attid"]
+    cover = og or scan["img_src"]
     if cover:
         cover = abs_url(cover)
 
@@ -134,75 +374,424 @@ def parse_page(html: str, url: str):
 
     return {
         "AudioBook_ID": g,
-        "Book_Title": title,
-        "Book_Description": desc,
-        "Book_Detail": detail,
-        "Book_Language": lang,
-        "Book_Country": country,
-        "Book_Author": author,
-        "Book_Translator": translator,
-        "Book_Narrator": narrator,
-        "Book_Director": director,
-        "Book_Producer": producer,
-        "Book_SoundEngineer": se,
-        "Book_Effector": eff,
-        "Book_Actors": actors,
-        "Book_Genre": genre,
-        "Book_Category": category,
-        "Book_Duration": duration,
-        "Episode_Count": episodes,
+        "Book_Title": text_or_none(scan["h1"]),
+        "Book_Description": text_or_none(scan["short"]) or "",
+        "Book_Detail": text_or_none(scan["full"]) or "",
+        **{key: fields[key] for key, _ in METADATA_LABELS},
+        "Book_Duration": fields["Book_Duration"],
+        "Episode_Count": fields["Episode_Count"],
         "Cover_Image_URL": cover,
         "Player_Link": build_player_link(g, attid) if g and attid else None,
         "attid": attid,
     }
 
+def record_sources(parsed, sources):
+    """Store which stage produced each non-empty field as a JSON column."""
+    parsed["Field_Sources"] = json.dumps(
+        {k: sources[k] for k in CSV_FIELDS if k in sources and parsed.get(k)},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return parsed
+
+def enrich_url(url: str) -> dict:
+    """Fetch one Details page and its MP3 list; raise on any page error."""
+    r = req_get(url)
+    parsed = parse_page(r.text, url)
+    attid = parsed.get("attid")
+    files = []
+    if attid and parsed.get("AudioBook_ID"):
+        files = probe_mp3_files(get_mp3_files_from_api(parsed["AudioBook_ID"], attid))
+    parsed.update(mp3_columns(files))
+    sources = dict.fromkeys(parsed, "html")
+    sources.update(dict.fromkeys(MP3_FIELDS, "api"))
+    parsed["mp3_files"] = files
+    return record_sources(parsed, sources)
+
+_known_attids = None
+_known_attids_lock = threading.Lock()
+
+def known_attids():
+    """``{AudioBook_ID: attid}`` from the catalog and the Player_Link of every merged CSV."""
+    global _known_attids
+    with _known_attids_lock:
+        if _known_attids is None:
+            cat = catalog()
+            found = cat.attids() if cat else {}
+            for path in sorted(Path(RUNS_DIR).glob("*/merged/books_with_attid_*.csv")):
+                for r in read_csv_rows(path):
+                    m = re.search(r"[?&]attid=(\d+)", r.get("Player_Link") or "", re.I)
+                    if m and r.get("AudioBook_ID"):
+                        found[str(r["AudioBook_ID"])] = int(m.group(1))
+            _known_attids = found
+    return _known_attids
+
+def lookup_attid(g, url):
+    m = re.search(r"[?&]attid=(\d+)", url, re.I)
+    if m:
+        return int(m.group(1))
+    return known_attids().get(str(g))
+
+def enrich_url_api(url: str) -> dict:
+    """API-first enrichment: one apisec call, the Details page only if needed."""
+    g = parse_qs(urlparse(url).query).get("g", [None])[0]
+    attid = lookup_attid(g, url) if g else None
+    if not attid:
+        return enrich_url(url)
+    data = fetch_api_details(g, attid)
+    parsed = {"AudioBook_ID": g, "attid": attid, "Player_Link": build_player_link(g, attid)}
+    parsed.update(parse_api_details(data))
+    files = probe_mp3_files(mp3_files_from_api_data(data))
+    parsed.update(mp3_columns(files))
+    sources = dict.fromkeys(parsed, "api")
+    parsed["mp3_files"] = files
+    if any(not parsed.get(f) for f in API_REQUIRED_FIELDS or PAGE_FIELDS):
+        page = parse_page(req_get(url).text, url)
+        for key, val in page.items():
+            if not parsed.get(key) and val:
+                parsed[key] = val
+                sources[key] = "html"
+    for key in CSV_FIELDS:
+        parsed.setdefault(key, "" if key in ("Book_Description", "Book_Detail") else None)
+    return record_sources(parsed, sources)
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def catalog():
+    """The shared :class:`~tools.catalog.Catalog` at CATALOG_PATH (``None`` with ``CATALOG=0``)."""
+    global _catalog
+    if not CATALOG:
+        return None
+    with _catalog_lock:
+        if _catalog is None or _catalog.path != CATALOG_PATH:
+            _catalog = Catalog(CATALOG_PATH)
+    return _catalog
+
+def close_catalog():
+    global _catalog
+    with _catalog_lock:
+        if _catalog is not None:
+            _catalog.close()
+            _catalog = None
+
+def _from_catalog(row):
+    """A copy of the book from the catalog if some run refreshed it recently."""
+    cat = catalog()
+    if not cat or CATALOG_MAX_AGE_DAYS <= 0 or not row.get("AudioBook_ID"):
+        return None
+    stored = cat.get_book(row["AudioBook_ID"], max_age=CATALOG_MAX_AGE_DAYS * 86400)
+    if stored is not None:
+        stored["from_catalog"] = True
+    return stored
+
+def _enrich_row(row):
+    url = str(row["URL"]).strip()
+    stored = _from_catalog(row)
+    if stored is not None:
+        metrics.inc("enrich_books_total", status="catalog")
+        return stored, None
+    try:
+        with metrics.timer("enrich_book_seconds", mode=ENRICH_MODE):
+            parsed = enrich_url_api(url) if ENRICH_MODE == "api" else enrich_url(url)
+    except Exception as e:
+        metrics.inc("enrich_books_total", status="error", error=type(e).__name__)
+        return None, e
+    metrics.inc("enrich_books_total", status="ok")
+    for source in json.loads(parsed.get("Field_Sources") or "{}").values():
+        metrics.inc("enrich_fields_total", source=source)
+    return parsed, None
+
+class CsvAppender:
+    """Append rows to a CSV, writing the header only when the file is new.
+
+    A file started with another header (e.g. by an older version that had
+    fewer columns) is first rewritten with ``fieldnames`` (plus any columns
+    only it has), so resumed rows keep every column.  Every row is flushed
+    immediately so a crash loses at most the row being written.
+    """
+
+    def __init__(self, path, fieldnames):
+        self.path = Path(path)
+        self.fieldnames = fieldnames
+        self._f = None
+        self._w = None
+
+    def write(self, row):
+        if self._f is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            new = not self.path.exists() or self.path.stat().st_size == 0
+            fieldnames = list(self.fieldnames)
+            if not new:
+                with self.path.open("r", newline="", encoding="utf-8-sig") as f:
+                    header = next(csv.reader(f), None) or []
+                fieldnames += [k for k in header if k not in fieldnames]
+                if header != fieldnames:
+                    _write_rows(self.path, read_csv_rows(self.path), fieldnames)
+            self._f = self.path.open("a", newline="", encoding="utf-8-sig" if new else "utf-8")
+            self._w = csv.DictWriter(self._f, fieldnames=fieldnames, extrasaction="ignore")
+            if new:
+                self._w.writeheader()
+        self._w.writerow(row)
+        self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+def read_csv_rows(path):
+    path = Path(path)
+    if not path.exists():
+        return []
+    with path.open("r", newline="", encoding="utf-8-sig") as f:
+        return list(csv.DictReader(f))
+
+def load_checkpoint(path):
+    """Return ``{AudioBook_ID: last status}`` from the checkpoint journal."""
+    status = {}
+    path = Path(path)
+    if not path.exists():
+        return status
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn last line after a crash
+            status[str(entry["AudioBook_ID"])] = entry["status"]
+    return status
+
+def shard_of(audiobook_id, count=None):
+    """Stable shard number of a book (the same on every machine and run)."""
+    digest = hashlib.sha1(str(audiobook_id).encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) % (count or SHARD_COUNT)
+
+def in_shard(row):
+    return SHARD_COUNT == 1 or shard_of(row.get("AudioBook_ID")) == SHARD_INDEX
+
+def resume_filter():
+    """Return a predicate telling whether an input row still has to be processed.
+
+    Only this worker's shard is processed.  Books already in the merged CSV
+    are done.  Books that failed before are retried only while they are
+    listed in the errors CSV; books that were never attempted are always
+    processed.  Without RESUME (or without a merged CSV) the previous
+    outputs are removed and every row is processed.
+    """
+    if not RESUME or not Path(OUT_CSV).exists():
+        for p in (OUT_CSV, ERR_CSV, CHECKPOINT):
+            Path(p).unlink(missing_ok=True)
+        return in_shard
+    attempted = load_checkpoint(CHECKPOINT)
+    done = {r["AudioBook_ID"] for r in read_csv_rows(OUT_CSV)}
+    done.update(k for k, v in attempted.items() if v == "ok")
+    listed_errors = {r["AudioBook_ID"] for r in read_csv_rows(ERR_CSV)}
+
+    def todo(row):
+        bid = str(row.get("AudioBook_ID"))
+        return in_shard(row) and bid not in done and (bid not in attempted or bid in listed_errors)
+    return todo
+
+def plan_resume(rows):
+    """Split input rows into the ones still to process on this run."""
+    keep = resume_filter()
+    todo = [row for row in rows if keep(row)]
+    if SHARD_COUNT > 1:
+        print(f"[shard] {SHARD_INDEX}/{SHARD_COUNT}: {sum(1 for r in rows if in_shard(r))} of {len(rows)} books")
+    if Path(OUT_CSV).exists():
+        print(f"[resume] {sum(1 for r in rows if in_shard(r)) - len(todo)} done, {len(todo)} to process")
+    return todo
+
+def compact_errors():
+    """Rewrite the errors CSV so it lists each still-failing book once."""
+    status = load_checkpoint(CHECKPOINT)
+    latest = {}
+    for r in read_csv_rows(ERR_CSV):
+        if status.get(str(r["AudioBook_ID"])) == "error":
+            latest.pop(r["AudioBook_ID"], None)
+            latest[r["AudioBook_ID"]] = r
+    err_path = Path(ERR_CSV)
+    if not latest:
+        err_path.unlink(missing_ok=True)
+        return
+    with err_path.open("w", newline="", encoding="utf-8-sig") as f:
+        w = csv.DictWriter(f, fieldnames=ERR_FIELDS, extrasaction="ignore")
+        w.writeheader()
+        w.writerows(latest.values())
+
+def enrich_rows(rows, total=None):
+    """Enrich ``rows`` and stream the results to the merged/errors CSVs.
+
+    ``rows`` may be a slow producer (``pipeline.py`` feeds books while the
+    crawl is still running): at most ``2 * ENRICH_WORKERS`` books are in
+    flight, each worker handling one book end to end (Details page, then
+    apisec), so the page fetch of one book overlaps the API call of another.
+    Results are written, journaled and yielded in input order regardless of
+    completion order.  Freshly enriched books are stored in the catalog and
+    every written book is linked to this run there.
+    """
+    merged = CsvAppender(OUT_CSV, CSV_FIELDS)
+    errors = CsvAppender(ERR_CSV, ERR_FIELDS)
+    Path(CHECKPOINT).parent.mkdir(parents=True, exist_ok=True)
+    journal = open(CHECKPOINT, "a", encoding="utf-8")
+    of = f"/{total}" if total is not None else ""
+
+    cat = catalog()
+
+    def _finish(idx, row, parsed, err):
+        bid = row.get("AudioBook_ID")
+        if err is None:
+            merged.write(parsed)
+            if cat and parsed.get("AudioBook_ID"):
+                if not parsed.get("from_catalog"):
+                    cat.put_book(parsed, fields=CSV_FIELDS)
+                cat.link_run(RUN_NAME, parsed["AudioBook_ID"])
+            print(f"[{idx}{of}] ✓ {parsed.get('AudioBook_ID')}" + (" (catalog)" if parsed.get("from_catalog") else ""))
+        else:
+            print(f"[{idx}{of}] ✗ {bid}: {err}")
+            errors.write({"AudioBook_ID": bid, "Error": str(err)})
+        journal.write(json.dumps({"AudioBook_ID": str(bid), "status": "error" if err else "ok"}) + "\n")
+        journal.flush()
+
+    try:
+        with ThreadPoolExecutor(max_workers=ENRICH_WORKERS) as ex:
+            pending = deque()
+            idx = 0
+            for row in rows:
+                pending.append((row, ex.submit(_enrich_row, row)))
+                while len(pending) > 2 * ENRICH_WORKERS or (pending and pending[0][1].done()):
+                    row_, fut = pending.popleft()
+                    idx += 1
+                    parsed, err = fut.result()
+                    _finish(idx, row_, parsed, err)
+                    if err is None:
+                        yield parsed
+            while pending:
+                row_, fut = pending.popleft()
+                idx += 1
+                parsed, err = fut.result()
+                _finish(idx, row_, parsed, err)
+                if err is None:
+                    yield parsed
+    finally:
+        journal.close()
+        merged.close()
+        errors.close()
+
+def input_order():
+    """``{AudioBook_ID: position}`` of the books in INPUT_CSV."""
+    return {str(r["AudioBook_ID"]): i for i, r in enumerate(read_csv_rows(INPUT_CSV))}
+
+def in_input_order(rows, order):
+    """``rows`` sorted by ``order`` (see :func:`input_order`); books missing from it follow, in their own order."""
+    end = len(order)
+    return sorted(rows, key=lambda r: order.get(str(r["AudioBook_ID"]), end))
+
+def finish_outputs():
+    """Put the merged CSV in INPUT_CSV order and compact errors.
+
+    Resumed and retried books are appended to the merged CSV, so it is
+    rewritten in input order (newest books first for the listing crawl),
+    and the run's books in the catalog are put in the same order (sharded
+    runs are ordered by ``merge``).  A header-only merged CSV is left if
+    nothing was enriched.
+    """
+    if not Path(OUT_CSV).exists():
+        with open(OUT_CSV, "w", newline="", encoding="utf-8-sig") as f:
+            csv.DictWriter(f, fieldnames=CSV_FIELDS).writeheader()
+    rows = read_csv_rows(OUT_CSV)
+    ordered = in_input_order(rows, input_order())
+    if ordered != rows:
+        _write_rows(OUT_CSV, ordered, list(rows[0]))
+    if SHARD_COUNT == 1:
+        order_catalog_run(ordered)
+    compact_errors()
+
+def order_catalog_run(rows):
+    """Put RUN_NAME's books in the catalog in the order of ``rows``."""
+    cat = catalog()
+    if cat:
+        try:
+            cat.order_run(RUN_NAME, [r["AudioBook_ID"] for r in rows])
+        finally:
+            close_catalog()
+
+def shard_paths(path):
+    """Existing shard outputs of a canonical output path, in shard order."""
+    p = Path(path)
+    found = []
+    for shard in p.parent.glob(f"{p.stem}.shard-*-of-*{p.suffix}"):
+        m = re.search(r"\.shard-(\d+)-of-(\d+)$", shard.stem)
+        if m:
+            found.append((int(m.group(2)), int(m.group(1)), shard))
+    return [shard for _, _, shard in sorted(found)]
+
+def _write_rows(path, rows, fieldnames):
+    tmp = Path(path).with_name(Path(path).name + ".tmp")
+    with tmp.open("w", newline="", encoding="utf-8-sig") as f:
+        w = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        w.writeheader()
+        w.writerows(rows)
+    os.replace(tmp, path)
+
+def merge_shards():
+    """Combine the shard outputs into the canonical merged and errors CSVs.
+
+    Books are deduplicated by AudioBook_ID and written in INPUT_CSV order
+    (books missing from it follow, in shard order); so are the errors,
+    minus the books some shard did enrich.  Returns the number of
+    merged books.
+    """
+    shards = shard_paths(MERGED_CSV)
+    if not shards:
+        print(f"No shard outputs next to {MERGED_CSV}")
+        return 0
+    order = input_order()
+    books, fieldnames = {}, list(CSV_FIELDS)
+    for path in shards:
+        rows = read_csv_rows(path)
+        for r in rows:
+            books.setdefault(str(r["AudioBook_ID"]), r)
+            fieldnames += [k for k in r if k not in fieldnames]
+    merged = in_input_order(books.values(), order)
+    _write_rows(MERGED_CSV, merged, fieldnames)
+    order_catalog_run(merged)
+
+    errors = {}
+    for path in shard_paths(MERGED_ERR_CSV):
+        for r in read_csv_rows(path):
+            if str(r["AudioBook_ID"]) not in books:
+                errors[str(r["AudioBook_ID"])] = r
+    if errors:
+        _write_rows(MERGED_ERR_CSV, in_input_order(errors.values(), order), ERR_FIELDS)
+    else:
+        Path(MERGED_ERR_CSV).unlink(missing_ok=True)
+    print(f"✓ Merged {len(books)} books from {len(shards)} shards -> {MERGED_CSV}"
+          + (f" ({len(errors)} errors -> {MERGED_ERR_CSV})" if errors else ""))
+    return len(books)
+
 def main():
+    if sys.argv[1:2] == ["merge"]:
+        merge_shards()
+        return
+    # The checkpoint sits directly in runs/<RUN_NAME>/, next to metrics.json.
+    with metrics.stage_run("enrich", str(Path(CHECKPOINT).parent)):
+        _enrich()
+
+def _enrich():
     in_path = Path(INPUT_CSV)
     if not in_path.exists():
         print(f"ERROR: {INPUT_CSV} not found.")
         sys.exit(1)
 
-    df_in = pd.read_csv(in_path, encoding="utf-8")
-    merged_rows = []
-    error_rows = []
-
-    for idx, row in df_in.iterrows():
-        url = str(row["URL"]).strip()
-        try:
-            r = req_get(url)
-            parsed = parse_page(r.text, url)
-            attid = parsed.get("attid")
-            best, all_mp3 = (None, None)
-            if attid and parsed.get("AudioBook_ID"):
-                best, all_mp3 = get_mp3s_from_api(parsed["AudioBook_ID"], attid)
-            parsed["FullBook_MP3_URL"] = best
-            parsed["All_MP3s_Found"] = all_mp3
-            merged_rows.append(parsed)
-            print(f"[{idx+1}/{len(df_in)}] ✓ {parsed.get('AudioBook_ID')}")
-        except Exception as e:
-            print(f"[{idx+1}/{len(df_in)}] ✗ {row.get('AudioBook_ID')}: {e}")
-            error_rows.append({
-                "AudioBook_ID": row.get("AudioBook_ID"),
-                "Error": str(e),
-            })
-        time.sleep(random.uniform(0.1, 0.3))
-
-    if error_rows:
-        err_path = Path(ERR_CSV)
-        err_path.parent.mkdir(parents=True, exist_ok=True)
-        with err_path.open("w", newline="", encoding="utf-8-sig") as f:
-            w = csv.DictWriter(f, fieldnames=["AudioBook_ID", "Error"])
-            w.writeheader()
-            w.writerows(error_rows)
-
-    out_path = Path(OUT_CSV)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with out_path.open("w", newline="", encoding="utf-8-sig") as f:
-        w = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
-        w.writeheader()
-        for r in merged_rows:
-            w.writerow(r)
-
+    rows = plan_resume(read_csv_rows(in_path))
+    try:
+        for _ in enrich_rows(rows, total=len(rows)):
+            pass
+    finally:
+        close_catalog()
+        close_mp3_headers()
+    finish_outputs()
     print("✓ Wrote:", OUT_CSV)
 
 if __name__ == "__main__":
@@ -0,0 +1,7 @@
+import pathlib
+import sys
+
+# The scripts import shared helpers as ``tools.*`` relative to the repo root.
+ROOT = str(pathlib.Path(__file__).resolve().parents[1])
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
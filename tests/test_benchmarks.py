@@ -0,0 +1,30 @@
+import sys
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+from stub_server import StubServer, MP3_LENGTH
+from run_benchmarks import check_thresholds, percentile
+
+def test_stub_serves_pages_api_and_enclosures():
+    with StubServer(books=25, per_page=20) as stub:
+        first = requests.get(stub.source_url.format(1), timeout=5).text
+        second = requests.get(stub.source_url.format(2), timeout=5).text
+        past_end = requests.get(stub.source_url.format(3), timeout=5).text
+        assert first.count("book-item") == 20
+        assert second.count("book-item") == 5
+        assert "book-item" not in past_end
+        data = requests.get(stub.api_url.format(g=700000, attid=400000), timeout=5).json()
+        assert data
+        head = requests.head(stub.base + "/downloadfile/?attid=1", timeout=5)
+        assert head.headers["Content-Length"] == str(MP3_LENGTH)
+        assert stub.requests == 5
+
+def test_check_thresholds_reports_regressions():
+    report = {"results": {"feed": {"100": {"units": 90, "throughput": 5.0, "p95_ms": 10.0}}}}
+    thresholds = {"feed": {"100": {"min_units": 100, "min_throughput": 40, "max_p95_ms": 250}},
+                  "scrape": {"100": {"min_units": 100}}}
+    problems = check_thresholds(report, thresholds)
+    assert len(problems) == 2
+    assert percentile([5, 1, 3, 2, 4], 50) == 3
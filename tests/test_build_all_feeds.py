@@ -0,0 +1,34 @@
+import os
+
+from tools import build_all_feeds
+
+
+def test_find_merged_csvs_uses_run_directory_names(tmp_path):
+    for run in ("a", "b"):
+        merged = tmp_path / run / "merged"
+        merged.mkdir(parents=True)
+        (merged / f"books_with_attid_{run}.csv").write_text("x", encoding="utf-8")
+    (tmp_path / "b" / "merged" / "books_with_attid_b.shard-0-of-2.csv").write_text("x", encoding="utf-8")
+    runs = build_all_feeds.find_merged_csvs(str(tmp_path))
+    assert [r for r, _ in runs] == ["a", "b"]
+
+
+def test_update_index_lists_existing_feeds_once(tmp_path):
+    public = tmp_path / "public"
+    for run in ("beta", "alpha"):
+        (public / "feeds" / run).mkdir(parents=True)
+        (public / "feeds" / run / "podcast.xml").write_text("<rss/>", encoding="utf-8")
+    (public / "feeds" / "empty").mkdir()
+    index = public / "index.html"
+    index.write_text(
+        "<ul id=\"feeds\">\n    <!-- FEEDS:LIST -->\n    <li>stale</li>\n  </ul>\n</body>", encoding="utf-8"
+    )
+    build_all_feeds.update_index(str(index), str(public))
+    build_all_feeds.update_index(str(index), str(public))
+    html = index.read_text(encoding="utf-8")
+    assert "stale" not in html
+    assert html.count("<li>") == 2
+    assert html.index("feeds/alpha/podcast.xml") < html.index("feeds/beta/podcast.xml")
+    assert "feeds/empty" not in html
+    assert html.endswith("</ul>\n</body>")
+    assert oct(os.stat(index).st_mode & 0o777) == "0o644"
@@ -0,0 +1,44 @@
+import csv
+import time
+
+from tools.catalog import Catalog
+
+
+def _row(bid, title, mp3s=""):
+    return {"AudioBook_ID": str(bid), "Book_Title": title, "All_MP3s_Found": mp3s,
+            "Player_Link": f"https://book.iranseda.ir/Details?VALID=TRUE&g={bid}&b=&attid={bid + 1000}"}
+
+
+def test_books_files_and_runs(tmp_path):
+    cat = Catalog(str(tmp_path / "catalog.sqlite"))
+    files = [{"url": "http://e.com/1.mp3", "file_size": 10, "quality": "11"},
+             {"url": "http://e.com/2.mp3", "file_size": None, "quality": None}]
+    cat.put_book({**_row(5, "A"), "mp3_files": files})
+    cat.put_book(_row(6, "B", "http://e.com/x.mp3,http://e.com/y.mp3"), refreshed_at=time.time() - 3600)
+
+    assert cat.get_book(5)["Book_Title"] == "A"
+    assert cat.get_book(6, max_age=60) is None and cat.get_book(6, max_age=7200)
+    assert cat.mp3_files(5) == files
+    assert [f["url"] for f in cat.mp3_files(6)] == ["http://e.com/x.mp3", "http://e.com/y.mp3"]
+    assert cat.attids() == {"5": 1005, "6": 1006}
+    assert cat.book_for_attid(1006) == "6"
+
+    for run, bid in (("tagA", 6), ("tagA", 5), ("tagB", 5), ("tagA", 6)):
+        cat.link_run(run, bid)
+    assert [r["AudioBook_ID"] for r in cat.run_books("tagA")] == ["6", "5"]
+    assert cat.runs_of(5) == ["tagA", "tagB"]
+    # A later run lists a new book first: it takes that position.
+    cat.put_book(_row(7, "C"))
+    for bid in (6, 5, 7):
+        cat.link_run("tagC", bid)
+    cat.order_run("tagC", [7, 6])
+    assert [r["AudioBook_ID"] for r in cat.run_books("tagC")] == ["7", "6", "5"]
+
+    out = tmp_path / "tagA.csv"
+    assert cat.export_csv("tagA", str(out)) == 2
+    with open(out, encoding="utf-8-sig", newline="") as f:
+        assert [r["Book_Title"] for r in csv.DictReader(f)] == ["B", "A"]
+
+    other = Catalog(str(tmp_path / "other.sqlite"))
+    assert other.import_csv(str(out), "tagA") == 2
+    assert [r["AudioBook_ID"] for r in other.run_books("tagA")] == ["6", "5"]
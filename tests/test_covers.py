@@ -0,0 +1,67 @@
+import io
+from unittest.mock import MagicMock
+
+import pytest
+
+from tools import covers
+
+
+def _response(status, body=b"", headers=None):
+    r = MagicMock()
+    r.status_code = status
+    r.content = body
+    r.headers = headers or {}
+    r.raise_for_status = MagicMock()
+    return r
+
+
+def test_covers_are_cached_by_content_and_revalidated(tmp_path, monkeypatch):
+    monkeypatch.setattr(covers, "Image", None)
+    store = covers.CoverStore(str(tmp_path / "cache"))
+    out = tmp_path / "public" / "covers"
+    client = MagicMock()
+    client.get.return_value = _response(200, b"\xff\xd8jpeg", {"Content-Type": "image/jpeg", "ETag": '"v1"'})
+
+    urls = ["http://p.example/picture?AttID=1", "http://p.example/picture?AttID=2"]
+    counts = covers.sync_covers(urls, store, str(out), client)
+    assert counts == {"downloaded": 2, "published": 1}
+    sha = store.get(urls[0])["sha256"]
+    assert store.get(urls[1])["sha256"] == sha
+    assert [p.name for p in out.iterdir()] == [sha + ".jpg"]
+
+    # Fresh entries skip the network entirely; stale ones send validators.
+    client.get.reset_mock()
+    assert covers.sync_covers(urls, store, str(out), client) == {"cached": 2, "published": 0}
+    client.get.assert_not_called()
+    client.get.return_value = _response(304)
+    assert covers.sync_covers(urls[:1], store, str(out), client, revalidate=True) == {"not_modified": 1, "published": 0}
+    assert client.get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+
+    cover_map = covers.CoverMap(store, str(out), "https://x/covers")
+    row = {"Cover_Image_URL": urls[1], "Book_Title": "T"}
+    assert cover_map.rewrite(row)["Cover_Image_URL"] == f"https://x/covers/{sha}.jpg"
+    assert cover_map.rewrite({"Cover_Image_URL": "http://other/x"})["Cover_Image_URL"] == "http://other/x"
+
+
+def test_non_images_are_rejected(tmp_path):
+    store = covers.CoverStore(str(tmp_path / "cache"))
+    client = MagicMock()
+    client.get.return_value = _response(200, b"<html>", {"Content-Type": "text/html"})
+    counts = covers.sync_covers(["http://p.example/x"], store, str(tmp_path / "out"), client)
+    assert counts == {"error": 1, "published": 0}
+    assert store.get("http://p.example/x") is None
+
+
+def test_variants_are_square_jpegs(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    buf = io.BytesIO()
+    Image.new("RGB", (800, 500), "red").save(buf, "PNG")
+    store = covers.CoverStore(str(tmp_path / "cache"))
+    client = MagicMock()
+    client.get.return_value = _response(200, buf.getvalue(), {"Content-Type": "image/png"})
+    out = tmp_path / "out"
+    covers.sync_covers(["http://p.example/x"], store, str(out), client, sizes=(1400, 300))
+    sha = store.get("http://p.example/x")["sha256"]
+    for size in (1400, 300):
+        with Image.open(out / f"{sha}-{size}.jpg") as img:
+            assert img.size == (size, size) and img.format == "JPEG"
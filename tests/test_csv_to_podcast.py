@@ -98,3 +98,253 @@ def test_invalid_content_type_is_skipped(mock_head, capsys):
     assert item is None
     out = capsys.readouterr().out
     assert "Invalid Content-Type" in out
+
+
+@patch("tools.csv_to_podcast.requests.head")
+def test_probe_enclosures_keeps_failures_per_url(mock_head):
+    from tools.csv_to_podcast import probe_enclosures
+
+    def fake_head(url, **kwargs):
+        if url.endswith("bad.mp3"):
+            return _mock_response({"Content-Type": "text/html", "Content-Length": "1"})
+        return _mock_response({"Content-Type": "audio/mpeg", "Content-Length": "9"})
+
+    mock_head.side_effect = fake_head
+    urls = ["http://a.example/ok.mp3", "http://b.example/bad.mp3", "http://a.example/ok.mp3"]
+    probes = probe_enclosures(urls, workers=4, per_host=1)
+    assert probes["http://a.example/ok.mp3"] == 9
+    assert isinstance(probes["http://b.example/bad.mp3"], RuntimeError)
+    assert mock_head.call_count == 2
+
+    row = {"Book_Title": "T", "FullBook_MP3_URL": "http://b.example/bad.mp3"}
+    assert build_item(row, "Wed, 01 Jan 2024 00:00:00 +0000", probes[row["FullBook_MP3_URL"]]) is None
+
+
+@patch("tools.csv_to_podcast.requests.head")
+def test_fresh_cache_entry_skips_network(mock_head, tmp_path):
+    from tools.csv_to_podcast import fetch_audio_length
+    from tools.enclosure_cache import EnclosureCache
+
+    mock_head.return_value = _mock_response(
+        {"Content-Type": "audio/mpeg", "Content-Length": "42", "ETag": '"v1"'}
+    )
+    cache = EnclosureCache(str(tmp_path / "enc.sqlite"))
+    url = "http://example.com/a.mp3"
+    assert fetch_audio_length(url, cache=cache) == 42
+    assert fetch_audio_length(url, cache=cache) == 42
+    assert mock_head.call_count == 1
+
+    # Forced revalidation sends a conditional request; 304 keeps the entry.
+    not_modified = _mock_response({})
+    not_modified.status_code = 304
+    mock_head.return_value = not_modified
+    assert fetch_audio_length(url, cache=cache, revalidate=True) == 42
+    assert mock_head.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+    cache.close()
+
+
+@patch("tools.csv_to_podcast.requests.head")
+def test_cached_rejection_is_replayed(mock_head, tmp_path):
+    from tools.csv_to_podcast import fetch_audio_length
+    from tools.enclosure_cache import EnclosureCache
+
+    mock_head.return_value = _mock_response({"Content-Type": "text/html"})
+    cache = EnclosureCache(str(tmp_path / "enc.sqlite"))
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match="Invalid Content-Type"):
+            fetch_audio_length("http://example.com/x", cache=cache)
+    assert mock_head.call_count == 1
+    cache.close()
+
+
+def test_iter_rows_sniffs_cp1256(tmp_path):
+    from tools.csv_to_podcast import iter_rows, sniff_encoding
+
+    path = tmp_path / "books.csv"
+    path.write_bytes("Book_Title\nکتاب\n".replace("ک", "ك").encode("cp1256"))
+    assert sniff_encoding(str(path)) == "cp1256"
+    assert list(iter_rows(str(path))) == [{"Book_Title": "كتاب"}]
+
+
+def test_atomic_writer_keeps_old_feed_on_failure(tmp_path):
+    from tools.csv_to_podcast import AtomicWriter
+
+    target = tmp_path / "podcast.xml"
+    target.write_text("old", encoding="utf-8")
+    with pytest.raises(ValueError):
+        with AtomicWriter(str(target)) as f:
+            f.write("half")
+            raise ValueError
+    assert target.read_text(encoding="utf-8") == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["podcast.xml"]
+
+    with AtomicWriter(str(target)) as f:
+        f.write("new")
+    assert target.read_text(encoding="utf-8") == "new"
+
+
+def test_incremental_rebuild_reuses_unchanged_items(tmp_path):
+    import csv
+    import tools.csv_to_podcast as mod
+
+    def write_csv(rows):
+        path = tmp_path / "books.csv"
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            w = csv.DictWriter(f, fieldnames=["Book_Title", "FullBook_MP3_URL", "FullBook_MP3_Size"])
+            w.writeheader()
+            w.writerows(rows)
+        return str(path)
+
+    probed = []
+
+    def head(url, **kwargs):
+        probed.append(url)
+        return _mock_response({"Content-Type": "audio/mpeg", "Content-Length": "5"})
+
+    client = MagicMock()
+    client.head = head
+    out = str(tmp_path / "podcast.xml")
+    argv = ["--site", "https://x", "--out", out, "--no-cache", "--incremental"]
+    rows = [
+        {"Book_Title": "A", "FullBook_MP3_URL": "http://e.com/a.mp3"},
+        {"Book_Title": "B", "FullBook_MP3_URL": "http://e.com/b.mp3"},
+    ]
+    with patch.object(mod, "default_client", return_value=client), \
+            patch.object(mod, "now_rfc822", return_value="FIRST"):
+        mod.main(["--csv", write_csv(rows)] + argv)
+    assert len(probed) == 2
+
+    rows[1]["Book_Title"] = "B2"
+    rows.append({"Book_Title": "C", "FullBook_MP3_URL": "http://e.com/c.mp3"})
+    probed.clear()
+    with patch.object(mod, "default_client", return_value=client), \
+            patch.object(mod, "now_rfc822", return_value="SECOND"):
+        mod.main(["--csv", write_csv(rows)] + argv)
+    assert sorted(probed) == ["http://e.com/b.mp3", "http://e.com/c.mp3"]
+
+    index = mod.index_feed(out)
+    dates = {url[-5]: index[mod.item_guid(url)].pubdate for url in
+             ("http://e.com/a.mp3", "http://e.com/b.mp3", "http://e.com/c.mp3")}
+    assert dates == {"a": "FIRST", "b": "SECOND", "c": "SECOND"}
+
+    # A recorded size that differs from the published length is not reused.
+    rows[0]["FullBook_MP3_Size"] = "11"
+    with patch.object(mod, "default_client", return_value=client), \
+            patch.object(mod, "now_rfc822", return_value="THIRD"):
+        mod.main(["--csv", write_csv(rows)] + argv)
+    entry = mod.index_feed(out)[mod.item_guid("http://e.com/a.mp3")]
+    assert (entry.length, entry.pubdate) == (11, "THIRD")
+
+
+def test_iter_items_keeps_order_with_a_small_window():
+    from tools.csv_to_podcast import iter_items
+
+    probed = []
+
+    def head(url, **kwargs):
+        probed.append(url)
+        return _mock_response({"Content-Type": "audio/mpeg", "Content-Length": "7"})
+
+    client = MagicMock()
+    client.head = head
+    rows = ({"Book_Title": name, "FullBook_MP3_URL": f"http://e.com/{name}.mp3"} for name in "aabc")
+    items = list(iter_items(rows, "D", batch=2, workers=2, client=client))
+    assert [it.split("<title>")[1][0] for it in items] == list("aabc")
+    # The duplicate arrives while the first probe is still in the window.
+    assert sorted(probed) == ["http://e.com/a.mp3", "http://e.com/b.mp3", "http://e.com/c.mp3"]
+
+
+def test_recorded_sizes_replace_probes_except_for_the_sample():
+    from tools.csv_to_podcast import iter_items, verify_sampled
+
+    probed = []
+
+    def head(url, **kwargs):
+        probed.append(url)
+        return _mock_response({"Content-Type": "audio/mpeg", "Content-Length": "99"})
+
+    client = MagicMock()
+    client.head = head
+    urls = [f"http://e.com/{i}.mp3" for i in range(40)]
+    rows = [{"Book_Title": "t", "FullBook_MP3_URL": u, "FullBook_MP3_Size": "7",
+             "FullBook_MP3_Type": "audio/mpeg"} for u in urls]
+    rows.append({"Book_Title": "t", "FullBook_MP3_URL": "http://e.com/nosize.mp3"})
+
+    items = list(iter_items(rows, "D", workers=2, client=client))
+    assert probed == ["http://e.com/nosize.mp3"]
+    assert sum('length="7"' in it for it in items) == 40
+
+    probed.clear()
+    items = list(iter_items(rows, "D", workers=2, client=client, verify_sample=0.5))
+    sampled = [u for u in urls if verify_sampled(u, 0.5)]
+    assert 0 < len(sampled) < len(urls)
+    assert sorted(probed) == sorted(sampled + ["http://e.com/nosize.mp3"])
+    # A sampled probe that disagrees with the record wins.
+    assert sum('length="99"' in it for it in items) == len(sampled) + 1
+
+
+def test_feed_from_catalog_records_published_items(tmp_path):
+    import tools.csv_to_podcast as mod
+    from tools.catalog import Catalog
+
+    db = str(tmp_path / "catalog.sqlite")
+    cat = Catalog(db)
+    for bid in ("1", "2"):
+        cat.put_book({"AudioBook_ID": bid, "Book_Title": "T" + bid, "FullBook_MP3_URL": f"http://e.com/{bid}.mp3"})
+        cat.link_run("tag", bid)
+    cat.close()
+
+    probed = []
+
+    def head(url, **kwargs):
+        probed.append(url)
+        return _mock_response({"Content-Type": "audio/mpeg", "Content-Length": "5"})
+
+    client = MagicMock()
+    client.head = head
+    out = tmp_path / "podcast.xml"
+    argv = ["--catalog", db, "--run-name", "tag", "--site", "https://x", "--out", str(out), "--no-cache", "--incremental"]
+    with patch.object(mod, "default_client", return_value=client):
+        mod.main(argv)
+    assert out.read_text(encoding="utf-8").count("<item>") == 2
+    assert len(Catalog(db).feed_items("tag")) == 2
+
+    # Without the previous podcast.xml the catalog still allows reuse.
+    out.unlink()
+    probed.clear()
+    with patch.object(mod, "default_client", return_value=client):
+        mod.main(argv)
+    assert probed == []
+
+
+def test_paged_feed_links_pages_and_drops_stale_ones(tmp_path):
+    import csv
+    import gzip
+    import xml.etree.ElementTree as ET
+    import tools.csv_to_podcast as mod
+
+    path = tmp_path / "books.csv"
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        w = csv.DictWriter(f, fieldnames=["Book_Title", "FullBook_MP3_URL"])
+        w.writeheader()
+        w.writerows({"Book_Title": f"T{i}", "FullBook_MP3_URL": f"http://e.com/{i}.mp3"} for i in range(5))
+    client = MagicMock()
+    client.head = lambda url, **kw: _mock_response({"Content-Type": "audio/mpeg", "Content-Length": "5"})
+    out = tmp_path / "feeds" / "podcast.xml"
+    argv = ["--csv", str(path), "--site", "https://x", "--run-name", "r", "--out", str(out), "--no-cache"]
+
+    with patch.object(mod, "default_client", return_value=client):
+        mod.main(argv + ["--page-size", "2", "--precompress"])
+    pages = mod.existing_pages(str(out))
+    assert [p.rsplit("/", 1)[1] for p in pages] == ["podcast.xml", "podcast-2.xml", "podcast-3.xml"]
+    atom = "{http://www.w3.org/2005/Atom}link"
+    channel = ET.parse(pages[1]).getroot().find("channel")
+    links = {l.get("rel"): l.get("href") for l in channel.findall(atom)}
+    assert links == {"self": "https://x/feeds/r/podcast-2.xml", "first": "https://x/feeds/r/podcast.xml",
+                     "previous": "https://x/feeds/r/podcast.xml", "next": "https://x/feeds/r/podcast-3.xml"}
+    assert [i.findtext("title") for i in channel.findall("item")] == ["T2", "T3"]
+    assert gzip.decompress((tmp_path / "feeds" / "podcast-2.xml.gz").read_bytes()) == open(pages[1], "rb").read()
+
+    with patch.object(mod, "default_client", return_value=client):
+        mod.main(argv)
+    assert sorted(p.name for p in (tmp_path / "feeds").glob("podcast*")) == ["podcast.xml"]
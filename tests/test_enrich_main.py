@@ -0,0 +1,247 @@
+import csv
+import importlib.util
+import pathlib
+import random
+import time
+
+script_path = pathlib.Path(__file__).resolve().parents[1] / 'script_iran_seda_final_STREAM_MERGE_v6_env.py'
+spec = importlib.util.spec_from_file_location('script_module_main', script_path)
+mod = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mod)
+
+
+def _write_input(path, ids):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["AudioBook_ID", "URL"])
+        for i in ids:
+            w.writerow([i, f"https://book.iranseda.ir/DetailsAlbum/?VALID=TRUE&g={i}"])
+
+
+def _read_ids(path):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return [r["AudioBook_ID"] for r in csv.DictReader(f)]
+
+
+def test_concurrent_main_keeps_input_order(tmp_path, monkeypatch):
+    ids = list(range(100, 130))
+    inp = tmp_path / "in.csv"
+    _write_input(inp, ids)
+
+    def fake_enrich(url):
+        g = url.rsplit("=", 1)[1]
+        time.sleep(random.uniform(0, 0.01))
+        if int(g) % 7 == 0:
+            raise RuntimeError("boom")
+        return {"AudioBook_ID": g, "Book_Title": f"t{g}"}
+
+    monkeypatch.setattr(mod, "enrich_url", fake_enrich)
+    monkeypatch.setattr(mod, "INPUT_CSV", str(inp))
+    monkeypatch.setattr(mod, "OUT_CSV", str(tmp_path / "merged.csv"))
+    monkeypatch.setattr(mod, "ERR_CSV", str(tmp_path / "errors.csv"))
+    monkeypatch.setattr(mod, "CHECKPOINT", str(tmp_path / "checkpoint.jsonl"))
+    monkeypatch.setattr(mod, "CATALOG_PATH", str(tmp_path / "catalog.sqlite"))
+    monkeypatch.setattr(mod, "ENRICH_WORKERS", 8)
+    mod.main()
+
+    ok = [str(i) for i in ids if i % 7]
+    bad = [str(i) for i in ids if not i % 7]
+    assert _read_ids(tmp_path / "merged.csv") == ok
+    assert _read_ids(tmp_path / "errors.csv") == bad
+
+
+def test_rerun_resumes_and_retries_listed_errors(tmp_path, monkeypatch):
+    ids = [1, 2, 3, 4, 5]
+    inp = tmp_path / "in.csv"
+    _write_input(inp, ids)
+    calls = []
+    failing = {"2", "4"}
+
+    def fake_enrich(url):
+        g = url.rsplit("=", 1)[1]
+        calls.append(g)
+        if g in failing:
+            raise RuntimeError("boom")
+        return {"AudioBook_ID": g}
+
+    monkeypatch.setattr(mod, "enrich_url", fake_enrich)
+    monkeypatch.setattr(mod, "INPUT_CSV", str(inp))
+    monkeypatch.setattr(mod, "OUT_CSV", str(tmp_path / "merged.csv"))
+    monkeypatch.setattr(mod, "ERR_CSV", str(tmp_path / "errors.csv"))
+    monkeypatch.setattr(mod, "CHECKPOINT", str(tmp_path / "checkpoint.jsonl"))
+    monkeypatch.setattr(mod, "CATALOG_PATH", str(tmp_path / "catalog.sqlite"))
+    monkeypatch.setattr(mod, "RESUME", True)
+    mod.main()
+    assert _read_ids(tmp_path / "errors.csv") == ["2", "4"]
+
+    # Drop "4" from the errors CSV: only "2" is retried on the next run.
+    with open(tmp_path / "errors.csv", "w", newline="", encoding="utf-8-sig") as f:
+        f.write("AudioBook_ID,Error\n2,boom\n")
+    failing.clear()
+    calls.clear()
+    mod.main()
+    assert calls == ["2"]
+    assert _read_ids(tmp_path / "merged.csv") == ["1", "2", "3", "5"]
+    assert not (tmp_path / "errors.csv").exists()
+
+
+def test_api_mode_skips_details_page_when_json_is_enough(monkeypatch):
+    import json
+
+    page_html = ("<html><body><h1>از صفحه</h1><ul class='metadata-list'>"
+                 "<li><dt>نویسنده</dt><dd>ژول ورن</dd></li><li><dt>مهندس صدا</dt><dd>رضا</dd></li>"
+                 "</ul></body></html>")
+    payload = {"title": "از API", "items": [{"download": [
+        {"extension": "mp3", "downloadUrl": "https://player.iranseda.ir/downloadfile/?attid=2&q=11", "fileSize": "10"},
+    ]}]}
+    fetched = []
+
+    class _Resp:
+        def __init__(self, text=None, data=None):
+            self.text, self._data = text, data
+
+        def json(self):
+            return self._data
+
+    def fake_get(url):
+        fetched.append(url)
+        if "apisec" in url:
+            return _Resp(data=payload)
+        return _Resp(text=page_html)
+
+    monkeypatch.setattr(mod, "req_get", fake_get)
+    url = "https://book.iranseda.ir/DetailsAlbum/?VALID=TRUE&g=7&attid=3"
+
+    monkeypatch.setattr(mod, "API_REQUIRED_FIELDS", ["Book_Title"])
+    parsed = mod.enrich_url_api(url)
+    assert len(fetched) == 1 and "apisec" in fetched[0]
+    assert parsed["Book_Title"] == "از API"
+    assert parsed["Player_Link"] == mod.build_player_link("7", 3)
+    assert json.loads(parsed["Field_Sources"])["FullBook_MP3_URL"] == "api"
+    assert (parsed["FullBook_MP3_Size"], parsed["FullBook_MP3_Type"], parsed["FullBook_MP3_Quality"]) == (10, "audio/mpeg", "11")
+    assert json.loads(parsed["All_MP3s_Meta"]) == parsed["mp3_files"]
+
+    # A required field the API lacks pulls in the page, for that field only.
+    fetched.clear()
+    monkeypatch.setattr(mod, "API_REQUIRED_FIELDS", ["Book_Title", "Book_Author"])
+    parsed = mod.enrich_url_api(url)
+    assert len(fetched) == 2
+    sources = json.loads(parsed["Field_Sources"])
+    assert parsed["Book_Title"] == "از API" and sources["Book_Title"] == "api"
+    assert parsed["Book_Author"] == "ژول ورن" and sources["Book_Author"] == "html"
+
+    # By default any field the page provides and the API lacks pulls it in.
+    fetched.clear()
+    monkeypatch.setattr(mod, "API_REQUIRED_FIELDS", [])
+    parsed = mod.enrich_url_api(url)
+    assert len(fetched) == 2
+    assert parsed["Book_SoundEngineer"] == "رضا" and json.loads(parsed["Field_Sources"])["Book_SoundEngineer"] == "html"
+
+
+def test_books_refreshed_by_another_run_come_from_the_catalog(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_enrich(url):
+        g = url.rsplit("=", 1)[1]
+        calls.append(g)
+        return {"AudioBook_ID": g, "Book_Title": f"t{g}"}
+
+    monkeypatch.setattr(mod, "enrich_url", fake_enrich)
+    monkeypatch.setattr(mod, "CATALOG_PATH", str(tmp_path / "catalog.sqlite"))
+    monkeypatch.setattr(mod, "RESUME", False)
+    for run, ids in (("tagA", [1, 2, 3]), ("tagB", [3, 4, 1])):
+        run_dir = tmp_path / run
+        run_dir.mkdir()
+        _write_input(run_dir / "in.csv", ids)
+        monkeypatch.setattr(mod, "RUN_NAME", run)
+        monkeypatch.setattr(mod, "INPUT_CSV", str(run_dir / "in.csv"))
+        monkeypatch.setattr(mod, "OUT_CSV", str(run_dir / "merged.csv"))
+        monkeypatch.setattr(mod, "ERR_CSV", str(run_dir / "errors.csv"))
+        monkeypatch.setattr(mod, "CHECKPOINT", str(run_dir / "checkpoint.jsonl"))
+        mod.main()
+
+    assert calls == ["1", "2", "3", "4"]
+    assert _read_ids(tmp_path / "tagB" / "merged.csv") == ["3", "4", "1"]
+    cat = mod.Catalog(str(tmp_path / "catalog.sqlite"))
+    assert [r["AudioBook_ID"] for r in cat.run_books("tagB")] == ["3", "4", "1"]
+
+    # The next crawl of tagB lists a new book first; the catalog follows the input order.
+    _write_input(tmp_path / "tagB" / "in.csv", [5, 3, 4, 1])
+    monkeypatch.setattr(mod, "RESUME", True)
+    mod.main()
+    assert [r["AudioBook_ID"] for r in cat.run_books("tagB")] == ["5", "3", "4", "1"]
+    assert cat.runs_of(1) == ["tagA", "tagB"]
+
+
+def test_probed_bitrate_picks_the_published_file(monkeypatch):
+    files = [{"url": "http://e.com/d/?attid=1", "file_size": 300, "type": "audio/mpeg", "quality": "11"},
+             {"url": "http://e.com/d/?attid=2", "file_size": 100, "type": "audio/mpeg", "quality": "11"}]
+    bitrates = {"http://e.com/d/?attid=1": 64, "http://e.com/d/?attid=2": 128}
+
+    def fake_probe(files, cache=None, client=None):
+        return [dict(f, bitrate=bitrates[f["url"]], duration=1440.6, sample_rate=44100) for f in files]
+
+    monkeypatch.setattr(mod, "probe_files", fake_probe)
+    monkeypatch.setattr(mod, "mp3_headers", lambda: None)
+    assert mod.mp3_columns(mod.probe_mp3_files(files))["FullBook_MP3_URL"] == files[0]["url"]
+
+    monkeypatch.setattr(mod, "MP3_PROBE", True)
+    cols = mod.mp3_columns(mod.probe_mp3_files(files))
+    assert cols["FullBook_MP3_URL"] == files[1]["url"]
+    assert (cols["FullBook_MP3_Bitrate"], cols["FullBook_MP3_Duration"], cols["FullBook_MP3_Size"]) == (128, 1441, 100)
+    assert mod.summarize_mp3_files(mod.probe_mp3_files(files))[0] == files[1]["url"]
+    # A malformed payload has no MP3 files instead of failing the book.
+    assert mod.mp3_files_from_api_data({"items": [{"download": [{"extension": "mp3", "fileSize": "n/a"}]}]}) == []
+
+
+def test_shards_split_the_input_and_merge_back_in_order(tmp_path, monkeypatch):
+    ids = list(range(200, 240))
+    inp = tmp_path / "in.csv"
+    _write_input(inp, ids)
+
+    def fake_enrich(url):
+        g = url.rsplit("=", 1)[1]
+        if int(g) % 9 == 0:
+            raise RuntimeError("boom")
+        return {"AudioBook_ID": g, "Book_Title": f"t{g}"}
+
+    monkeypatch.setattr(mod, "enrich_url", fake_enrich)
+    monkeypatch.setattr(mod, "INPUT_CSV", str(inp))
+    monkeypatch.setattr(mod, "CATALOG", False)
+    monkeypatch.setattr(mod, "SHARD_COUNT", 3)
+    monkeypatch.setattr(mod, "MERGED_CSV", str(tmp_path / "merged.csv"))
+    monkeypatch.setattr(mod, "MERGED_ERR_CSV", str(tmp_path / "errors.csv"))
+    seen = []
+    for shard in range(3):
+        suffix = f".shard-{shard}-of-3"
+        monkeypatch.setattr(mod, "SHARD_INDEX", shard)
+        monkeypatch.setattr(mod, "OUT_CSV", str(tmp_path / f"merged{suffix}.csv"))
+        monkeypatch.setattr(mod, "ERR_CSV", str(tmp_path / f"errors{suffix}.csv"))
+        monkeypatch.setattr(mod, "CHECKPOINT", str(tmp_path / f"checkpoint{suffix}.jsonl"))
+        mod.main()
+        got = _read_ids(tmp_path / f"merged{suffix}.csv")
+        assert all(mod.shard_of(i, 3) == shard for i in got)
+        seen += got
+    assert sorted(seen) == sorted(str(i) for i in ids if i % 9)
+
+    # A book enriched twice (e.g. a retried runner) is merged once.
+    with open(tmp_path / "merged.shard-0-of-3.csv", "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow([seen[-1], "dup"])
+    assert mod.merge_shards() == len(seen)
+    assert _read_ids(tmp_path / "merged.csv") == [str(i) for i in ids if i % 9]
+    assert _read_ids(tmp_path / "errors.csv") == [str(i) for i in ids if not i % 9]
+
+
+def test_resume_upgrades_an_older_merged_csv_header(tmp_path):
+    merged = tmp_path / "merged.csv"
+    merged.write_text("AudioBook_ID,Book_Title,Old_Column\n1,t1,x\n", encoding="utf-8-sig")
+    appender = mod.CsvAppender(merged, mod.CSV_FIELDS)
+    appender.write({"AudioBook_ID": "2", "FullBook_MP3_Size": "1234"})
+    appender.close()
+
+    with open(merged, encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+    assert reader.fieldnames == list(mod.CSV_FIELDS) + ["Old_Column"]
+    assert [(r["AudioBook_ID"], r["Old_Column"], r["FullBook_MP3_Size"]) for r in rows] == [
+        ("1", "x", ""), ("2", "", "1234")]
@@ -0,0 +1,42 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from tools.http_cache import CacheMiss, ResponseCache, cached_get
+
+
+def _response(status, body=b"", headers=None):
+    r = MagicMock()
+    r.status_code = status
+    r.content = body
+    r.headers = headers or {}
+    return r
+
+
+def test_conditional_get_replays_body_on_304(tmp_path):
+    cache = ResponseCache(str(tmp_path / "http.sqlite"))
+    url = "https://book.iranseda.ir/Details?g=1"
+    fetch = MagicMock(return_value=_response(200, "<h1>کتاب</h1>".encode(), {"ETag": '"a"'}))
+    first = cached_get(url, cache=cache, offline=False, fetch=fetch)
+    assert first.status_code == 200 and not first.from_cache
+
+    fetch.return_value = _response(304)
+    second = cached_get(url, cache=cache, offline=False, fetch=fetch)
+    assert fetch.call_args.kwargs["headers"] == {"If-None-Match": '"a"'}
+    assert "timeout" not in fetch.call_args.kwargs  # the client's HTTP_TIMEOUT applies
+    assert second.from_cache
+    second.encoding = "utf-8"
+    assert second.text == "<h1>کتاب</h1>"
+    cache.close()
+
+
+def test_offline_mode_never_fetches(tmp_path):
+    cache = ResponseCache(str(tmp_path / "http.sqlite"))
+    fetch = MagicMock(return_value=_response(200, b'{"items": []}'))
+    cached_get("https://apisec.iranseda.ir/x", cache=cache, offline=False, fetch=fetch)
+    fetch.reset_mock()
+    assert cached_get("https://apisec.iranseda.ir/x", cache=cache, offline=True, fetch=fetch).json() == {"items": []}
+    with pytest.raises(CacheMiss):
+        cached_get("https://apisec.iranseda.ir/y", cache=cache, offline=True, fetch=fetch)
+    fetch.assert_not_called()
+    cache.close()
@@ -0,0 +1,55 @@
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from tools.http_client import AdaptiveRateLimiter, HttpClient
+
+
+def _response(status, headers=None):
+    r = MagicMock()
+    r.status_code = status
+    r.headers = headers or {}
+    return r
+
+
+def _client(responses, retries=3):
+    session = MagicMock()
+    session.request.side_effect = responses
+    sleeps = []
+    client = HttpClient(retries=retries, session_factory=lambda: session, sleep=sleeps.append)
+    return client, session, sleeps
+
+
+def test_retries_5xx_and_honours_retry_after():
+    client, session, sleeps = _client([_response(503, {"Retry-After": "2"}), _response(200)])
+    assert client.get("https://apisec.iranseda.ir/x").status_code == 200
+    assert session.request.call_count == 2
+    assert sleeps == [2.0]
+
+
+def test_gives_up_after_retries():
+    client, session, _ = _client([requests.Timeout()] * 3, retries=2)
+    with pytest.raises(requests.Timeout):
+        client.get("https://book.iranseda.ir/")
+    assert session.request.call_count == 3
+
+    client, _, _ = _client([_response(429)] * 2, retries=1)
+    assert client.get("https://book.iranseda.ir/").status_code == 429
+
+
+def test_sessions_are_pooled_per_host():
+    client = HttpClient()
+    assert client.session("a.example") is client.session("a.example")
+    assert client.session("a.example") is not client.session("b.example")
+
+
+def test_rate_adapts_to_server_health():
+    limiter = AdaptiveRateLimiter(max_rps=4, min_rps=0.5, initial_rps=2, latency_target=1.0)
+    for _ in range(30):
+        limiter.record("h", 0.1, ok=True)
+    assert limiter.rate("h") == 4
+    limiter.record("h", 0.1, ok=False)
+    assert limiter.rate("h") == 2
+    limiter.record("h", 5.0, ok=True)
+    assert limiter.rate("h") == 1.5
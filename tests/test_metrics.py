@@ -0,0 +1,44 @@
+import json
+
+import requests
+
+from tools import metrics
+from tools.csv_to_podcast import skip_reason
+
+
+def test_registry_snapshot_and_prometheus_text():
+    reg = metrics.Registry()
+    reg.inc("http_requests_total", host="a", status=200)
+    reg.inc("http_requests_total", 2, host="a", status=200)
+    reg.observe("http_request_seconds", 0.02, host="a")
+    reg.observe("http_request_seconds", 3.0, host="a")
+    snap = reg.snapshot()
+    assert snap["counters"] == [{"name": "http_requests_total", "labels": {"host": "a", "status": "200"}, "value": 3}]
+    hist = snap["histograms"][0]
+    assert hist["count"] == 2 and dict(hist["buckets"])[0.025] == 1 and hist["buckets"][-1] == ["+Inf", 2]
+
+    text = metrics.render_prometheus({"enrich": snap})
+    assert "# TYPE radioseda_http_requests_total counter" in text
+    assert 'radioseda_http_requests_total{stage="enrich",host="a",status="200"} 3' in text
+    assert 'radioseda_http_request_seconds_bucket{stage="enrich",host="a",le="+Inf"} 2' in text
+
+
+def test_stage_run_merges_stages(tmp_path):
+    with metrics.stage_run("scrape", str(tmp_path)):
+        metrics.inc("scrape_pages_total", status="ok")
+    with metrics.stage_run("feed", str(tmp_path)):
+        metrics.inc("feed_items_skipped_total", reason="no_audio")
+    report = json.loads((tmp_path / "metrics.json").read_text(encoding="utf-8"))
+    assert set(report["stages"]) == {"scrape", "feed"}
+    assert report["stages"]["feed"]["counters"][0]["labels"] == {"reason": "no_audio"}
+    prom = (tmp_path / "metrics.prom").read_text(encoding="utf-8")
+    assert 'radioseda_stage_seconds{stage="scrape"}' in prom
+
+
+def test_skip_reasons():
+    response = requests.Response()
+    response.status_code = 404
+    assert skip_reason(requests.HTTPError(response=response)) == "http_404"
+    assert skip_reason(requests.ConnectionError()) == "network"
+    assert skip_reason(RuntimeError("Invalid Content-Type: text/html")) == "content_type"
+    assert skip_reason(RuntimeError("Missing Content-Length")) == "content_length"
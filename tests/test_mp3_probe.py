@@ -0,0 +1,64 @@
+import struct
+
+from benchmarks.stub_server import MP3_LENGTH, StubServer
+from tools import mp3_probe
+from tools.http_client import HttpClient
+
+
+def _vbr_prefix(tag_size):
+    """ID3v2 tag of ``tag_size`` bytes, then a 44.1 kHz MPEG-1 Layer III frame with a Xing header."""
+    tag = b"ID3\x04\x00\x00" + bytes((tag_size >> s) & 0x7F for s in (21, 14, 7, 0)) + bytes(tag_size)
+    header = bytes((0xFF, 0xFB, 0x90, 0x00))  # 128 kbps stereo
+    xing = b"Xing" + struct.pack(">III", 0x03, 38281, 15_000_000)
+    return tag + (header + bytes(32) + xing).ljust(417, b"\x00") + header.ljust(417, b"\x00")
+
+
+def test_xing_frames_give_exact_duration_and_average_bitrate():
+    info = mp3_probe.parse_mp3_header(_vbr_prefix(100), file_size=15_000_200)
+    assert info["vbr"] == "xing"
+    assert info["duration"] == round(38281 * 1152 / 44100, 3)
+    assert info["bitrate"] == round(15_000_000 * 8 / info["duration"] / 1000)
+    assert info["audio_start"] == 110
+
+
+def test_large_id3_tag_needs_a_second_range(monkeypatch):
+    data = _vbr_prefix(40_000)
+    ranges = []
+
+    def fake_fetch(url, start, client, size=mp3_probe.PROBE_BYTES):
+        ranges.append(start)
+        return data[start:start + size], len(data) + 10_000_000
+
+    monkeypatch.setattr(mp3_probe, "_fetch_range", fake_fetch)
+    info = mp3_probe.probe_mp3("http://e.com/downloadfile/?attid=5", client=object())
+    assert ranges == [0, 40_010]
+    assert info["audio_start"] == 40_010 and info["vbr"] == "xing"
+
+
+def test_stub_files_are_probed_once_and_chosen_by_bitrate(tmp_path):
+    cache = mp3_probe.Mp3HeaderCache(str(tmp_path / "mp3.sqlite"))
+    with StubServer() as stub:
+        files = [{"url": stub.base + f"/downloadfile/?attid=7000{i}&q=11", "file_size": size}
+                 for i, size in ((1, 100), (2, 300), (3, 200))]
+        client = HttpClient()
+        probed = mp3_probe.probe_files(files, cache=cache, client=client)
+        assert [f["bitrate"] for f in probed] == [128, 64, 96]
+        assert probed[0]["duration"] == round((MP3_LENGTH - 2048) // 417 * 1152 / 44100, 3)
+        assert stub.range_requests == 3
+
+        assert mp3_probe.probe_files(files, cache=cache, client=client) == probed
+        assert stub.range_requests == 3
+    cache.close()
+
+    assert mp3_probe.choose_file(probed)["bitrate"] == 128
+    assert mp3_probe.choose_file(probed, max_bitrate=100)["bitrate"] == 96
+    assert mp3_probe.choose_file(probed, max_bitrate=32)["bitrate"] == 64
+    assert mp3_probe.choose_file(files)["file_size"] == 300
+
+
+def test_probed_duration_is_used_for_itunes_duration():
+    from tools.csv_to_podcast import build_item
+
+    row = {"Book_Title": "t", "Book_Duration": "۲۴ دقیقه", "FullBook_MP3_URL": "http://e.com/a.mp3",
+           "FullBook_MP3_Duration": "1441"}
+    assert "<itunes:duration>0:24:01</itunes:duration>" in build_item(row, "D", 7)
@@ -21,3 +21,52 @@ def test_cover_image_url_is_absolute():
     url = "https://book.iranseda.ir/Details?VALID=TRUE&g=5678"
     parsed = parse_page(html, url)
     assert parsed["Cover_Image_URL"] == "https://book.iranseda.ir/images/cover.jpg?AttID=1234"
+
+
+RICH_HTML = '''<html><head>
+<meta property="og:image" content="https://player.iranseda.ir/picture?AttID=521584&s=c" />
+<script>var x = "<li><dt>زبان</dt></li>";</script>
+</head><body>
+<nav><ul><li><a href="/">خانه</a></li></ul></nav>
+<div class="container">
+  <h1>بیست هزار فرسنگ زیر دریا</h1>
+  <div class="short-description">خلاصه</div>
+  <div class="full-description"><p>متن کامل</p></div>
+  <ul class="item-info">
+    <li><span>مدت زمان:</span> 02:10:00</li>
+    <li><span>تعداد قسمت:</span> 8</li>
+  </ul>
+  <ul class="metadata-list">
+    <li><dt>زبان</dt><dd>فارسی</dd></li>
+    <li><dt>نویسنده</dt><dd>ژول ورن</dd></li>
+    <li><dt>گوینده</dt><dd>گوینده‌ای</dd></li>
+    <li><dt>ژانر</dt><dd>علمی تخیلی</dd></li>
+    <li><dt>دسته‌بندی</dt></li>
+  </ul>
+  <img src="/img/logo.png" />
+  <img src="https://player.iranseda.ir/picture?AttID=999" />
+</div>
+</body></html>'''
+
+
+def test_backends_agree_with_legacy_helpers():
+    url = "https://book.iranseda.ir/DetailsAlbum/?VALID=TRUE&g=674800"
+    bs4_result = parse_page(RICH_HTML, url, backend="bs4")
+    fast_result = parse_page(RICH_HTML, url, backend="fast")
+    assert bs4_result == fast_result
+
+    soup = mod.BeautifulSoup(RICH_HTML, "html.parser")
+    for key, label in mod.METADATA_LABELS:
+        assert bs4_result[key] == mod.parse_from_metadata_list(soup, label)
+    assert (bs4_result["Book_Duration"], bs4_result["Episode_Count"]) == mod.parse_duration_and_episodes(soup)
+    assert bs4_result["attid"] == mod.extract_attid(soup) == 521584
+    assert bs4_result["Book_Author"] == "ژول ورن"
+    assert bs4_result["Episode_Count"] == "8"
+
+
+def test_fixture_same_on_every_backend():
+    html = '''<html><head>
+    <meta property="og:image" content="/images/cover.jpg?AttID=1234" />
+    </head><body><h1>Example Book</h1></body></html>'''
+    url = "https://book.iranseda.ir/Details?VALID=TRUE&g=5678"
+    assert parse_page(html, url, backend="bs4") == parse_page(html, url, backend="fast")
@@ -0,0 +1,72 @@
+import pipeline
+
+
+def test_resumed_books_keep_their_crawl_position():
+    order = []
+    crawl = pipeline._record_order(({"AudioBook_ID": i} for i in (9, 8, 7, 6, 5)), order)
+    earlier = [{"AudioBook_ID": "7"}, {"AudioBook_ID": "5"}, {"AudioBook_ID": "1"}]
+    # Books 7 and 5 were enriched by an earlier run; 1 is no longer listed.
+    enriched = ({"AudioBook_ID": str(r["AudioBook_ID"])} for r in crawl if r["AudioBook_ID"] not in (7, 5))
+    rows = pipeline._in_crawl_order(earlier, enriched, order)
+    assert [r["AudioBook_ID"] for r in rows] == ["9", "8", "7", "6", "5", "1"]
+
+
+def test_stopped_pump_still_ends_its_queue():
+    import queue
+    import threading
+
+    stop = threading.Event()
+    q = queue.Queue(maxsize=2)
+
+    def source():
+        for i in range(10):
+            if i == 2:
+                stop.set()  # the consumer gave up with the queue full
+            yield i
+
+    pipeline._pump(source(), q, stop, "test", {})
+    # The oldest item made room for the end marker, so draining terminates.
+    assert list(pipeline._drain(q)) == [1]
+
+
+def test_main_crawls_enriches_and_pages_the_feed_against_the_stub(tmp_path):
+    import csv
+    import gzip
+    import os
+    import subprocess
+    import sys
+    import xml.etree.ElementTree as ET
+    from pathlib import Path
+
+    from benchmarks.stub_server import StubServer
+
+    root = Path(__file__).resolve().parents[1]
+    with StubServer(books=45, per_page=20) as stub:
+        env = dict(os.environ, RUN_NAME="e2e", RUNS_DIR=str(tmp_path / "runs"), SOURCE_URL=stub.source_url,
+                   START_PAGE="1", END_PAGE="auto", API_DETAILS_URL=stub.api_url, HTTP_CACHE="off",
+                   MAX_RPS_PER_HOST="0", ENRICH_WORKERS="4", PIPELINE_QUEUE="4")
+        proc = subprocess.run(
+            [sys.executable, str(root / "pipeline.py"), "--site", "https://x", "--run-name", "e2e",
+             "--out-dir", str(tmp_path / "feeds"), "--no-cache", "--page-size", "20", "--precompress"],
+            env=env, cwd=tmp_path, capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stdout[-2000:] + proc.stderr[-2000:]
+
+    def ids(path):
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            return [r["AudioBook_ID"] for r in csv.DictReader(f)]
+
+    raw = ids(tmp_path / "runs" / "e2e" / "raw" / "audiobooks_e2e.csv")
+    assert len(raw) == 45
+    assert ids(tmp_path / "runs" / "e2e" / "merged" / "books_with_attid_e2e.csv") == raw
+
+    feed_dir = tmp_path / "feeds" / "e2e"
+    atom = "{http://www.w3.org/2005/Atom}link"
+    names = ["podcast.xml", "podcast-2.xml", "podcast-3.xml"]
+    for n, (name, count) in enumerate(zip(names, (20, 20, 5))):
+        data = (feed_dir / name).read_bytes()
+        assert gzip.decompress((feed_dir / (name + ".gz")).read_bytes()) == data
+        channel = ET.fromstring(data).find("channel")
+        assert len(channel.findall("item")) == count
+        links = {l.get("rel"): l.get("href") for l in channel.findall(atom)}
+        assert links["first"] == "https://x/feeds/e2e/podcast.xml"
+        assert links.get("next") == (f"https://x/feeds/e2e/{names[n + 1]}" if n < 2 else None)
@@ -0,0 +1,77 @@
+import importlib.util
+import pathlib
+
+script_path = pathlib.Path(__file__).resolve().parents[1] / 'scrape_iranseda_env.py'
+spec = importlib.util.spec_from_file_location('scrape_module', script_path)
+mod = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mod)
+
+
+def _page_html(ids):
+    links = "".join(f'<a href="/DetailsAlbum/?VALID=TRUE&g={i}">b</a>' for i in ids)
+    return f"<html><body>{links}</body></html>"
+
+
+def test_extract_books_makes_urls_absolute():
+    books = mod.extract_books(_page_html([5, 6]))
+    assert books == [
+        [5, "https://book.iranseda.ir/DetailsAlbum/?VALID=TRUE&g=5"],
+        [6, "https://book.iranseda.ir/DetailsAlbum/?VALID=TRUE&g=6"],
+    ]
+
+
+def test_auto_crawl_stops_at_first_empty_page(monkeypatch):
+    site = {1: [1, 2], 2: [3], 3: [4], 4: [], 5: [9]}
+    def fake_fetch(page):
+        return mod.extract_books(_page_html(site.get(page, [])))
+
+    monkeypatch.setattr(mod, "fetch_page", fake_fetch)
+    pages = [p for p, _ in mod.crawl(start=1, end=None, workers=2)]
+    assert pages == [1, 2, 3, 4]
+
+
+def test_auto_crawl_stops_after_consecutive_failed_pages(monkeypatch):
+    # Page 2 fails once; from page 4 on the site answers 5xx for ever.
+    def fake_fetch(page):
+        return None if page == 2 or page >= 4 else mod.extract_books(_page_html([page]))
+
+    monkeypatch.setattr(mod, "fetch_page", fake_fetch)
+    monkeypatch.setattr(mod, "MAX_FAILED_PAGES", 3)
+    pages = [p for p, _ in mod.crawl(start=1, end=None, workers=2)]
+    assert pages == [1, 2, 3, 4, 5, 6]
+
+
+def test_incremental_crawl_stops_at_the_watermark(tmp_path, monkeypatch):
+    import csv
+
+    site = {}
+    crawled = []
+
+    def fake_crawl():
+        for page in range(1, 20):
+            crawled.append(page)
+            yield page, mod.extract_books(_page_html(site.get(page, [])))
+            if not site.get(page):
+                return
+
+    monkeypatch.setattr(mod, "crawl", fake_crawl)
+    monkeypatch.setattr(mod, "INCREMENTAL", True)
+    monkeypatch.setattr(mod, "END_PAGE", None)
+    monkeypatch.setattr(mod, "CATALOG_PATH", str(tmp_path / "catalog.sqlite"))
+    out, delta = tmp_path / "raw.csv", tmp_path / "delta.csv"
+
+    def ids(path):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            return [int(r["AudioBook_ID"]) for r in csv.DictReader(f)]
+
+    site.update({1: [5, 4], 2: [3, 2], 3: [1]})
+    assert [b for b, _ in mod.scrape_books(str(out), str(delta))] == [5, 4, 3, 2, 1]
+    assert crawled == [1, 2, 3, 4]
+
+    # Two new books push the listing down; page 2 is all known.
+    crawled.clear()
+    site.update({1: [7, 6], 2: [5, 4], 3: [3, 2], 4: [1]})
+    assert [b for b, _ in mod.scrape_books(str(out), str(delta))] == [7, 6, 5, 4, 3, 2, 1]
+    assert crawled == [1, 2]
+    assert ids(delta) == [7, 6]
+    assert ids(out) == [7, 6, 5, 4, 3, 2, 1]
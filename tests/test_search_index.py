@@ -0,0 +1,63 @@
+import csv
+import gzip
+import json
+
+from tools import search_index
+from tools.csv_to_podcast import build_item, item_guid
+
+
+def _publish(root, run, books):
+    """Write the merged CSV and a feed of ``books`` (dicts of CSV fields) for ``run``."""
+    merged = root / "runs" / run / "merged"
+    merged.mkdir(parents=True, exist_ok=True)
+    with open(merged / f"books_with_attid_{run}.csv", "w", newline="", encoding="utf-8-sig") as f:
+        w = csv.DictWriter(f, fieldnames=sorted({k for b in books for k in b}))
+        w.writeheader()
+        w.writerows(books)
+    feed = root / "public" / "feeds" / run / "podcast.xml"
+    feed.parent.mkdir(parents=True, exist_ok=True)
+    items = "\n".join(build_item(b, "D", 7) for b in books)
+    feed.write_text("<rss>\n" + items + "\n</rss>\n", encoding="utf-8")
+
+
+def _book(n, title, author="", narrator=""):
+    return {"Book_Title": title, "Book_Author": author, "Book_Narrator": narrator,
+            "Book_Genre": "داستان", "FullBook_MP3_URL": f"http://e.com/{n}.mp3"}
+
+
+def _shard(root, prefix):
+    path = root / "public" / "search" / "shards" / search_index.shard_name(prefix)
+    assert json.loads(gzip.decompress((path.parent / (path.name + ".gz")).read_bytes())) == json.loads(path.read_text("utf-8"))
+    return json.loads(path.read_text("utf-8"))
+
+
+def test_normalize_unifies_arabic_letters_and_zwnj():
+    assert search_index.tokens("كتاب‌هاي صوتيِ ۱۲") == {"کتاب", "های", "صوتی", "12"}
+
+
+def test_index_covers_all_feeds_and_rebuilds_incrementally(tmp_path):
+    public, runs = str(tmp_path / "public"), str(tmp_path / "runs")
+    shared = _book(1, "سفر به مرکز زمین", "ژول ورن", "آرش")
+    _publish(tmp_path, "a", [shared, _book(2, "کتاب شب")])
+    _publish(tmp_path, "b", [shared])
+
+    counts = search_index.build_index(public, runs)
+    assert counts["feeds"] == 2 and counts["rebuilt"] == 2
+    guid = item_guid(shared["FullBook_MP3_URL"])
+    shard = _shard(tmp_path, "ور")
+    assert shard["tokens"]["ورن"] == [guid]
+    assert shard["docs"][guid] == ["سفر به مرکز زمین", "ژول ورن", "آرش", "داستان",
+                                   ["feeds/a/podcast.xml", "feeds/b/podcast.xml"]]
+    # The narrator's آ is indexed as ا; titles are found by any word prefix.
+    assert _shard(tmp_path, "ار")["tokens"]["ارش"] == [guid]
+    assert "کتاب" in _shard(tmp_path, "کت")["tokens"]
+
+    assert search_index.build_index(public, runs) == dict(counts, rebuilt=0, shards_written=0)
+
+    _publish(tmp_path, "b", [shared, _book(3, "گلستان", "سعدی")])
+    counts = search_index.build_index(public, runs)
+    assert counts["rebuilt"] == 1
+    # Only the new book's shards (گل, سع, دا) change.
+    assert counts["shards_written"] == 3
+    meta = json.loads((tmp_path / "public" / "search" / "meta.json").read_text("utf-8"))
+    assert meta["feeds"]["b"] == {"path": "feeds/b/podcast.xml", "books": 2}
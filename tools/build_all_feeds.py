@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Rebuild every feed under ``runs/*/merged/`` in one go.
+
+Usage:
+    python tools/build_all_feeds.py --site https://<user>.github.io/<repo>
+    python tools/build_all_feeds.py --index-only
+
+All enclosures of all feeds are probed first, in this process, through one
+HTTP client and one enclosure cache (duplicates across feeds are probed
+once).  The feeds are then rendered in parallel on a process pool; the
+workers read the freshly filled cache, so they make no network calls for
+enclosures that answered.  Finally the feed list in ``public/index.html`` is
+regenerated from the ``podcast.xml`` files that actually exist, and so is the
+search index under ``public/search/`` (see ``search_index.py``).
+"""
+import argparse, glob, os, sys
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+try:
+    from tools import csv_to_podcast as feeds
+    from tools import search_index
+    from tools.http_client import default_client
+except ImportError:  # executed as ``python tools/build_all_feeds.py``
+    import csv_to_podcast as feeds
+    import search_index
+    from http_client import default_client
+
+FEEDS_MARKER = "<!-- FEEDS:LIST -->"
+
+def find_merged_csvs(runs_dir):
+    """Return ``[(run_name, csv_path)]`` for every run with a merged CSV."""
+    found = []
+    for path in sorted(glob.glob(os.path.join(runs_dir, "*", "merged", "books_with_attid_*.csv"))):
+        run_name = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        if os.path.basename(path) == f"books_with_attid_{run_name}.csv":
+            found.append((run_name, path))
+    return found
+
+def prefetch_enclosures(csv_paths, cache, client, workers=16, per_host=4, batch=2048, revalidate=False,
+                        verify_sample=0.0):
+    """Probe the unique enclosures of all feeds once, filling ``cache``.
+
+    Enclosures whose size the merged CSV already records are skipped, except
+    for the ``verify_sample`` the feed builds will check.
+    """
+    seen = set()
+    pending = []
+    probed = 0
+    for path in csv_paths:
+        for row in feeds.iter_rows(path):
+            url = feeds.audio_url(row)
+            if url and feeds.known_length(row) is not None and not feeds.verify_sampled(url, verify_sample):
+                continue
+            if url and url not in seen:
+                seen.add(url)
+                pending.append(url)
+            if len(pending) >= batch:
+                feeds.probe_enclosures(pending, workers=workers, per_host=per_host,
+                                       cache=cache, revalidate=revalidate, client=client)
+                probed += len(pending)
+                pending = []
+    if pending:
+        feeds.probe_enclosures(pending, workers=workers, per_host=per_host,
+                               cache=cache, revalidate=revalidate, client=client)
+        probed += len(pending)
+    return probed
+
+def _build_one(argv):
+    """Process-pool worker: build one feed from csv_to_podcast arguments."""
+    args = feeds.build_parser().parse_args(argv)
+    with feeds.metrics.stage_run("feed", feeds.metrics_dir(args)):
+        cache = feeds.open_cache(args)
+        catalog = feeds.open_catalog(args)
+        try:
+            return feeds.build_feed(args, cache=cache, client=default_client(), catalog=catalog)
+        finally:
+            if cache:
+                cache.close()
+            if catalog:
+                catalog.close()
+
+def render_feed_list(public_dir):
+    """Return the ``<li>`` lines for every published ``feeds/<run>/podcast.xml``."""
+    lines = []
+    for path in sorted(glob.glob(os.path.join(public_dir, "feeds", "*", "podcast.xml"))):
+        rel = "feeds/" + os.path.basename(os.path.dirname(path)) + "/podcast.xml"
+        lines.append(f"    <li><code>{escape(rel)}</code> — <a href='{escape(rel)}'>مشاهده RSS</a></li>")
+    return lines
+
+def update_index(index_path, public_dir):
+    """Replace everything between the FEEDS marker and ``</ul>`` with the feed list."""
+    with open(index_path, "r", encoding="utf-8") as f:
+        html = f.read()
+    start = html.index(FEEDS_MARKER) + len(FEEDS_MARKER)
+    end = html.index("</ul>", start)
+    block = "\n" + "\n".join(render_feed_list(public_dir)) + "\n  "
+    with feeds.AtomicWriter(index_path) as f:
+        f.write(html[:start] + block + html[end:])
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs-dir", default=os.getenv("RUNS_DIR", "runs"))
+    ap.add_argument("--out-dir", default="public/feeds")
+    ap.add_argument("--index", default="public/index.html")
+    ap.add_argument("--index-only", action="store_true", help="Only regenerate the feed list in --index")
+    ap.add_argument("--site", help="Required unless --index-only")
+    ap.add_argument("--channel-title")
+    ap.add_argument("--channel-author")
+    ap.add_argument("--channel-summary")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Feeds built in parallel")
+    ap.add_argument("--probe-workers", type=int, default=16)
+    ap.add_argument("--probe-per-host", type=int, default=4)
+    ap.add_argument("--cache", default=feeds.DEFAULT_CACHE_PATH)
+    ap.add_argument("--revalidate", action="store_true")
+    ap.add_argument("--verify-sample", type=float, default=0.0,
+                    help="Fraction of enclosures with a recorded size that are probed anyway")
+    ap.add_argument("--incremental", action="store_true")
+    ap.add_argument("--page-size", type=int, default=0, help="Items per page of paged feeds (0 = one file)")
+    ap.add_argument("--precompress", action="store_true", help="Write .gz/.br siblings of every feed file")
+    ap.add_argument("--covers-dir", help="Use the covers published here by tools/covers.py")
+    ap.add_argument("--catalog", nargs="?", const=feeds.DEFAULT_CATALOG_PATH,
+                    help="Record every feed's published items in the catalog")
+    ap.add_argument("--no-search", action="store_true", help="Do not rebuild the search index in public/search")
+    args = ap.parse_args(argv)
+
+    public_dir = os.path.dirname(os.path.abspath(args.out_dir))
+    if not args.index_only:
+        if not args.site:
+            ap.error("--site is required")
+        runs = find_merged_csvs(args.runs_dir)
+        if not runs:
+            print(f"No merged CSVs under {args.runs_dir}")
+        cache = feeds.EnclosureCache(args.cache)
+        try:
+            n = prefetch_enclosures([p for _, p in runs], cache, default_client(),
+                                    workers=args.probe_workers, per_host=args.probe_per_host,
+                                    revalidate=args.revalidate, verify_sample=args.verify_sample)
+        finally:
+            cache.close()
+        print(f"Probed {n} unique enclosures across {len(runs)} feeds")
+
+        common = ["--site", args.site, "--out-dir", args.out_dir, "--cache", args.cache,
+                  "--probe-workers", str(args.probe_workers), "--probe-per-host", str(args.probe_per_host)]
+        for flag in ("channel_title", "channel_author", "channel_summary"):
+            if getattr(args, flag):
+                common += ["--" + flag.replace("_", "-"), getattr(args, flag)]
+        if args.incremental:
+            common.append("--incremental")
+        if args.verify_sample:
+            common += ["--verify-sample", str(args.verify_sample)]
+        if args.catalog:
+            common += ["--catalog", args.catalog]
+        if args.page_size:
+            common += ["--page-size", str(args.page_size)]
+        if args.precompress:
+            common.append("--precompress")
+        if args.covers_dir:
+            common += ["--covers-dir", args.covers_dir]
+        jobs = [["--csv", path, "--run-name", run] + common for run, path in runs]
+        failed = 0
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as ex:
+            for (run, _), fut in zip(runs, [ex.submit(_build_one, job) for job in jobs]):
+                try:
+                    print("Wrote:", fut.result())
+                except Exception as e:
+                    failed += 1
+                    print(f"! {run}: {e}")
+
+    if os.path.exists(args.index):
+        update_index(args.index, public_dir)
+        print("Updated:", args.index)
+    if not args.no_search:
+        catalog = feeds.Catalog(args.catalog) if args.catalog else None
+        try:
+            counts = search_index.build_index(public_dir, args.runs_dir, catalog)
+        finally:
+            if catalog:
+                catalog.close()
+        print("Search index: " + ", ".join(f"{k} {v}" for k, v in counts.items()))
+    if not args.index_only and failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
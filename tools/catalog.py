@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""Cross-run catalog of enriched books (SQLite, ``runs/catalog.sqlite``).
+
+Tables:
+
+* ``books``      one row per AudioBook_ID (indexed by ``attid`` too) holding
+                 the enriched CSV row as JSON and when it was last refreshed.
+* ``mp3_files``  the book's MP3 downloads, one row per URL with ``file_size``
+                 and ``quality`` (instead of the comma-joined CSV column).
+* ``book_runs``  which runs (tags) list a book, in the run's input order
+                 (new books are appended until ``order_run`` renumbers them).
+* ``feed_items`` what each run's published feed contains (guid, pubDate,
+                 enclosure length and item digest, see ``csv_to_podcast``).
+* ``listings``   the watermark of an incremental crawl: every book a listing
+                 (``SOURCE_URL``) is known to contain, newest first.
+
+The enrichment stage reuses books refreshed recently by *any* run instead of
+fetching them again, and both it and the feed stage read and write here.
+The per-run CSVs are still written; ``export`` recreates one from the
+catalog and ``import`` loads existing merged CSVs.
+
+Usage:
+    python tools/catalog.py import runs/*/merged/books_with_attid_*.csv
+    python tools/catalog.py export --run <RUN_NAME> --out books.csv
+    python tools/catalog.py stats
+"""
+import argparse, csv, glob, json, os, re, sqlite3, sys, threading, time
+
+DEFAULT_CATALOG_PATH = os.path.join(os.getenv("RUNS_DIR", "runs"), "catalog.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    audiobook_id TEXT PRIMARY KEY,
+    attid INTEGER,
+    data TEXT NOT NULL,
+    refreshed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS books_attid ON books(attid);
+CREATE TABLE IF NOT EXISTS mp3_files (
+    audiobook_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    file_size INTEGER,
+    quality TEXT,
+    PRIMARY KEY (audiobook_id, url)
+);
+CREATE INDEX IF NOT EXISTS mp3_files_url ON mp3_files(url);
+CREATE TABLE IF NOT EXISTS book_runs (
+    run_name TEXT NOT NULL,
+    audiobook_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (run_name, audiobook_id)
+);
+CREATE INDEX IF NOT EXISTS book_runs_book ON book_runs(audiobook_id);
+CREATE TABLE IF NOT EXISTS feed_items (
+    run_name TEXT NOT NULL,
+    guid TEXT NOT NULL,
+    pubdate TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (run_name, guid)
+);
+CREATE TABLE IF NOT EXISTS listings (
+    source_url TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    audiobook_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (source_url, audiobook_id)
+);
+"""
+
+_ATTID_RE = re.compile(r"[?&]attid=(\d+)", re.I)
+
+def attid_of(row):
+    """The attid of an enriched row (``attid`` key or its Player_Link)."""
+    if row.get("attid"):
+        return int(row["attid"])
+    m = _ATTID_RE.search(row.get("Player_Link") or "")
+    return int(m.group(1)) if m else None
+
+def mp3_files_of(row):
+    """MP3 files of a row: its ``mp3_files`` list, ``All_MP3s_Meta`` JSON or ``All_MP3s_Found``."""
+    if row.get("mp3_files") is not None:
+        return row["mp3_files"]
+    if row.get("All_MP3s_Meta"):
+        try:
+            return json.loads(row["All_MP3s_Meta"])
+        except ValueError:
+            pass
+    urls = [u for u in (row.get("All_MP3s_Found") or "").split(",") if u]
+    return [{"url": u, "file_size": None, "quality": None} for u in urls]
+
+class Catalog:
+    def __init__(self, path=DEFAULT_CATALOG_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    # -- books --------------------------------------------------------------
+    def put_book(self, row, fields=None, refreshed_at=None):
+        """Store an enriched row (only ``fields`` when given) and its MP3 files."""
+        bid = str(row["AudioBook_ID"])
+        data = {k: row.get(k) for k in fields} if fields else {
+            k: v for k, v in row.items() if k not in ("attid", "mp3_files")}
+        files = mp3_files_of(row)
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?)",
+                    (bid, attid_of(row), json.dumps(data, ensure_ascii=False), refreshed_at or time.time()),
+                )
+                self._db.execute("DELETE FROM mp3_files WHERE audiobook_id = ?", (bid,))
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO mp3_files VALUES (?, ?, ?, ?, ?)",
+                    [(bid, i, f["url"], f.get("file_size"), f.get("quality")) for i, f in enumerate(files)],
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def get_book(self, audiobook_id, max_age=None):
+        """The stored row, or ``None`` if unknown (or older than ``max_age`` seconds)."""
+        with self._lock:
+            row = self._db.execute("SELECT data, refreshed_at FROM books WHERE audiobook_id = ?",
+                                   (str(audiobook_id),)).fetchone()
+        if row is None or (max_age is not None and time.time() - row["refreshed_at"] >= max_age):
+            return None
+        return json.loads(row["data"])
+
+    def mp3_files(self, audiobook_id):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT url, file_size, quality FROM mp3_files WHERE audiobook_id = ? ORDER BY position",
+                (str(audiobook_id),)).fetchall()
+        return [dict(r) for r in rows]
+
+    def attids(self):
+        """``{AudioBook_ID: attid}`` for every book with a known attid."""
+        with self._lock:
+            rows = self._db.execute("SELECT audiobook_id, attid FROM books WHERE attid IS NOT NULL").fetchall()
+        return {r["audiobook_id"]: r["attid"] for r in rows}
+
+    def book_for_attid(self, attid):
+        with self._lock:
+            row = self._db.execute("SELECT audiobook_id FROM books WHERE attid = ?", (int(attid),)).fetchone()
+        return row["audiobook_id"] if row else None
+
+    # -- runs ---------------------------------------------------------------
+    def link_run(self, run_name, audiobook_id):
+        """Add a book to a run, after the books it already lists."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO book_runs SELECT ?, ?, COALESCE(MAX(position), 0) + 1"
+                " FROM book_runs WHERE run_name = ?",
+                (run_name, str(audiobook_id), run_name),
+            )
+
+    def order_run(self, run_name, audiobook_ids):
+        """Renumber a run's books: ``audiobook_ids`` first, in that order, then the rest as before.
+
+        Called with the run's input order after every run, so books found by
+        a later (incremental) run take their listing position instead of
+        staying after every book linked before them.
+        """
+        ids = list(dict.fromkeys(str(b) for b in audiobook_ids))
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                linked = [r["audiobook_id"] for r in self._db.execute(
+                    "SELECT audiobook_id FROM book_runs WHERE run_name = ? ORDER BY position", (run_name,))]
+                known, first = set(linked), set(ids)
+                order = [b for b in ids if b in known] + [b for b in linked if b not in first]
+                self._db.executemany(
+                    "UPDATE book_runs SET position = ? WHERE run_name = ? AND audiobook_id = ?",
+                    [(i, run_name, b) for i, b in enumerate(order, 1)],
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def run_books(self, run_name):
+        """Yield the stored rows of a run's books in run order (see :meth:`order_run`)."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT b.data FROM book_runs r JOIN books b ON b.audiobook_id = r.audiobook_id"
+                " WHERE r.run_name = ? ORDER BY r.position", (run_name,)).fetchall()
+        for r in rows:
+            yield json.loads(r["data"])
+
+    def runs_of(self, audiobook_id):
+        with self._lock:
+            rows = self._db.execute("SELECT run_name FROM book_runs WHERE audiobook_id = ? ORDER BY run_name",
+                                    (str(audiobook_id),)).fetchall()
+        return [r["run_name"] for r in rows]
+
+    # -- feeds --------------------------------------------------------------
+    def put_feed_items(self, run_name, index):
+        """Replace a run's published items with ``{guid: FeedEntry}`` (see ``index_feed``)."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute("DELETE FROM feed_items WHERE run_name = ?", (run_name,))
+                self._db.executemany(
+                    "INSERT INTO feed_items VALUES (?, ?, ?, ?, ?)",
+                    [(run_name, guid, e.pubdate, e.length, e.digest) for guid, e in index.items()],
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def feed_items(self, run_name):
+        """``{guid: (pubdate, length, digest)}`` of a run's published feed."""
+        with self._lock:
+            rows = self._db.execute("SELECT guid, pubdate, length, digest FROM feed_items WHERE run_name = ?",
+                                    (run_name,)).fetchall()
+        return {r["guid"]: (r["pubdate"], r["length"], r["digest"]) for r in rows}
+
+    # -- listings -------------------------------------------------------------
+    def listing(self, source_url):
+        """``[(AudioBook_ID, url)]`` known to be on a listing, in listing order."""
+        with self._lock:
+            rows = self._db.execute("SELECT audiobook_id, url FROM listings WHERE source_url = ? ORDER BY position",
+                                    (source_url,)).fetchall()
+        return [(r["audiobook_id"], r["url"]) for r in rows]
+
+    def put_listing(self, source_url, books):
+        """Replace a listing's watermark with ``[(AudioBook_ID, url)]`` in listing order."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute("DELETE FROM listings WHERE source_url = ?", (source_url,))
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO listings VALUES (?, ?, ?, ?)",
+                    [(source_url, i, str(bid), url) for i, (bid, url) in enumerate(books)],
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    # -- CSV compatibility ----------------------------------------------------
+    def import_csv(self, path, run_name, refreshed_at=None):
+        """Load a merged CSV into the catalog; returns the number of rows."""
+        refreshed_at = refreshed_at or os.path.getmtime(path)
+        ids = []
+        with open(path, "r", newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                if not row.get("AudioBook_ID"):
+                    continue
+                self.put_book(row, refreshed_at=refreshed_at)
+                self.link_run(run_name, row["AudioBook_ID"])
+                ids.append(row["AudioBook_ID"])
+        self.order_run(run_name, ids)
+        return len(ids)
+
+    def export_csv(self, run_name, path, fieldnames=None):
+        """Write a run's books as a merged CSV; returns the number of rows."""
+        rows = self.run_books(run_name)
+        first = next(rows, None)
+        fieldnames = fieldnames or (list(first) if first else ["AudioBook_ID"])
+        n = 0
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            w = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+            w.writeheader()
+            if first is not None:
+                w.writerow(first)
+                n = 1
+            for row in rows:
+                w.writerow(row)
+                n += 1
+        return n
+
+    def stats(self):
+        with self._lock:
+            return {
+                table: self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("books", "mp3_files", "book_runs", "feed_items", "listings")
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--catalog", default=DEFAULT_CATALOG_PATH)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    imp = sub.add_parser("import", help="Load merged CSVs (runs/<RUN>/merged/books_with_attid_<RUN>.csv)")
+    imp.add_argument("csvs", nargs="+")
+    exp = sub.add_parser("export", help="Write a run's books as a merged CSV")
+    exp.add_argument("--run", required=True)
+    exp.add_argument("--out", required=True)
+    sub.add_parser("stats")
+    args = ap.parse_args(argv)
+
+    cat = Catalog(args.catalog)
+    try:
+        if args.cmd == "import":
+            for pattern in args.csvs:
+                for path in sorted(glob.glob(pattern)) or [pattern]:
+                    run_name = os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(path))))
+                    print(f"{path}: {cat.import_csv(path, run_name)} books -> run {run_name}")
+        elif args.cmd == "export":
+            print(f"Wrote {cat.export_csv(args.run, args.out)} books -> {args.out}")
+        else:
+            json.dump(cat.stats(), sys.stdout, indent=2)
+            print()
+    finally:
+        cat.close()
+
+if __name__ == "__main__":
+    main()
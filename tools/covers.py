@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Download, cache and publish cover art for the feeds.
+
+Usage:
+    python tools/covers.py --csv runs/<RUN_NAME>/merged/books_with_attid_<RUN_NAME>.csv
+    python tools/csv_to_podcast.py ... --covers-dir public/covers
+
+Every distinct ``Cover_Image_URL`` of the given CSVs is fetched concurrently
+through the shared HTTP client.  Originals are stored content-addressed
+(``runs/.cache/covers/<sha256[:2]>/<sha256>``), so covers shared by several
+books or runs are kept once; a small SQLite index maps each URL to its blob
+with the ETag/Last-Modified validators.  URLs checked within ``--ttl-days``
+are not requested again and older ones are revalidated with a conditional
+GET, so unchanged covers cost nothing on later runs.
+
+With Pillow installed each cover is published as square JPEG variants
+``public/covers/<sha256>-<size>.jpg`` (default 1400 and 300 px; podcast
+directories ask for 1400-3000 px squares).  Without Pillow the original is
+published unchanged as ``public/covers/<sha256>.<ext>``.  Variants that
+already exist are not rendered again.  ``csv_to_podcast.py --covers-dir``
+then points ``itunes:image`` at the published files.
+"""
+import argparse, csv, hashlib, io, mimetypes, os, sqlite3, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+try:  # optional: without Pillow the originals are published as-is
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+try:
+    from tools import metrics
+    from tools.http_client import default_client
+except ImportError:  # executed as ``python tools/covers.py``
+    import metrics
+    from http_client import default_client
+
+DEFAULT_CACHE_DIR = os.path.join("runs", ".cache", "covers")
+DEFAULT_OUT_DIR = os.path.join("public", "covers")
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_SIZES = (1400, 300)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS covers (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    checked_at REAL NOT NULL
+);
+"""
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def extension_for(content_type):
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    if ctype == "image/jpeg":
+        return ".jpg"
+    return mimetypes.guess_extension(ctype) or ".img"
+
+class CoverStore:
+    """Content-addressed blobs plus the URL -> blob index."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False,
+                                   isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def get(self, url):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM covers WHERE url = ?", (url,)).fetchone()
+        return dict(row) if row else None
+
+    def is_fresh(self, entry, now=None):
+        return (now or time.time()) - entry["checked_at"] < self.ttl
+
+    def put(self, url, sha, headers):
+        values = (url, sha, headers.get("content-type"), headers.get("etag"),
+                  headers.get("last-modified"), time.time())
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO covers VALUES (?, ?, ?, ?, ?, ?)", values)
+
+    def touch(self, url):
+        with self._lock:
+            self._db.execute("UPDATE covers SET checked_at = ? WHERE url = ?", (time.time(), url))
+
+    def blob_path(self, sha):
+        return os.path.join(self.cache_dir, sha[:2], sha)
+
+    def has_blob(self, sha):
+        return os.path.exists(self.blob_path(sha))
+
+    def write_blob(self, data):
+        sha = hashlib.sha256(data).hexdigest()
+        if not self.has_blob(sha):
+            _write_atomic(self.blob_path(sha), data)
+        return sha
+
+    def read_blob(self, sha):
+        with open(self.blob_path(sha), "rb") as f:
+            return f.read()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def fetch_cover(url, store, client, revalidate=False):
+    """Return ``(index entry, result)`` for ``url``, downloading only when needed."""
+    entry = store.get(url)
+    if entry and store.has_blob(entry["sha256"]):
+        if not revalidate and store.is_fresh(entry):
+            return entry, "cached"
+    else:
+        entry = None
+    conditional = {}
+    if entry and entry.get("etag"):
+        conditional["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        conditional["If-Modified-Since"] = entry["last_modified"]
+    r = client.get(url, headers=conditional)
+    if entry and r.status_code == 304:
+        store.touch(url)
+        return entry, "not_modified"
+    r.raise_for_status()
+    headers = {k.lower(): v for k, v in r.headers.items()}
+    if not headers.get("content-type", "").lower().startswith("image/"):
+        raise RuntimeError(f"Not an image: {headers.get('content-type')}")
+    sha = store.write_blob(r.content)
+    store.put(url, sha, headers)
+    return store.get(url), "downloaded"
+
+def variant_names(entry, sizes=DEFAULT_SIZES):
+    """Published file names of a cover, in ``sizes`` order."""
+    if Image is None:
+        return [entry["sha256"] + extension_for(entry["content_type"])]
+    return [f"{entry['sha256']}-{size}.jpg" for size in sizes]
+
+def publish(entry, store, out_dir, sizes=DEFAULT_SIZES):
+    """Write the missing published variants of a cover; returns how many were written."""
+    written = 0
+    todo = [(name, size) for name, size in zip(variant_names(entry, sizes), sizes)
+            if not os.path.exists(os.path.join(out_dir, name))]
+    if not todo:
+        return 0
+    data = store.read_blob(entry["sha256"])
+    if Image is None:
+        _write_atomic(os.path.join(out_dir, todo[0][0]), data)
+        return 1
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert("RGB")
+        for name, size in todo:
+            square = ImageOps.fit(img, (size, size), method=Image.LANCZOS)
+            buf = io.BytesIO()
+            square.save(buf, "JPEG", quality=85, optimize=True, progressive=True)
+            _write_atomic(os.path.join(out_dir, name), buf.getvalue())
+            written += 1
+    return written
+
+def cover_urls(csv_paths):
+    """Distinct ``Cover_Image_URL`` values of the given merged CSVs, in order."""
+    seen = {}
+    for path in csv_paths:
+        with open(path, "r", newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                url = (row.get("Cover_Image_URL") or "").strip()
+                if url:
+                    seen.setdefault(url, None)
+    return list(seen)
+
+def sync_covers(urls, store, out_dir, client, sizes=DEFAULT_SIZES, workers=8, revalidate=False):
+    """Fetch and publish every cover; returns a Counter-like dict of results."""
+    counts = {}
+    lock = threading.Lock()
+    blob_locks = {}  # sha256 -> lock, so URLs sharing a cover publish it once
+
+    def _one(url):
+        try:
+            entry, result = fetch_cover(url, store, client, revalidate=revalidate)
+            with lock:
+                blob_lock = blob_locks.setdefault(entry["sha256"], threading.Lock())
+            with blob_lock:
+                published = publish(entry, store, out_dir, sizes)
+        except Exception as e:
+            print(f"! cover {url}: {e}")
+            result, published = "error", 0
+        metrics.inc("covers_total", result=result)
+        with lock:
+            counts[result] = counts.get(result, 0) + 1
+            counts["published"] = counts.get("published", 0) + published
+
+    if urls:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as ex:
+            list(ex.map(_one, urls))
+    return counts
+
+class CoverMap:
+    """Rewrite ``Cover_Image_URL`` to the published copy, when there is one."""
+
+    def __init__(self, store, out_dir, base_url, size=DEFAULT_SIZES[0]):
+        self.store = store
+        self.out_dir = out_dir
+        self.base_url = base_url.rstrip("/")
+        self.size = size
+
+    def url_for(self, url):
+        entry = self.store.get(url) if url else None
+        if entry is None:
+            return None
+        for name in (f"{entry['sha256']}-{self.size}.jpg", entry["sha256"] + extension_for(entry["content_type"])):
+            if os.path.exists(os.path.join(self.out_dir, name)):
+                return self.base_url + "/" + name
+        return None
+
+    def rewrite(self, row):
+        published = self.url_for((row.get("Cover_Image_URL") or "").strip())
+        if published:
+            row = dict(row, Cover_Image_URL=published)
+        return row
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--csv", nargs="+", required=True, help="Merged CSVs whose covers are published")
+    ap.add_argument("--out-dir", default=DEFAULT_OUT_DIR)
+    ap.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    ap.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Square JPEG sizes in px")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--ttl-days", type=float, default=DEFAULT_TTL / 86400)
+    ap.add_argument("--revalidate", action="store_true", help="Revalidate every cached cover")
+    args = ap.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    if Image is None:
+        print("Pillow is not installed; publishing covers without resizing")
+    first = os.path.dirname(os.path.abspath(args.csv[0]))
+    run_dir = os.path.dirname(first) if os.path.basename(first) == "merged" else first
+    with metrics.stage_run("covers", run_dir):
+        store = CoverStore(args.cache_dir, ttl=args.ttl_days * 86400)
+        try:
+            urls = cover_urls(args.csv)
+            counts = sync_covers(urls, store, args.out_dir, default_client(), sizes=sizes,
+                                 workers=args.workers, revalidate=args.revalidate)
+        finally:
+            store.close()
+    print(f"Covers: {len(urls)} urls, " + ", ".join(f"{k} {v}" for k, v in sorted(counts.items())))
+
+if __name__ == "__main__":
+    main()
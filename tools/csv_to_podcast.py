@@ -1,9 +1,28 @@
 # -*- coding: utf-8 -*-
-import argparse, csv, hashlib, os
+import argparse, codecs, csv, gzip, hashlib, itertools, os, re, tempfile, threading
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from urllib.parse import urlparse
 from xml.sax.saxutils import escape
 import requests
 
+try:  # optional: only needed for --precompress to also write .br files
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from tools import metrics
+    from tools.catalog import Catalog, DEFAULT_CATALOG_PATH
+    from tools.enclosure_cache import EnclosureCache, DEFAULT_CACHE_PATH, DEFAULT_TTL, DEFAULT_MAX_ENTRIES
+    from tools.http_client import default_client
+except ImportError:  # executed as ``python tools/csv_to_podcast.py``
+    import metrics
+    from catalog import Catalog, DEFAULT_CATALOG_PATH
+    from enclosure_cache import EnclosureCache, DEFAULT_CACHE_PATH, DEFAULT_TTL, DEFAULT_MAX_ENTRIES
+    from http_client import default_client
+
 # Maximum length allowed for the description field.  If the generated
 # description exceeds this value the script will gradually drop optional
 # metadata fields (see `field_map` in `build_item`).  The value is chosen to
@@ -25,18 +44,42 @@ def cdata(text):
     if "]]>" in text: text = text.replace("]]>", "]]]]><![CDATA[>")
     return "<![CDATA[" + text + "]]>"
 
-def read_rows(path):
-    for enc in ("utf-8-sig","utf-8","cp1256"):
+CSV_ENCODINGS = ("utf-8-sig", "utf-8", "cp1256")
+
+def sniff_encoding(path, size=64 * 1024):
+    """Pick the first candidate encoding that decodes the file's first bytes.
+
+    The prefix is fed to an incremental decoder so a multi-byte character cut
+    at the end of the sample does not disqualify an encoding.
+    """
+    with open(path, "rb") as f:
+        prefix = f.read(size)
+    for enc in CSV_ENCODINGS:
         try:
-            import csv as _csv
-            with open(path, "r", encoding=enc, newline="") as f:
-                return [dict(r) for r in _csv.DictReader(f)]
-        except Exception:
+            codecs.getincrementaldecoder(enc)().decode(prefix, final=False)
+            return enc
+        except UnicodeDecodeError:
             continue
     raise RuntimeError("Cannot read CSV.")
 
+def iter_rows(path):
+    """Yield CSV rows as dicts without loading the whole file."""
+    with open(path, "r", encoding=sniff_encoding(path), newline="") as f:
+        for r in csv.DictReader(f):
+            yield dict(r)
+
+def _length_from_headers(headers: dict) -> int:
+    ctype = headers.get("content-type", "").split(";")[0].strip().lower()
+    if ctype != "audio/mpeg":
+        raise RuntimeError(f"Invalid Content-Type: {headers.get('content-type')}")
+    # Accept-Ranges might be missing or set to 'none'. We no longer require
+    # it to be ``bytes`` because some audio hosts do not advertise byte-range
+    # support even though the content is downloadable.
+    if "content-length" not in headers:
+        raise RuntimeError("Missing Content-Length")
+    return int(headers["content-length"])
 
-def fetch_audio_length(url: str) -> int:
+def fetch_audio_length(url: str, cache=None, revalidate=False, client=None, timeout=None) -> int:
     """Return Content-Length of an MP3 after validating required headers.
 
     Raises RuntimeError if `Content-Type` is not `audio/mpeg` or if
@@ -44,28 +87,158 @@ def fetch_audio_length(url: str) -> int:
     required, but many servers (including IranSeda) either omit it or set it
     to values other than ``bytes``. The script now tolerates such responses
     as long as a valid ``Content-Length`` is provided.
+
+    With an :class:`EnclosureCache`, fresh entries are answered without any
+    network traffic (including cached rejections), and stale ones are
+    revalidated with ``If-None-Match``/``If-Modified-Since``.  ``revalidate``
+    forces that conditional request even for fresh entries.  ``client`` is
+    an :class:`~tools.http_client.HttpClient` (its ``HTTP_TIMEOUT`` applies
+    unless ``timeout`` is given); without one a bare ``requests.head`` is
+    sent, with a 30 s default timeout.
     """
-    r = requests.head(url, allow_redirects=True, timeout=30)
+    entry = cache.get(url) if cache else None
+    if entry and not revalidate and cache.is_fresh(entry):
+        metrics.inc("enclosure_probes_total", result="cached")
+        return _length_from_headers(EnclosureCache.headers_of(entry))
+    conditional = {}
+    if entry and entry.get("etag"):
+        conditional["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        conditional["If-Modified-Since"] = entry["last_modified"]
+    head = client.head if client else requests.head
+    opts = {"allow_redirects": True}
+    if timeout is not None or client is None:
+        opts["timeout"] = 30 if timeout is None else timeout
+    if conditional:
+        r = head(url, headers=conditional, **opts)
+    else:
+        r = head(url, **opts)
+    if entry and r.status_code == 304:
+        metrics.inc("enclosure_probes_total", result="not_modified")
+        cache.touch(url)
+        return _length_from_headers(EnclosureCache.headers_of(entry))
+    metrics.inc("enclosure_probes_total", result="fetched")
     r.raise_for_status()
     headers = {k.lower(): v for k, v in r.headers.items()}
-    ctype = headers.get("content-type", "").split(";")[0].strip().lower()
-    if ctype != "audio/mpeg":
-        raise RuntimeError(f"Invalid Content-Type: {headers.get('content-type')}")
-    # Accept-Ranges might be missing or set to 'none'. We no longer require
-    # it to be ``bytes`` because some audio hosts do not advertise byte-range
-    # support even though the content is downloadable.
-    if "content-length" not in headers:
-        raise RuntimeError("Missing Content-Length")
-    return int(headers["content-length"])
+    if cache:
+        cache.put(url, headers)
+    return _length_from_headers(headers)
+
+class HostLimiter:
+    """Run :func:`fetch_audio_length` with at most ``per_host`` calls per host at once.
+
+    Failures are returned (not raised) so callers can apply the usual
+    skip-on-failure logic per URL.
+    """
 
-def build_item(row, pubdate):
+    def __init__(self, per_host=4, **probe_opts):
+        self.per_host = per_host
+        self.probe_opts = probe_opts
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            sem = self._slots.setdefault(host, threading.BoundedSemaphore(self.per_host))
+        with sem:
+            try:
+                return fetch_audio_length(url, **self.probe_opts)
+            except Exception as e:
+                return e
+
+def probe_enclosures(urls, workers=16, per_host=4, cache=None, revalidate=False, client=None):
+    """Run :func:`fetch_audio_length` for every URL in parallel.
+
+    Returns a dict mapping each URL to its length, or to the exception raised
+    while probing it, so callers can apply the usual skip-on-failure logic.
+    ``per_host`` caps concurrent requests to a single host so that one slow
+    server cannot take over the whole pool.
+    """
+    urls = list(dict.fromkeys(u for u in urls if u))
+    if not urls:
+        return {}
+    probe = HostLimiter(per_host, cache=cache, revalidate=revalidate, client=client)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as ex:
+        return dict(zip(urls, ex.map(probe, urls)))
+
+def audio_url(row):
+    return safe_get(row, "FullBook_MP3_URL") or safe_get(row, "Player_Link")
+
+def skip_reason(exc):
+    """Short label for why an enclosure probe failed, for the skip metrics."""
+    if isinstance(exc, requests.HTTPError):
+        status = getattr(exc.response, "status_code", None)
+        return f"http_{status}" if status else "http_error"
+    if isinstance(exc, requests.RequestException):
+        return "network"
+    msg = str(exc)
+    if msg.startswith("Invalid Content-Type"):
+        return "content_type"
+    if msg.startswith("Missing Content-Length"):
+        return "content_length"
+    return type(exc).__name__
+
+def item_guid(audio):
+    return hashlib.sha1(audio.encode("utf-8")).hexdigest()
+
+def known_length(row):
+    """Enclosure size recorded by the enrichment stage, or ``None``.
+
+    Only rows whose enclosure is the API's ``FullBook_MP3_URL`` carry a size
+    (``FullBook_MP3_Size``); rows falling back to the player page, or whose
+    ``FullBook_MP3_Type`` is not MP3, have to be probed.
+    """
+    if not safe_get(row, "FullBook_MP3_URL"):
+        return None
+    size = safe_get(row, "FullBook_MP3_Size")
+    ctype = (safe_get(row, "FullBook_MP3_Type") or "audio/mpeg").lower()
+    if not size.isdigit() or int(size) <= 0 or ctype != "audio/mpeg":
+        return None
+    return int(size)
+
+def verify_sampled(audio, fraction):
+    """Whether ``audio`` is in the ``fraction`` of enclosures probed anyway.
+
+    The choice hashes the URL, so the same enclosures are checked on every
+    run and by every tool.
+    """
+    return fraction > 0 and int(item_guid(audio)[:8], 16) < fraction * 0x100000000
+
+def check_known_length(audio, known, result):
+    """Compare a sampled probe with the recorded size; the probe wins unless it failed."""
+    if isinstance(result, Exception):
+        metrics.inc("enclosure_size_checks_total", result="error")
+        return known
+    if result != known:
+        metrics.inc("enclosure_size_checks_total", result="mismatch")
+        print(f"! size mismatch for {audio}: recorded {known}, probed {result}")
+        return result
+    metrics.inc("enclosure_size_checks_total", result="match")
+    return result
+
+def format_duration(seconds):
+    """``H:MM:SS`` for ``itunes:duration``."""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def build_item(row, pubdate, probe=None):
+    """Render one ``<item>`` or return ``None`` if it has to be skipped.
+
+    ``probe`` is the precomputed result of :func:`probe_enclosures` for this
+    row's audio URL (a length or an exception).  When omitted the enclosure is
+    probed here.
+    """
     title = safe_get(row, "Book_Title") or "عنوان بدون نام"
-    audio = safe_get(row, "FullBook_MP3_URL") or safe_get(row, "Player_Link")
+    audio = audio_url(row)
     if not audio:
+        metrics.inc("feed_items_skipped_total", reason="no_audio")
         return None
 
     image = safe_get(row, "Cover_Image_URL")
-    duration = safe_get(row, "Book_Duration")
+    # The duration read from the MP3 header (MP3_PROBE) beats the page text.
+    probed = safe_get(row, "FullBook_MP3_Duration")
+    duration = format_duration(probed) if probed.isdigit() else safe_get(row, "Book_Duration")
     author = safe_get(row, "Book_Producer") or safe_get(row, "Book_Author")
     category = safe_get(row, "Book_Category") or safe_get(row, "Book_Genre")
     lang = safe_get(row, "Book_Language") or "fa"
@@ -117,15 +290,20 @@ def build_item(row, pubdate):
         desc = _join(trimmed)
 
     try:
-        length = fetch_audio_length(audio)
+        if probe is None:
+            probe = fetch_audio_length(audio)
+        if isinstance(probe, Exception):
+            raise probe
+        length = probe
     except Exception as e:
         # If we cannot determine the length or content type, skip this entry
         # instead of terminating the whole feed generation process. This can
         # happen when the remote server responds with HTML or another
         # unexpected payload when a HEAD request is made.
         print(f"Skipping {audio}: {e}")
+        metrics.inc("feed_items_skipped_total", reason=skip_reason(e))
         return None
-    guid_str = hashlib.sha1(audio.encode("utf-8")).hexdigest()
+    guid_str = item_guid(audio)
     parts = []
     parts.append("    <item>")
     parts.append("      <title>" + escape(title) + "</title>")
@@ -148,28 +326,156 @@ def build_item(row, pubdate):
     parts.append("    </item>")
     return "\n".join(parts)
 
-def main():
-    import argparse, os
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--csv", required=True)
-    ap.add_argument("--out", help="Exact output file path")
-    ap.add_argument("--out-dir", default="public/feeds")
-    ap.add_argument("--run-name", default=os.getenv("RUN_NAME","latest"))
-    ap.add_argument("--site", required=True)
-    ap.add_argument("--channel-title", default="کتاب‌های صوتی من")
-    ap.add_argument("--channel-author", default="Mustafa Tayefi")
-    ap.add_argument("--channel-summary", default="جمع آوری بخشی از کتاب های صوتی موجود در سایت ایران صدا  در جهت استفاده در نرم افزار پادگیر")
-    args = ap.parse_args()
+# What the incremental mode remembers about an item of the previous feed.
+FeedEntry = namedtuple("FeedEntry", "pubdate length digest")
 
-    rows = read_rows(args.csv)
-    pubdate = now_rfc822()
-    cover = rows and safe_get(rows[0], "Cover_Image_URL") or ""
+_GUID_RE = re.compile(r"<guid[^>]*>([0-9a-f]{40})</guid>")
+_PUBDATE_RE = re.compile(r"<pubDate>([^<]*)</pubDate>")
+_LENGTH_RE = re.compile(r'<enclosure [^>]*length="(\d+)"')
+
+def _digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def index_feed(path):
+    """Index the items of a previously generated feed by their SHA-1 guid.
+
+    The file is read line by line (newlines preserved) and only a digest of
+    each ``<item>`` block is kept, so the index stays small.
+    """
+    index = {}
+    if not os.path.exists(path):
+        return index
+    block = None
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for line in f:
+            bare = line.rstrip("\r\n")
+            if block is None:
+                if bare == "    <item>":
+                    block = [line]
+                continue
+            block.append(line)
+            if bare == "    </item>":
+                text = "".join(block)
+                text = text[: len(text) - (len(line) - len(bare))]
+                guid, pubdate, length = (_GUID_RE.search(text), _PUBDATE_RE.search(text), _LENGTH_RE.search(text))
+                if guid and pubdate and length:
+                    index[guid.group(1)] = FeedEntry(pubdate.group(1), int(length.group(1)), _digest(text))
+                block = None
+    return index
+
+def iter_items(rows, pubdate, batch=512, previous=None, stats=None,
+               workers=16, per_host=4, cache=None, revalidate=False, client=None, verify_sample=0.0):
+    """Yield rendered items in row order while enclosures are probed in parallel.
+
+    Each row's probe is submitted as soon as the row is read, and at most
+    ``batch`` rows (and their probes) are in flight, so memory stays flat
+    however large the catalog is and ``rows`` may be a slow producer (see
+    ``pipeline.py``).  ``per_host`` caps concurrent probes per host.
+
+    With ``previous`` (see :func:`index_feed`) each row whose guid is already
+    published is first rendered with the old length and pubDate; when that
+    reproduces the old item exactly (and no other size is recorded for it)
+    it is reused as-is and never probed.
+    Only new and changed items are probed and stamped with ``pubdate``.
+    ``stats`` (a Counter) receives ``reused``/``changed``/``new`` counts.
+
+    Rows with a size recorded by the enrichment stage (:func:`known_length`)
+    are not probed at all, except for the ``verify_sample`` fraction chosen
+    by :func:`verify_sampled`, whose probes are checked against the record.
+    """
+    stats = stats if stats is not None else Counter()
+    probe = HostLimiter(per_host, cache=cache, revalidate=revalidate, client=client)
+    window = deque()  # (row, reused item or None, audio url, recorded size, probed?)
+    probes = {}       # audio url -> [future, rows in the window using it]
+
+    def _admit(r, ex):
+        audio = audio_url(r)
+        known = known_length(r)
+        if previous and audio:
+            old = previous.get(item_guid(audio))
+            # A newly recorded size differing from the published one is a change.
+            if old is not None and known in (None, old.length):
+                it = build_item(r, old.pubdate, old.length)
+                if it and _digest(it) == old.digest:
+                    window.append((r, it, audio, None, False))
+                    return
+        probed = bool(audio) and (known is None or verify_sampled(audio, verify_sample))
+        if known is not None and not probed:
+            metrics.inc("enclosure_probes_total", result="trusted")
+        if probed:
+            if audio not in probes:
+                probes[audio] = [ex.submit(probe, audio), 0]
+            probes[audio][1] += 1
+        window.append((r, None, audio, known, probed))
+
+    def _emit():
+        r, reused, audio, known, probed = window.popleft()
+        if reused is not None:
+            stats["reused"] += 1
+            return reused
+        result = known
+        if probed:
+            entry = probes[audio]
+            result = entry[0].result()
+            entry[1] -= 1
+            if not entry[1]:
+                del probes[audio]
+            if known is not None:
+                result = check_known_length(audio, known, result)
+        it = build_item(r, pubdate, result)
+        if it:
+            stats["changed" if previous and item_guid(audio) in previous else "new"] += 1
+        return it
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        for r in rows:
+            _admit(r, ex)
+            if len(window) >= max(1, batch):
+                it = _emit()
+                if it:
+                    yield it
+        while window:
+            it = _emit()
+            if it:
+                yield it
 
-    items = []
-    for r in rows:
-        it = build_item(r, pubdate)
-        if it: items.append(it)
+class AtomicWriter:
+    """Buffered text writer that replaces ``path`` only once it is complete.
 
+    Content goes to a temporary file in the same directory and is renamed
+    over the target on success, so readers (e.g. GitHub Pages) never see a
+    half-written feed.  On error the temporary file is removed.
+    """
+
+    def __init__(self, path, buffering=1 << 16, binary=False):
+        self.path = path
+        self.buffering = buffering
+        self.binary = binary
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, self.tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".xml", dir=directory)
+        if self.binary:
+            self.f = os.fdopen(fd, "wb", buffering=self.buffering)
+        else:
+            self.f = os.fdopen(fd, "w", encoding="utf-8", buffering=self.buffering)
+        return self.f
+
+    def __exit__(self, exc_type, exc, tb):
+        self.f.close()
+        if exc_type is None:
+            os.chmod(self.tmp, 0o644)
+            os.replace(self.tmp, self.path)
+        else:
+            os.unlink(self.tmp)
+        return False
+
+def feed_url(args, name):
+    return args.site.rstrip("/") + "/feeds/" + args.run_name + "/" + name
+
+def channel_header(args, pubdate, cover, links=()):
+    """Channel preamble; ``links`` are extra ``(rel, name)`` atom links (paging)."""
     rss_parts = []
     rss_parts.append('<?xml version="1.0" encoding="UTF-8"?>')
     rss_parts.append('<rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd" xmlns:atom="http://www.w3.org/2005/Atom">')
@@ -182,15 +488,248 @@ def main():
     rss_parts.append("    <itunes:summary>"+escape(args.channel_summary)+"</itunes:summary>")
     rss_parts.append("    <description>"+cdata(args.channel_summary)+"</description>")
     if cover: rss_parts.append('    <itunes:image href="'+escape(cover)+'"/>')
-    rss_parts.append('    <atom:link href="'+escape(args.site.rstrip("/"))+'/feeds/'+escape(args.run_name)+'/podcast.xml" rel="self" type="application/rss+xml" />')
-    rss_parts.append("\n".join(items))
-    rss_parts.append("  </channel>")
-    rss_parts.append("</rss>")
-
-    out_file = args.out or os.path.join(args.out_dir, args.run_name, "podcast.xml")
-    os.makedirs(os.path.dirname(out_file), exist_ok=True)
-    with open(out_file, "w", encoding="utf-8") as f:
-        f.write("\n".join(rss_parts))
+    self_name = dict(links).get("self", "podcast.xml")
+    rss_parts.append('    <atom:link href="'+escape(feed_url(args, self_name))+'" rel="self" type="application/rss+xml" />')
+    for rel, name in links:
+        if rel != "self":
+            rss_parts.append('    <atom:link href="'+escape(feed_url(args, name))+'" rel="'+rel+'" type="application/rss+xml" />')
+    return "\n".join(rss_parts)
+
+CHANNEL_FOOTER = "  </channel>\n</rss>"
+
+def page_path(out_file, n):
+    """Path of page ``n`` of a paged feed: ``podcast.xml``, ``podcast-2.xml``, ..."""
+    if n == 1:
+        return out_file
+    stem, ext = os.path.splitext(out_file)
+    return f"{stem}-{n}{ext}"
+
+def existing_pages(out_file):
+    """Paths of the pages of a previously written feed, in order."""
+    pages = []
+    for n in itertools.count(1):
+        path = page_path(out_file, n)
+        if not os.path.exists(path):
+            return pages
+        pages.append(path)
+
+def index_feed_pages(out_file):
+    """:func:`index_feed` over every page of a (possibly paged) feed."""
+    index = {}
+    for path in existing_pages(out_file):
+        index.update(index_feed(path))
+    return index
+
+COMPRESSED_SUFFIXES = (".gz", ".br")
+
+def precompress(path):
+    """Write ``path.gz`` (and ``path.br`` when brotli is installed) next to ``path``."""
+    with open(path, "rb") as f:
+        data = f.read()
+    with AtomicWriter(path + ".gz", binary=True) as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    written = [path + ".gz"]
+    if brotli is not None:
+        with AtomicWriter(path + ".br", binary=True) as f:
+            f.write(brotli.compress(data, quality=11))
+        written.append(path + ".br")
+    for sibling in (path + s for s in COMPRESSED_SUFFIXES):
+        if sibling not in written and os.path.exists(sibling):
+            os.unlink(sibling)
+    return written
+
+def write_pages(args, pubdate, cover, items, out_file, page_size):
+    """Write ``items`` as an RFC 5005 paged feed of ``page_size`` items per page.
+
+    Page 1 is ``out_file`` (the URL clients subscribe to) and holds the first
+    items; every page links to the first one and to its neighbours with
+    ``atom:link rel="first"/"previous"/"next"``.  Only one page of items is
+    held in memory.  Returns the written paths.
+    """
+    items = iter(items)
+    name = lambda n: os.path.basename(page_path(out_file, n))
+    paths = []
+    chunk = list(itertools.islice(items, page_size))
+    for n in itertools.count(1):
+        following = list(itertools.islice(items, page_size))
+        links = [("self", name(n)), ("first", name(1))]
+        if n > 1:
+            links.append(("previous", name(n - 1)))
+        if following:
+            links.append(("next", name(n + 1)))
+        path = page_path(out_file, n)
+        with AtomicWriter(path) as f:
+            f.write(channel_header(args, pubdate, cover, links))
+            f.write("\n")
+            f.write("\n".join(chunk))
+            f.write("\n")
+            f.write(CHANNEL_FOOTER)
+        paths.append(path)
+        if not following:
+            return paths
+        chunk = following
+
+def remove_stale_pages(out_file, pages):
+    """Delete pages beyond the first ``pages`` left over from a longer feed."""
+    for path in existing_pages(out_file)[pages:]:
+        for p in [path] + [path + s for s in COMPRESSED_SUFFIXES]:
+            if os.path.exists(p):
+                os.unlink(p)
+
+def build_parser():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--csv", help="Merged CSV of the run (required unless --catalog)")
+    ap.add_argument("--out", help="Exact output file path")
+    ap.add_argument("--out-dir", default="public/feeds")
+    ap.add_argument("--run-name", default=os.getenv("RUN_NAME","latest"))
+    ap.add_argument("--site", required=True)
+    ap.add_argument("--channel-title", default="کتاب‌های صوتی من")
+    ap.add_argument("--channel-author", default="Mustafa Tayefi")
+    ap.add_argument("--channel-summary", default="جمع آوری بخشی از کتاب های صوتی موجود در سایت ایران صدا  در جهت استفاده در نرم افزار پادگیر")
+    ap.add_argument("--probe-workers", type=int, default=16, help="Parallel enclosure probes")
+    ap.add_argument("--probe-per-host", type=int, default=4, help="Concurrent probes per host")
+    ap.add_argument("--probe-batch", type=int, default=512, help="Rows probed (and held in memory) at a time")
+    ap.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Enclosure metadata cache (SQLite)")
+    ap.add_argument("--no-cache", action="store_true", help="Probe every enclosure without the cache")
+    ap.add_argument("--cache-ttl-days", type=float, default=DEFAULT_TTL / 86400)
+    ap.add_argument("--cache-max-entries", type=int, default=DEFAULT_MAX_ENTRIES)
+    ap.add_argument("--revalidate", action="store_true", help="Revalidate every cached enclosure")
+    ap.add_argument("--verify-sample", type=float, default=0.0,
+                    help="Fraction (0-1) of enclosures with a recorded FullBook_MP3_Size that are probed anyway")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Reuse unchanged items (and their pubDate) from the existing feed")
+    ap.add_argument("--page-size", type=int, default=0,
+                    help="Items per page of an RFC 5005 paged feed (podcast.xml, podcast-2.xml, ...); 0 = one file")
+    ap.add_argument("--precompress", action="store_true",
+                    help="Also write .gz (and .br if brotli is installed) next to every feed file")
+    ap.add_argument("--covers-dir", help="Point item and channel images at the covers published "
+                    "here by tools/covers.py (e.g. public/covers)")
+    ap.add_argument("--covers-url", help="Public URL of --covers-dir (default: <site>/covers)")
+    ap.add_argument("--cover-size", type=int, default=1400, help="Published cover variant to use")
+    ap.add_argument("--cover-cache", help="Cover cache of tools/covers.py (default: runs/.cache/covers)")
+    ap.add_argument("--catalog", nargs="?", const=DEFAULT_CATALOG_PATH,
+                    help="Catalog database: read the run's books from it when --csv is omitted "
+                    "and record the published items (default path: %(const)s)")
+    ap.add_argument("--metrics-dir", help="Where metrics.json/metrics.prom go "
+                    "(default: runs/<RUN_NAME>/ for a merged CSV, else next to the feed)")
+    return ap
+
+def output_path(args):
+    return args.out or os.path.join(args.out_dir, args.run_name, "podcast.xml")
+
+def metrics_dir(args):
+    if args.metrics_dir:
+        return args.metrics_dir
+    if not args.csv:
+        return os.path.join(os.path.dirname(os.path.abspath(args.catalog)), args.run_name)
+    csv_dir = os.path.dirname(os.path.abspath(args.csv))
+    if os.path.basename(csv_dir) == "merged":
+        return os.path.dirname(csv_dir)
+    return os.path.dirname(os.path.abspath(output_path(args)))
+
+def build_feed(args, cache=None, client=None, rows=None, catalog=None):
+    """Stream the feed described by ``args`` to its output file.
+
+    ``rows`` replaces reading ``args.csv`` (``pipeline.py`` passes books as
+    they are enriched); without either the run's books come from ``catalog``.
+    With a :class:`~tools.catalog.Catalog` the published items are recorded
+    there, and ``--incremental`` falls back to them when the previous feed
+    file is missing.
+    """
+    if rows is not None:
+        rows = iter(rows)
+    elif args.csv:
+        rows = iter_rows(args.csv)
+    else:
+        rows = catalog.run_books(args.run_name)
+    covers = None
+    if args.covers_dir:
+        # Imported here: tools/covers.py pulls in Pillow, which only this option needs.
+        try:
+            from tools.covers import CoverMap, CoverStore, DEFAULT_CACHE_DIR
+        except ImportError:  # executed as ``python tools/csv_to_podcast.py``
+            from covers import CoverMap, CoverStore, DEFAULT_CACHE_DIR
+        covers = CoverStore(args.cover_cache or DEFAULT_CACHE_DIR)
+        cover_map = CoverMap(covers, args.covers_dir, args.covers_url or args.site.rstrip("/") + "/covers",
+                             size=args.cover_size)
+        rows = (cover_map.rewrite(r) for r in rows)
+    try:
+        return _write_feed(args, rows, cache, client, catalog)
+    finally:
+        if covers:
+            covers.close()
+
+def _write_feed(args, rows, cache, client, catalog):
+    first = next(rows, None)
+    if first is not None:
+        rows = itertools.chain([first], rows)
+    pubdate = now_rfc822()
+    cover = first and safe_get(first, "Cover_Image_URL") or ""
+    out_file = output_path(args)
+    previous = index_feed_pages(out_file) if args.incremental else None
+    if args.incremental and not previous and catalog:
+        previous = {guid: FeedEntry(*e) for guid, e in catalog.feed_items(args.run_name).items()}
+    stats = Counter()
+
+    items = iter_items(rows, pubdate, batch=args.probe_batch, previous=previous, stats=stats,
+                       workers=args.probe_workers, per_host=args.probe_per_host,
+                       cache=cache, revalidate=args.revalidate, client=client,
+                       verify_sample=args.verify_sample)
+    if args.page_size > 0:
+        paths = write_pages(args, pubdate, cover, items, out_file, args.page_size)
+    else:
+        with AtomicWriter(out_file) as f:
+            f.write(channel_header(args, pubdate, cover))
+            f.write("\n")
+            for n, it in enumerate(items):
+                if n:
+                    f.write("\n")
+                f.write(it)
+            f.write("\n")
+            f.write(CHANNEL_FOOTER)
+        paths = [out_file]
+    remove_stale_pages(out_file, len(paths))
+    for path in paths:
+        if args.precompress:
+            precompress(path)
+        else:
+            for stale in (path + s for s in COMPRESSED_SUFFIXES):
+                if os.path.exists(stale):
+                    os.unlink(stale)
+    metrics.set_gauge("feed_pages", len(paths))
+    for status, n in stats.items():
+        metrics.inc("feed_items_total", n, status=status)
+    if catalog:
+        catalog.put_feed_items(args.run_name, index_feed_pages(out_file))
+    if previous is not None:
+        print(f"Incremental: {stats['reused']} unchanged, {stats['changed']} changed, "
+              f"{stats['new']} new, {len(previous) - stats['reused'] - stats['changed']} removed")
+    return out_file
+
+def open_catalog(args):
+    return Catalog(args.catalog) if args.catalog else None
+
+def open_cache(args):
+    if args.no_cache:
+        return None
+    return EnclosureCache(args.cache, ttl=args.cache_ttl_days * 86400,
+                          max_entries=args.cache_max_entries)
+
+def main(argv=None):
+    ap = build_parser()
+    args = ap.parse_args(argv)
+    if not args.csv and not args.catalog:
+        ap.error("one of --csv or --catalog is required")
+    with metrics.stage_run("feed", metrics_dir(args)):
+        cache = open_cache(args)
+        catalog = open_catalog(args)
+        try:
+            out_file = build_feed(args, cache=cache, client=default_client(), catalog=catalog)
+        finally:
+            if cache:
+                cache.close()
+            if catalog:
+                catalog.close()
     print("Wrote:", out_file)
 
 if __name__ == "__main__":
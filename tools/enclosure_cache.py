@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""On-disk cache of enclosure metadata used by ``csv_to_podcast``.
+
+Each row is keyed by the enclosure URL and keeps the headers returned by the
+last HEAD request (Content-Length, Content-Type, ETag, Last-Modified) plus the
+time it was checked.  Entries younger than ``ttl`` seconds are trusted as-is;
+older ones are revalidated with a conditional request.  The table is trimmed
+to ``max_entries`` rows, dropping the least recently checked URLs first.
+"""
+import os, sqlite3, threading, time
+
+DEFAULT_CACHE_PATH = os.path.join("runs", ".cache", "enclosures.sqlite")
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 200_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS enclosures (
+    url TEXT PRIMARY KEY,
+    content_length INTEGER,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    checked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS enclosures_checked_at ON enclosures(checked_at);
+"""
+
+class EnclosureCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def get(self, url):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM enclosures WHERE url = ?", (url,)).fetchone()
+        return dict(row) if row else None
+
+    def is_fresh(self, entry, now=None):
+        return (now or time.time()) - entry["checked_at"] < self.ttl
+
+    def put(self, url, headers):
+        """Store the (lower-cased) response headers of a HEAD request."""
+        length = headers.get("content-length")
+        values = (
+            url,
+            int(length) if length and length.isdigit() else None,
+            headers.get("content-type"),
+            headers.get("etag"),
+            headers.get("last-modified"),
+            time.time(),
+        )
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO enclosures VALUES (?, ?, ?, ?, ?, ?)", values)
+
+    def touch(self, url):
+        """Mark an entry as checked now, e.g. after a ``304 Not Modified``."""
+        with self._lock:
+            self._db.execute("UPDATE enclosures SET checked_at = ? WHERE url = ?", (time.time(), url))
+
+    def evict(self):
+        """Drop the least recently checked rows beyond ``max_entries``."""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM enclosures WHERE url IN ("
+                " SELECT url FROM enclosures ORDER BY checked_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def close(self):
+        self.evict()
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def headers_of(entry):
+        """Rebuild a lower-cased header dict from a cached entry."""
+        headers = {}
+        if entry.get("content_type") is not None:
+            headers["content-type"] = entry["content_type"]
+        if entry.get("content_length") is not None:
+            headers["content-length"] = str(entry["content_length"])
+        return headers
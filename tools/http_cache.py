@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Conditional-GET response cache shared by the scraping stages.
+
+Successful GET responses are stored zlib-compressed in SQLite together with
+their ``ETag``/``Last-Modified`` validators.  The next request for the same
+URL is sent with ``If-None-Match``/``If-Modified-Since`` and a ``304`` is
+answered from the stored body, so a re-run only transfers what changed.
+
+``HTTP_CACHE`` selects the mode: ``on`` (default), ``off`` or ``offline``.
+Offline mode never touches the network and replays stored bodies; URLs that
+were never fetched raise :class:`CacheMiss`.
+"""
+import os, sqlite3, threading, time, zlib
+import requests
+from requests.structures import CaseInsensitiveDict
+
+try:
+    from tools import metrics
+    from tools.http_client import default_client
+except ImportError:  # imported from within tools/
+    import metrics
+    from http_client import default_client
+
+HTTP_CACHE_MODE = os.getenv("HTTP_CACHE", "on").strip().lower() or "on"
+HTTP_CACHE_PATH = os.getenv("HTTP_CACHE_PATH", os.path.join(os.getenv("RUNS_DIR", "runs"), ".cache", "http.sqlite"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL
+);
+"""
+
+class CacheMiss(requests.RequestException):
+    """Raised in offline mode for URLs that are not in the cache."""
+
+class ResponseCache:
+    def __init__(self, path=HTTP_CACHE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def get(self, url):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM responses WHERE url = ?", (url,)).fetchone()
+        if not row:
+            return None
+        entry = dict(row)
+        entry["body"] = zlib.decompress(entry["body"])
+        return entry
+
+    def put(self, url, response):
+        values = (
+            url,
+            zlib.compress(response.content, 6),
+            response.headers.get("Content-Type"),
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            time.time(),
+        )
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", values)
+
+    def touch(self, url):
+        with self._lock:
+            self._db.execute("UPDATE responses SET fetched_at = ? WHERE url = ?", (time.time(), url))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+def default_cache():
+    """Return the process-wide cache configured by the environment."""
+    global _default_cache
+    if HTTP_CACHE_MODE == "off":
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(HTTP_CACHE_PATH)
+    return _default_cache
+
+def _reset_after_fork():
+    # SQLite connections must not be used across fork(); children reopen.
+    global _default_cache, _default_lock
+    _default_cache = None
+    _default_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def replay(url, entry):
+    """Build a ``requests.Response`` from a cached entry."""
+    r = requests.Response()
+    r.status_code = 200
+    r.url = url
+    r._content = entry["body"]
+    r.headers = CaseInsensitiveDict()
+    for header, key in (("Content-Type", "content_type"), ("ETag", "etag"), ("Last-Modified", "last_modified")):
+        if entry.get(key):
+            r.headers[header] = entry[key]
+    r.from_cache = True
+    return r
+
+def cached_get(url, cache=None, offline=None, fetch=None, timeout=None):
+    """GET ``url`` through the response cache.
+
+    ``cache`` defaults to :func:`default_cache`; ``offline`` defaults to the
+    ``HTTP_CACHE=offline`` setting; ``fetch`` defaults to the shared
+    :class:`~tools.http_client.HttpClient`, whose ``HTTP_TIMEOUT`` applies
+    unless ``timeout`` is given.  Non-200 responses are returned untouched
+    and never stored, so callers keep their own status handling.
+    """
+    if cache is None:
+        cache = default_cache()
+    if offline is None:
+        offline = HTTP_CACHE_MODE == "offline"
+    entry = cache.get(url) if cache else None
+    if offline:
+        if entry is None:
+            metrics.inc("http_cache_total", result="miss")
+            raise CacheMiss(f"not cached: {url}")
+        metrics.inc("http_cache_total", result="offline")
+        return replay(url, entry)
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    opts = {"timeout": timeout} if timeout is not None else {}
+    r = (fetch or default_client().get)(url, headers=headers, **opts)
+    if entry and r.status_code == 304:
+        metrics.inc("http_cache_total", result="not_modified")
+        cache.touch(url)
+        return replay(url, entry)
+    if cache:
+        metrics.inc("http_cache_total", result="changed" if entry else "miss")
+    if cache and r.status_code == 200:
+        cache.put(url, r)
+    r.from_cache = False
+    return r
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Pooled, retrying HTTP client shared by the scrape, enrich and feed stages.
+
+* One ``requests.Session`` per host, so connections (and TLS sessions) are
+  reused across requests and threads.
+* Retries with exponential backoff and full jitter on timeouts, connection
+  errors, 429 and 5xx responses; ``Retry-After`` is honoured when present.
+* An AIMD rate limiter per host: the allowed request rate grows a little
+  after every fast, successful response and is cut back when the server
+  answers with errors or latency climbs above ``HTTP_LATENCY_TARGET``.
+
+Configuration comes from the environment: ``MAX_RPS_PER_HOST`` (ceiling,
+``0`` disables pacing), ``MIN_RPS_PER_HOST``, ``HTTP_RETRIES``,
+``HTTP_TIMEOUT``, ``HTTP_LATENCY_TARGET`` and ``HTTP_POOL_SIZE``.
+
+Every attempt is recorded in :mod:`tools.metrics` per host and endpoint
+(URL path): latency, status, response bytes and retries.
+"""
+import os, random, threading, time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from tools import metrics
+except ImportError:  # imported from within tools/
+    import metrics
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRY_EXCEPTIONS = (requests.Timeout, requests.ConnectionError)
+
+def _env_float(name, default):
+    return float(os.getenv(name, "") or default)
+
+class AdaptiveRateLimiter:
+    """Per-host request pacing with additive increase, multiplicative decrease."""
+
+    def __init__(self, max_rps=5.0, min_rps=0.5, initial_rps=None, latency_target=2.0,
+                 increase=0.1, decrease=0.5):
+        self.max_rps = max_rps
+        self.min_rps = min(min_rps, max_rps) if max_rps > 0 else 0.0
+        self.initial_rps = initial_rps or max(self.min_rps, max_rps / 2)
+        self.latency_target = latency_target
+        self.increase = increase
+        self.decrease = decrease
+        self._lock = threading.Lock()
+        self._rate = {}
+        self._next_slot = {}
+
+    def rate(self, host):
+        with self._lock:
+            return self._rate.get(host, self.initial_rps)
+
+    def wait(self, host):
+        if self.max_rps <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + 1.0 / self._rate.get(host, self.initial_rps)
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def record(self, host, latency, ok):
+        if self.max_rps <= 0:
+            return
+        with self._lock:
+            rate = self._rate.get(host, self.initial_rps)
+            if not ok:
+                rate *= self.decrease
+            elif latency > self.latency_target:
+                rate *= (1 + self.decrease) / 2
+            else:
+                rate += self.increase
+            self._rate[host] = min(self.max_rps, max(self.min_rps, rate))
+
+class HttpClient:
+    def __init__(self, limiter=None, retries=4, backoff=0.5, max_backoff=30.0, timeout=30.0,
+                 pool_size=32, session_factory=requests.Session, sleep=time.sleep):
+        self.limiter = limiter or AdaptiveRateLimiter(max_rps=0)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session_factory = session_factory
+        self._sleep = sleep
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, host):
+        with self._lock:
+            s = self._sessions.get(host)
+            if s is None:
+                s = self._session_factory()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                self._sessions[host] = s
+            return s
+
+    def _delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.strip().isdigit():
+            return min(self.max_backoff, float(retry_after))
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method, url, **kwargs):
+        """Send a request, retrying transient failures.
+
+        After the last attempt a retryable response is returned as-is (so the
+        caller's ``raise_for_status`` reports it) and a retryable exception is
+        re-raised.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        parts = urlparse(url)
+        host = parts.netloc
+        labels = {"host": host, "endpoint": parts.path.rstrip("/") or "/", "method": method}
+        session = self.session(host)
+        for attempt in range(self.retries + 1):
+            self.limiter.wait(host)
+            start = time.monotonic()
+            try:
+                r = session.request(method, url, **kwargs)
+            except RETRY_EXCEPTIONS as e:
+                elapsed = time.monotonic() - start
+                self.limiter.record(host, elapsed, ok=False)
+                metrics.observe("http_request_seconds", elapsed, **labels)
+                metrics.inc("http_requests_total", status=type(e).__name__, **labels)
+                if attempt == self.retries:
+                    raise
+                metrics.inc("http_retries_total", reason=type(e).__name__, **labels)
+                self._sleep(self._delay(attempt))
+                continue
+            elapsed = time.monotonic() - start
+            ok = r.status_code not in RETRY_STATUSES
+            self.limiter.record(host, elapsed, ok=ok)
+            metrics.observe("http_request_seconds", elapsed, **labels)
+            metrics.inc("http_requests_total", status=r.status_code, **labels)
+            if not kwargs.get("stream"):
+                metrics.inc("http_response_bytes_total", len(r.content), **labels)
+            if ok or attempt == self.retries:
+                return r
+            metrics.inc("http_retries_total", reason=r.status_code, **labels)
+            self._sleep(self._delay(attempt, r))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for s in self._sessions.values():
+                s.close()
+            self._sessions.clear()
+
+_default_client = None
+_default_lock = threading.Lock()
+
+def default_client():
+    """Return the process-wide client configured by the environment."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            limiter = AdaptiveRateLimiter(
+                max_rps=_env_float("MAX_RPS_PER_HOST", 5),
+                min_rps=_env_float("MIN_RPS_PER_HOST", 0.5),
+                latency_target=_env_float("HTTP_LATENCY_TARGET", 2.0),
+            )
+            _default_client = HttpClient(
+                limiter=limiter,
+                retries=int(_env_float("HTTP_RETRIES", 4)),
+                timeout=_env_float("HTTP_TIMEOUT", 30),
+                pool_size=int(_env_float("HTTP_POOL_SIZE", 32)),
+            )
+    return _default_client
+
+def _reset_after_fork():
+    # Pooled sockets must not be shared with a forked child (process pools).
+    global _default_client, _default_lock
+    _default_client = None
+    _default_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
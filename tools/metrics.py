@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""In-process metrics for the scrape, enrich and feed stages.
+
+Counters, gauges and histograms live in one thread-safe :class:`Registry`
+per process (``REGISTRY``); the module-level :func:`inc`, :func:`observe`,
+:func:`set_gauge` and :func:`timer` record into it.  A stage wraps its run
+in :func:`stage_run`, which times it and on exit merges the stage's metrics
+into ``<run dir>/metrics.json`` and rewrites ``<run dir>/metrics.prom`` in the
+Prometheus textfile format (one ``stage`` label per stage).
+
+``PROFILE=1`` (or a comma-separated list of stage names, e.g.
+``PROFILE=enrich``) additionally records a cProfile of the stage, including
+its worker threads, to ``<run dir>/profile_<stage>.prof``; inspect it with
+``python -m pstats``.
+"""
+import bisect, cProfile, json, os, pstats, sys, tempfile, threading, time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+PREFIX = "radioseda_"
+# Upper bounds (seconds) of the latency buckets; ``+Inf`` is implicit.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """``[(le, count)]`` with running totals, ending with ``+Inf``."""
+        out, total = [], 0
+        for le, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            out.append((le, total))
+        return out
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = Histogram(buckets)
+            h.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """JSON-friendly copy of every metric."""
+        with self._lock:
+            return {
+                "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.counters.items())],
+                "gauges": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.gauges.items())],
+                "histograms": [
+                    {"name": n, "labels": dict(l), "count": h.count, "sum": h.sum,
+                     "buckets": [["+Inf" if le == float("inf") else le, c] for le, c in h.cumulative()]}
+                    for (n, l), h in sorted(self.histograms.items())
+                ],
+            }
+
+REGISTRY = Registry()
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set_gauge
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+def _reset_after_fork():
+    # A forked worker starts with empty metrics and a fresh lock.
+    REGISTRY._lock = threading.Lock()
+    REGISTRY.reset()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _labels(labels):
+    if not labels:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels.items()
+    )
+    return "{" + body + "}"
+
+def render_prometheus(stages):
+    """Render ``metrics.json``-style ``{stage: snapshot}`` as a Prometheus textfile."""
+    series = {}
+    for stage, snap in sorted(stages.items()):
+        for kind, type_ in (("counters", "counter"), ("gauges", "gauge")):
+            for m in snap.get(kind, []):
+                lines = series.setdefault((PREFIX + m["name"], type_), [])
+                lines.append(f"{PREFIX}{m['name']}{_labels({'stage': stage, **m['labels']})} {m['value']}")
+        for m in snap.get("histograms", []):
+            name = PREFIX + m["name"]
+            lines = series.setdefault((name, "histogram"), [])
+            base = {"stage": stage, **m["labels"]}
+            for le, count in m["buckets"]:
+                lines.append(f"{name}_bucket{_labels({**base, 'le': le})} {count}")
+            lines.append(f"{name}_sum{_labels(base)} {m['sum']}")
+            lines.append(f"{name}_count{_labels(base)} {m['count']}")
+    out = []
+    for (name, type_), lines in sorted(series.items()):
+        out.append(f"# TYPE {name} {type_}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+def write_run_metrics(run_dir, stage, seconds, registry=REGISTRY):
+    """Merge ``stage``'s metrics into ``run_dir/metrics.json`` and rewrite ``metrics.prom``."""
+    os.makedirs(run_dir, exist_ok=True)
+    path = os.path.join(run_dir, "metrics.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        report = {}
+    stages = report.setdefault("stages", {})
+    stages[stage] = {
+        "finished_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "seconds": round(seconds, 3),
+        **registry.snapshot(),
+    }
+    _write_atomic(path, json.dumps(report, ensure_ascii=False, indent=2))
+    _write_atomic(os.path.join(run_dir, "metrics.prom"),
+                  render_prometheus({name: snap for name, snap in stages.items()}))
+    return path
+
+def _profile_enabled(stage):
+    wanted = {s.strip().lower() for s in os.getenv("PROFILE", "").split(",") if s.strip()}
+    return bool(wanted & {"1", "true", "yes", "all", stage})
+
+class _ThreadedProfile:
+    """cProfile of the calling thread plus every thread started while active."""
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def _start_thread(self, *args):
+        # Runs as the first profile event of a new thread: swap in a profiler.
+        sys.setprofile(None)
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:  # Python 3.12+: only one profiler may be active at a time
+            return
+        with self._lock:
+            self.profiles.append(prof)
+
+    def start(self):
+        main = cProfile.Profile()
+        main.enable()
+        self.profiles.append(main)
+        threading.setprofile(self._start_thread)
+
+    def stop(self, path):
+        threading.setprofile(None)
+        self.profiles[0].disable()
+        stats = pstats.Stats(self.profiles[0])
+        for prof in self.profiles[1:]:
+            stats.add(prof)
+        stats.dump_stats(path)
+
+@contextmanager
+def stage_run(stage, run_dir, registry=REGISTRY):
+    """Time a stage, optionally profile it, and write its metrics on exit."""
+    registry.reset()
+    profile = None
+    if _profile_enabled(stage):
+        os.makedirs(run_dir, exist_ok=True)
+        profile = _ThreadedProfile()
+        profile.start()
+    start = time.perf_counter()
+    try:
+        yield registry
+    finally:
+        seconds = time.perf_counter() - start
+        registry.set_gauge("stage_seconds", seconds)
+        if profile:
+            dump = os.path.join(run_dir, f"profile_{stage}.prof")
+            profile.stop(dump)
+            print(f"[metrics] profile -> {dump}")
+        print(f"[metrics] {stage}: {seconds:.1f}s -> {write_run_metrics(run_dir, stage, seconds, registry)}")
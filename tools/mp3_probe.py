@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""Read MP3 durations and bitrates from the first few KB of each file.
+
+Usage:
+    python tools/mp3_probe.py https://player.iranseda.ir/downloadfile/?attid=... [...]
+    MP3_PROBE=1 python script_iran_seda_final_STREAM_MERGE_v6_env.py
+
+Each file is probed with a ``Range: bytes=0-16383`` GET (a second one past a
+large ID3v2 tag if needed).  The first MPEG frame gives the bitrate and
+sample rate; a Xing/Info header (with the LAME encoder tag) or a VBRI header
+in that frame gives the frame count, so VBR files get an exact duration.
+CBR files without one are timed from the file size.  Results are kept per
+download attid in ``runs/.cache/mp3_headers.sqlite`` and never fetched again.
+
+The enrichment stage (``MP3_PROBE=1``) probes every MP3 of a book, picks the
+file with the highest bitrate (at most ``MP3_MAX_BITRATE`` kbps when set)
+and records its duration, which ``csv_to_podcast`` uses for
+``itunes:duration``.
+"""
+import argparse, json, os, re, sqlite3, struct, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from tools import metrics
+    from tools.http_client import default_client
+except ImportError:  # executed as ``python tools/mp3_probe.py``
+    import metrics
+    from http_client import default_client
+
+DEFAULT_CACHE_PATH = os.path.join("runs", ".cache", "mp3_headers.sqlite")
+PROBE_BYTES = 16 * 1024
+
+# kbps by bitrate index for (MPEG version 1?, layer)
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mp3_headers (
+    attid TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    info TEXT NOT NULL,
+    checked_at REAL NOT NULL
+);
+"""
+
+_ATTID_RE = re.compile(r"[?&]attid=(\d+)", re.I)
+
+def id3v2_size(data):
+    """Bytes taken by a leading ID3v2 tag (0 without one)."""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = 0
+    for b in data[6:10]:
+        size = (size << 7) | (b & 0x7F)
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+def parse_frame_header(data, i):
+    """Fields of the MPEG audio frame header at ``data[i:i+4]``, or ``None``."""
+    if i + 4 > len(data) or data[i] != 0xFF or data[i + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[i + 1] >> 3) & 3
+    layer = 4 - ((data[i + 1] >> 1) & 3)
+    bitrate_index = data[i + 2] >> 4
+    rate_index = (data[i + 2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _BITRATES[mpeg1, layer][bitrate_index]
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (data[i + 2] >> 1) & 1
+    mono = data[i + 3] >> 6 == 3
+    if layer == 1:
+        samples, length = 384, (12 * bitrate * 1000 // sample_rate + padding) * 4
+    elif layer == 2 or mpeg1:
+        samples, length = 1152, 144 * bitrate * 1000 // sample_rate + padding
+    else:
+        samples, length = 576, 72 * bitrate * 1000 // sample_rate + padding
+    return {"mpeg1": mpeg1, "layer": layer, "bitrate": bitrate, "sample_rate": sample_rate,
+            "channels": 1 if mono else 2, "samples": samples, "length": length}
+
+def find_first_frame(data, start=0):
+    """``(offset, header)`` of the first frame followed by another valid one."""
+    i = data.find(b"\xff", start)
+    while 0 <= i < len(data) - 4:
+        h = parse_frame_header(data, i)
+        if h:
+            nxt = i + h["length"]
+            if nxt + 4 > len(data) or parse_frame_header(data, nxt):
+                return i, h
+        i = data.find(b"\xff", i + 1)
+    return None, None
+
+def _vbr_header(data, i, h):
+    """``(kind, frames, bytes, encoder)`` from a Xing/Info or VBRI header in the frame at ``i``."""
+    if h["layer"] == 3:
+        side = (17 if h["channels"] == 1 else 32) if h["mpeg1"] else (9 if h["channels"] == 1 else 17)
+        x = i + 4 + side
+        tag = data[x:x + 4]
+        if tag in (b"Xing", b"Info") and x + 8 <= len(data):
+            flags = struct.unpack(">I", data[x + 4:x + 8])[0]
+            pos, frames, nbytes = x + 8, None, None
+            if flags & 1:
+                frames = struct.unpack(">I", data[pos:pos + 4])[0]
+                pos += 4
+            if flags & 2:
+                nbytes = struct.unpack(">I", data[pos:pos + 4])[0]
+                pos += 4
+            pos += (100 if flags & 4 else 0) + (4 if flags & 8 else 0)
+            encoder = data[pos:pos + 9].decode("latin-1") if data[pos:pos + 4] in (b"LAME", b"Lavf", b"Lavc") else None
+            return ("info" if tag == b"Info" else "xing"), frames, nbytes, encoder
+    v = i + 36
+    if data[v:v + 4] == b"VBRI" and v + 18 <= len(data):
+        nbytes, frames = struct.unpack(">II", data[v + 10:v + 18])
+        return "vbri", frames, nbytes, None
+    return None, None, None, None
+
+def parse_mp3_header(data, file_size=None, offset=0):
+    """Duration, bitrate and format of an MP3 from its first bytes.
+
+    ``data`` starts at byte ``offset`` of the file (after an ID3v2 tag that
+    did not fit in the first request).  Returns ``None`` if no MPEG frame is
+    found.  ``duration`` is ``None`` for a CBR file of unknown size.
+    """
+    start = id3v2_size(data) if offset == 0 else 0
+    i, h = find_first_frame(data, start)
+    if h is None:
+        return None
+    kind, frames, nbytes, encoder = _vbr_header(data, i, h)
+    audio_start = offset + i
+    audio_bytes = nbytes or (file_size - audio_start if file_size else None)
+    if frames:
+        duration = frames * h["samples"] / h["sample_rate"]
+    elif audio_bytes:
+        duration = audio_bytes * 8 / (h["bitrate"] * 1000)
+    else:
+        duration = None
+    bitrate = h["bitrate"]
+    if kind in ("xing", "vbri") and duration and audio_bytes:
+        bitrate = round(audio_bytes * 8 / duration / 1000)
+    return {
+        "duration": round(duration, 3) if duration is not None else None,
+        "bitrate": bitrate,
+        "sample_rate": h["sample_rate"],
+        "channels": h["channels"],
+        "vbr": kind,
+        "encoder": encoder.strip("\x00 ") if encoder else None,
+        "audio_start": audio_start,
+        "file_size": file_size,
+    }
+
+def _total_size(r, data):
+    m = re.search(r"/(\d+)\s*$", r.headers.get("Content-Range", ""))
+    if m:
+        return int(m.group(1))
+    length = r.headers.get("Content-Length", "")
+    return int(length) if r.status_code == 200 and length.isdigit() else None
+
+def _fetch_range(url, start, client, size=PROBE_BYTES):
+    """``(bytes, total file size)`` for ``size`` bytes from ``start``; reads no more
+    than that even when the server ignores the Range header."""
+    r = client.get(url, headers={"Range": f"bytes={start}-{start + size - 1}"}, stream=True)
+    try:
+        r.raise_for_status()
+        data = b""
+        for chunk in r.iter_content(chunk_size=size):
+            data += chunk
+            if len(data) >= size:
+                break
+        metrics.inc("mp3_probe_bytes_total", len(data[:size]))
+        return data[:size], _total_size(r, data)
+    finally:
+        r.close()
+
+def probe_mp3(url, client=None, size=PROBE_BYTES):
+    """Probe one MP3 URL; raises when the file cannot be read or parsed."""
+    client = client or default_client()
+    data, total = _fetch_range(url, 0, client, size)
+    skip = id3v2_size(data)
+    if skip + 4 > len(data):
+        data, total2 = _fetch_range(url, skip, client, size)
+        info = parse_mp3_header(data, total or total2, offset=skip)
+    else:
+        info = parse_mp3_header(data, total)
+    if info is None:
+        raise ValueError("no MPEG audio frame in the first bytes")
+    return info
+
+class Mp3HeaderCache:
+    """Probe results keyed by download attid (or the URL when it has none)."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    @staticmethod
+    def key(url):
+        m = _ATTID_RE.search(url)
+        return m.group(1) if m else url
+
+    def get(self, url):
+        with self._lock:
+            row = self._db.execute("SELECT info FROM mp3_headers WHERE attid = ?", (self.key(url),)).fetchone()
+        return json.loads(row["info"]) if row else None
+
+    def put(self, url, info):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO mp3_headers VALUES (?, ?, ?, ?)",
+                             (self.key(url), url, json.dumps(info), time.time()))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def cached_probe(url, cache=None, client=None):
+    """:func:`probe_mp3` through ``cache``."""
+    info = cache.get(url) if cache else None
+    if info is not None:
+        metrics.inc("mp3_probes_total", result="cached")
+        return info
+    try:
+        info = probe_mp3(url, client)
+    except Exception:
+        metrics.inc("mp3_probes_total", result="error")
+        raise
+    metrics.inc("mp3_probes_total", result="fetched")
+    if cache:
+        cache.put(url, info)
+    return info
+
+def probe_files(files, cache=None, client=None, workers=4):
+    """Annotate ``[{"url", ...}]`` MP3 files with ``duration``/``bitrate``/``sample_rate``.
+
+    Files that cannot be probed are left as they are.
+    """
+    def _one(f):
+        try:
+            info = cached_probe(f["url"], cache, client)
+        except Exception as e:
+            print(f"! mp3 probe {f['url']}: {e}")
+            return f
+        return dict(f, duration=info["duration"], bitrate=info["bitrate"], sample_rate=info["sample_rate"])
+
+    if not files:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(files)))) as ex:
+        return list(ex.map(_one, files))
+
+def choose_file(files, max_bitrate=None):
+    """The file to publish: highest probed bitrate (within ``max_bitrate``), then largest.
+
+    When every probed file exceeds ``max_bitrate`` the lowest bitrate wins;
+    without any probed bitrate this is simply the largest file.
+    """
+    probed = [f for f in files if f.get("bitrate")]
+    capped = [f for f in probed if not max_bitrate or f["bitrate"] <= max_bitrate]
+    if capped:
+        return max(capped, key=lambda f: (f["bitrate"], f.get("file_size") or 0))
+    if probed:
+        return max(probed, key=lambda f: (-f["bitrate"], f.get("file_size") or 0))
+    return max(files, key=lambda f: f.get("file_size") or 0, default=None)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("urls", nargs="+")
+    ap.add_argument("--cache", default=DEFAULT_CACHE_PATH)
+    ap.add_argument("--no-cache", action="store_true")
+    args = ap.parse_args(argv)
+    cache = None if args.no_cache else Mp3HeaderCache(args.cache)
+    try:
+        for url in args.urls:
+            try:
+                info = cached_probe(url, cache, default_client())
+            except Exception as e:
+                info = {"error": str(e)}
+            json.dump({"url": url, **info}, sys.stdout, ensure_ascii=False)
+            print()
+    finally:
+        if cache:
+            cache.close()
+
+if __name__ == "__main__":
+    main()
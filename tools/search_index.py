@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Static search index over every published feed.
+
+Usage:
+    python tools/search_index.py [--public public] [--runs-dir runs] [--catalog]
+
+(``build_all_feeds.py`` runs it after regenerating ``public/index.html``.)
+
+Every book of every ``public/feeds/<run>/podcast.xml`` (all pages) is looked
+up in its run's merged CSV (or the catalog with ``--catalog``), and its
+title, author, narrator and genre are split into tokens after
+:func:`normalize` (Arabic/Persian letter variants, diacritics, ZWNJ and
+digits are unified).  Tokens are grouped by their first ``PREFIX_LENGTH``
+characters into small shards under ``public/search/``:
+
+    meta.json                 normalization table, shard prefix length, feeds
+    docs/<run>.json           the feed's books and a fingerprint of its items
+    shards/<hex prefix>.json  {"tokens": {token: [guid, ...]},
+                               "docs": {guid: [title, author, narrator, genre, [feed paths]]}}
+
+each with a ``.gz`` (and ``.br``) sibling, so ``public/search.html`` answers
+a query by loading one shard per query word.  Feeds whose items did not
+change keep their ``docs/<run>.json``, and only shards whose content changed
+are rewritten, so rebuilding after one feed changed touches only its shards.
+"""
+import argparse, glob, hashlib, json, os, re, unicodedata
+
+try:
+    from tools import csv_to_podcast as feeds
+    from tools.catalog import Catalog, DEFAULT_CATALOG_PATH
+except ImportError:  # executed as ``python tools/search_index.py``
+    import csv_to_podcast as feeds
+    from catalog import Catalog, DEFAULT_CATALOG_PATH
+
+PREFIX_LENGTH = 2
+MIN_TOKEN = 2
+FIELDS = ("Book_Title", "Book_Author", "Book_Narrator", "Book_Genre")
+
+# Applied after NFKC and lower-casing; mirrored by public/search.html via meta.json.
+CHARMAP = {
+    "ي": "ی", "ى": "ی", "ئ": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه",
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ؤ": "و", "\u200c": " ",
+    **{d: str(i) for i, d in enumerate("۰۱۲۳۴۵۶۷۸۹")},
+    **{d: str(i) for i, d in enumerate("٠١٢٣٤٥٦٧٨٩")},
+}
+STRIP = r"[\u064B-\u065F\u0670\u0640]"  # harakat, superscript alef, tatweel
+_STRIP_RE = re.compile(STRIP)
+_TRANSLATE = str.maketrans(CHARMAP)
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+def normalize(text):
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return _STRIP_RE.sub("", text).translate(_TRANSLATE)
+
+def tokens(text):
+    return {t for t in _TOKEN_RE.findall(normalize(text)) if len(t) >= MIN_TOKEN}
+
+def shard_name(prefix):
+    return prefix.encode("utf-8").hex() + ".json"
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+def _write_if_changed(path, text, compress=True):
+    """Write ``path`` (and its compressed siblings) unless it already holds ``text``."""
+    data = text.encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data and (not compress or os.path.exists(path + ".gz")):
+                return False
+    except OSError:
+        pass
+    with feeds.AtomicWriter(path, binary=True) as f:
+        f.write(data)
+    if compress:
+        feeds.precompress(path)
+    return True
+
+def _remove(path):
+    for p in [path] + [path + s for s in feeds.COMPRESSED_SUFFIXES]:
+        if os.path.exists(p):
+            os.unlink(p)
+
+def _fingerprint(index):
+    return hashlib.sha1("".join(f"{g}{e.digest}" for g, e in sorted(index.items())).encode("utf-8")).hexdigest()
+
+def run_rows(run, runs_dir, catalog=None):
+    """The enriched rows of ``run``: its merged CSV, else the catalog, else ``None``."""
+    path = os.path.join(runs_dir, run, "merged", f"books_with_attid_{run}.csv")
+    if os.path.exists(path):
+        return feeds.iter_rows(path)
+    if catalog is not None:
+        return catalog.run_books(run)
+    return None
+
+def feed_docs(run, feed, runs_dir, catalog=None, previous=None):
+    """``(docs, rebuilt)`` for one feed; ``previous`` is its last ``docs/<run>.json``."""
+    index = feeds.index_feed_pages(feed)
+    fingerprint = _fingerprint(index)
+    if previous and previous.get("fingerprint") == fingerprint:
+        return previous, False
+    books = {}
+    rows = run_rows(run, runs_dir, catalog)
+    if rows is None:
+        print(f"! search: no merged CSV or catalog entries for {run}")
+    for row in rows or ():
+        audio = feeds.audio_url(row)
+        guid = feeds.item_guid(audio) if audio else None
+        if guid in index and guid not in books:
+            books[guid] = [feeds.safe_get(row, k) for k in FIELDS]
+            if not books[guid][3]:
+                books[guid][3] = feeds.safe_get(row, "Book_Category")
+    return {"run": run, "fingerprint": fingerprint, "books": books}, True
+
+def build_index(public_dir="public", runs_dir="runs", catalog=None):
+    """(Re)build ``public_dir/search``; returns a dict of counts."""
+    out = os.path.join(public_dir, "search")
+    for sub in ("docs", "shards"):
+        os.makedirs(os.path.join(out, sub), exist_ok=True)
+    runs = sorted(os.path.basename(os.path.dirname(p))
+                  for p in glob.glob(os.path.join(public_dir, "feeds", "*", "podcast.xml")))
+    counts = {"feeds": len(runs), "rebuilt": 0, "shards": 0, "shards_written": 0}
+
+    docs = {}
+    for run in runs:
+        path = os.path.join(out, "docs", run + ".json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            previous = None
+        feed = os.path.join(public_dir, "feeds", run, "podcast.xml")
+        docs[run], rebuilt = feed_docs(run, feed, runs_dir, catalog, previous)
+        counts["rebuilt"] += rebuilt
+        _write_if_changed(path, _dumps(docs[run]), compress=False)
+    for path in glob.glob(os.path.join(out, "docs", "*.json")):
+        if os.path.basename(path)[:-5] not in docs:
+            os.unlink(path)
+
+    shards = {}
+    for run in runs:
+        feed_path = f"feeds/{run}/podcast.xml"
+        for guid, fields in docs[run]["books"].items():
+            for token in set().union(*(tokens(v) for v in fields)):
+                shard = shards.setdefault(token[:PREFIX_LENGTH], {"tokens": {}, "docs": {}})
+                shard["tokens"].setdefault(token, []).append(guid)
+                doc = shard["docs"].setdefault(guid, fields + [[]])
+                if feed_path not in doc[4]:
+                    doc[4].append(feed_path)
+    names = set()
+    for prefix, shard in shards.items():
+        for guids in shard["tokens"].values():
+            guids[:] = sorted(set(guids))
+        name = shard_name(prefix)
+        names.add(name)
+        counts["shards_written"] += _write_if_changed(os.path.join(out, "shards", name), _dumps(shard))
+    for path in glob.glob(os.path.join(out, "shards", "*.json")):
+        if os.path.basename(path) not in names:
+            _remove(path)
+    counts["shards"] = len(names)
+
+    meta = {
+        "version": 1,
+        "prefix_length": PREFIX_LENGTH,
+        "min_token": MIN_TOKEN,
+        "charmap": CHARMAP,
+        "strip": STRIP,
+        "feeds": {run: {"path": f"feeds/{run}/podcast.xml", "books": len(docs[run]["books"])} for run in runs},
+    }
+    _write_if_changed(os.path.join(out, "meta.json"), _dumps(meta))
+    return counts
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--public", default="public")
+    ap.add_argument("--runs-dir", default=os.getenv("RUNS_DIR", "runs"))
+    ap.add_argument("--catalog", nargs="?", const=DEFAULT_CATALOG_PATH,
+                    help="Read books of runs without a merged CSV from the catalog")
+    args = ap.parse_args(argv)
+    catalog = Catalog(args.catalog) if args.catalog else None
+    try:
+        counts = build_index(args.public, args.runs_dir, catalog)
+    finally:
+        if catalog:
+            catalog.close()
+    print("Search index: " + ", ".join(f"{k} {v}" for k, v in counts.items()))
+
+if __name__ == "__main__":
+    main()